@@ -0,0 +1,87 @@
+"""
+Offline bulk load of historical telemetry (CSV or Parquet exports of a site's old metering system).
+
+    cd backend && python -m app.bulk_load --kind ac exports/*.csv \
+        [--map device_id=meter,ts=timestamp,power_w=kw,energy_wh=kwh] [--power-scale 1000] \
+        [--energy-scale 1000] [--device-id X] [--format csv|parquet] [--delimiter ";"] \
+        [--chunk 50000] [--txn-rows 500000] \
+        [--create-devices [--location L]] [--no-rollups] [--db-url URL] [--quiet]
+
+Writes to DB_URL (or --db-url) with executemany on SQLite and COPY on Postgres, builds the
+hourly power sketches as it goes and prints progress (rows/s) per block and a JSON summary
+with per-device kWh at the end. Stop the backend first on SQLite: the loader holds the
+write lock for whole transactions.
+"""
+import argparse
+import json
+import sys
+
+from sqlmodel import SQLModel, create_engine
+
+from .config import get_settings
+from .services.bulk_load import COLUMNS, BulkLoader
+
+
+def _mapping(specs) -> dict:
+    out = {}
+    for spec in specs or ():
+        for part in spec.split(","):
+            target, sep, source = part.partition("=")
+            if not sep or target.strip() not in COLUMNS["ac"]:
+                raise SystemExit(f"--map expects column=source with column in {COLUMNS['ac']}, got {part!r}")
+            out[target.strip()] = source.strip()
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.bulk_load", description=__doc__.split("\n\n")[0].strip())
+    ap.add_argument("paths", nargs="+")
+    ap.add_argument("--kind", choices=sorted(COLUMNS), required=True)
+    ap.add_argument("--format", choices=("csv", "parquet"), help="default: from the file extension")
+    ap.add_argument("--map", action="append", help="column=source[,...]: file column for a telemetry field")
+    ap.add_argument("--device-id", help="all rows belong to this device (file has no device column)")
+    ap.add_argument("--power-scale", type=float, default=1.0, help="multiply power by this (1000 for kW)")
+    ap.add_argument("--energy-scale", type=float, default=1.0, help="multiply energy_wh by this (1000 for kWh)")
+    ap.add_argument("--delimiter", default=",")
+    ap.add_argument("--chunk", type=int, default=50000, help="rows parsed and validated per block")
+    ap.add_argument("--txn-rows", type=int, default=500000, help="rows per transaction")
+    ap.add_argument("--max-power-w", type=float, default=1e6, help="reject readings above this")
+    ap.add_argument("--create-devices", action="store_true", help="add Device rows for unknown device ids")
+    ap.add_argument("--location", help="location of devices created by --create-devices")
+    ap.add_argument("--no-rollups", action="store_true", help="skip the power sketches")
+    ap.add_argument("--db-url", help="default: the backend's DB_URL")
+    ap.add_argument("--quiet", action="store_true")
+    args = ap.parse_args(argv)
+
+    settings = get_settings()
+    if args.db_url:
+        engine = create_engine(args.db_url)
+        SQLModel.metadata.create_all(engine)
+    else:
+        from .db import get_engine, init_db
+        init_db(reset=False)
+        engine = get_engine()
+
+    def progress(stats: dict):
+        if not args.quiet:
+            print(f"[BulkLoad] {stats['file']}: {stats['rows']} rows ({stats['rejected']} rejected), "
+                  f"{stats['rows_per_s']} rows/s", file=sys.stderr)
+
+    loader = BulkLoader(
+        engine, args.kind, mapping=_mapping(args.map), device_id=args.device_id, power_scale=args.power_scale,
+        energy_scale=args.energy_scale, chunk=args.chunk, txn_rows=args.txn_rows, max_power_w=args.max_power_w,
+        rollups=not args.no_rollups, sketch_bucket_s=settings.power_sketch_bucket_sec, progress=progress,
+    )
+    try:
+        summary = loader.load(args.paths, fmt=args.format, delimiter=args.delimiter)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"[BulkLoad] failed after {loader.stats['inserted']} rows: {e}", file=sys.stderr)
+        return 1
+    if args.create_devices:
+        summary["devices_created"] = loader.create_devices(args.location)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,36 @@
 # backend/app/config.py
 from functools import lru_cache
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Optional
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 import os
 
+# Low-footprint defaults for EDGE_PROFILE=true: few, batched fsyncs and bounded memory and disk
+EDGE_DEFAULTS = {
+    "telemetry_batch_ms": 2000,
+    "sqlite_wal": True,
+    "max_devices": 2000,
+    "raw_retention_hours": 72,
+    "raw_retention_max_rows": 2_000_000,
+    "dedup_window": 16,
+    "admission_soft_limit": 200,
+    "admission_hard_limit": 2000,
+    "mail_queue_size": 100,
+    "snapshot_interval_sec": 300,
+    "power_sketch_flush_sec": 300,
+    "webhook_max_attempts": 1000,  # alerts wait out long link outages in the outbox
+    "whatif_workers": 1,
+    "ingest_compression": "swinging_door",
+}
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
     app_env: str = "dev"
     api_port: int = 8000
+    startup_budget_ms: int = 30000  # import-to-ready target; exceeding it is logged and shown on /readyz
+    admin_token: Optional[str] = None  # X-Admin-Token for /debug/profile/*; unset = disabled
 
     # MQTT ...
     mqtt_host: str = "d85467e9b3be4d9390f52e2a6c740aa6.s1.eu.hivemq.cloud"
@@ -22,6 +43,15 @@ class Settings(BaseSettings):
     mqtt_ws_path: str = "/mqtt"
     mqtt_keepalive: int = 60
     mqtt_client_id: str = "spo-backend-raspi4b-1"
+    mqtt_capture_path: Optional[str] = None  # record raw MQTT traffic here from startup (see bench/replay.py)
+    mqtt_capture_dir: str = "./data/captures"  # POST /debug/capture writes here (bare file names only)
+    # Switch commands: QoS, device acks on .../{ch}/ack or .../{ch}/state, retries
+    switch_qos: int = 1
+    switch_command_json: bool = False  # publish {"state","cid"} instead of plain ON/OFF (firmware must echo cid)
+    switch_ack_timeout_sec: float = 10.0
+    switch_max_retries: int = 2
+    switch_require_ack: bool = False  # close alerts only once the switch confirms OFF
+    switch_ack_wait_sec: float = 3.0  # how long shutdown requests wait for that confirmation
 
     # DB (default local SQLite)
     db_url: str = "sqlite:///./data/app.db"
@@ -38,13 +68,87 @@ class Settings(BaseSettings):
     smtp_use_tls: bool = True
     alerts_from: Optional[str] = None
     alerts_to: Optional[str] = None
+    # Queued delivery: pooled SMTP connections, rate limit, retries, optional digests
+    mail_workers: int = 2  # 0 = legacy one-thread-per-alert sending
+    mail_queue_size: int = 1000
+    mail_rate_per_min: float = 60.0
+    mail_max_retries: int = 5
+    mail_digest_sec: int = 0  # >0: group alert mails per recipient into one email per interval
+
+    # Webhook notifications (outbox-backed, async delivery)
+    webhook_urls: Optional[str] = None  # comma-separated endpoints; unset = disabled
+    webhook_token: Optional[str] = None  # sent as "Authorization: Bearer <token>"
+    webhook_batch_size: int = 50  # events per POST
+    webhook_concurrency: int = 4  # in-flight requests per endpoint
+    webhook_max_attempts: int = 8
 
     idle_power_threshold_w: float = 10.0
     idle_duration_sec: int = 300
+    idle_window_sec: float = 60.0  # moving-average horizon for idle detection
+    offline_after_sec: int = 600  # last-seen timeout before a device is flagged offline (0 = off)
+    device_state_ttl_sec: int = 24 * 3600  # drop in-memory state of devices silent this long (0 = never)
+    # Admission control: priority lanes between MQTT/HTTP ingest and the DB
+    admission_control: bool = True  # false = handle MQTT messages inline on the network thread
+    admission_soft_limit: int = 2000  # queued telemetry before coalescing to the latest sample per device
+    admission_hard_limit: int = 20000  # queued telemetry before dropping samples of devices not yet queued
+    admission_target_wait_ms: int = 2000  # queue wait that also counts as overload
+    admission_http_slots: int = 4  # concurrent HTTP telemetry posts; more get 503 + Retry-After
+    backfill_live_cutoff_sec: int = 120  # backfilled samples older than this skip idle/anomaly alerting
+    backfill_batch_size: int = 5000  # rows per multi-row INSERT
+    dedup_window: int = 64  # per-device (seq or device ts) keys remembered to drop redeliveries (0 = off)
+
+    # Live state shared by all workers (latest values, rolling/idle windows); unset = per process only
+    shared_state_path: Optional[str] = None  # e.g. /dev/shm/spo-live.bin
+    shared_state_capacity: int = 16384  # device records in the file
+
+    # Warm start: periodic snapshot of in-memory analytics state
+    snapshot_path: str = "./data/state.npz"
+    snapshot_interval_sec: int = 60  # 0 = only on clean shutdown
+
+    # Streaming anomaly detection (spikes, drift, stuck-on loads)
+    anomaly_detection: bool = True
+    anomaly_z_spike: float = 6.0
+    anomaly_stuck_on_min_w: float = 50.0
+    anomaly_stuck_on_sec: int = 8 * 3600
+
+    # Power percentiles: quantile sketches per device and time bucket, persisted to power_sketch
+    power_sketch_bucket_sec: int = 3600  # bucket width; queries resolve to whole buckets
+    power_sketch_flush_sec: int = 60  # how often new samples are merged into the table (0 = off)
+
+    # Ingest compression of stored raw telemetry (analytics still see every sample): off | deadband | swinging_door
+    ingest_compression: str = "off"
+    compression_tolerance_w: float = 1.0  # stored signal stays within 2x this of every sample (per device: PATCH config)
+    compression_max_gap_sec: int = 300  # store a sample at least this often per device
+
+    whatif_workers: int = 0  # processes for idle-threshold what-if runs (0 = CPUs - 1)
+
+    # Edge gateway (Raspberry Pi on an SD card): EDGE_PROFILE=true switches the defaults in EDGE_DEFAULTS
+    edge_profile: bool = False
+    telemetry_batch_ms: int = 0  # >0: group-commit live telemetry every interval instead of per sample
+    telemetry_batch_max_rows: int = 5000  # write buffer cap; a full buffer flushes early
+    sqlite_wal: bool = False  # WAL + synchronous=NORMAL: fsync at checkpoints, not per commit
+    max_devices: int = 0  # in-memory device cap; the least recently seen is evicted (0 = no cap)
+    raw_retention_hours: int = 0  # drop raw telemetry older than this (0 = keep)
+    raw_retention_max_rows: int = 0  # per telemetry table, oldest rows first (0 = no cap)
+    edge_site_id: Optional[str] = None  # name of this site at the central instance (default: MQTT client id)
+    edge_sync_url: Optional[str] = None  # central base URL, e.g. https://spo.example.com; unset = no forwarding
+    edge_sync_token: Optional[str] = None  # sent as "Authorization: Bearer <token>"
+    edge_sync_interval_sec: int = 60
+    edge_sync_batch: int = 500  # rollup rows per upload
+    # Central side: accept uploads on /edge/* with this token (unset = disabled)
+    edge_ingest_token: Optional[str] = None
 
     tariff_usd_per_kwh: float = 0.20
     co2_kg_per_kwh: float = 0.40
 
+    @model_validator(mode="after")
+    def _apply_edge_profile(self):
+        if self.edge_profile:
+            for name, value in EDGE_DEFAULTS.items():
+                if name not in self.model_fields_set:  # explicit env/.env values still win
+                    setattr(self, name, value)
+        return self
+
     @property
     def resolved_db_url(self) -> str:
         """
@@ -1,26 +1,62 @@
 # backend/app/db.py
 import os
+from sqlalchemy import event, inspect, text
 from sqlmodel import SQLModel, create_engine
 from .config import get_settings
 
 settings = get_settings()
 db_url = settings.resolved_db_url
 
-# Create ./data only for local sqlite path
-if db_url.startswith("sqlite:///./"):
-    os.makedirs("./data", exist_ok=True)
+_engine = None
 
-engine = create_engine(
-    db_url,
-    echo=False,
-    pool_pre_ping=True,  # good hygiene on Postgres
-)
+def get_engine():
+    """The process-wide engine, created on first use (not at import, so forked workers each build their own)."""
+    global _engine
+    if _engine is None:
+        # Create ./data only for local sqlite path
+        if db_url.startswith("sqlite:///./"):
+            os.makedirs("./data", exist_ok=True)
+        _engine = create_engine(
+            db_url,
+            echo=False,
+            pool_pre_ping=True,  # good hygiene on Postgres
+        )
+        if db_url.startswith("sqlite") and settings.sqlite_wal:
+            event.listen(_engine, "connect", _sqlite_wal)
+    return _engine
+
+def _sqlite_wal(dbapi_conn, _record):
+    # WAL + NORMAL: commits append to the log without an fsync; the log is synced at checkpoints
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA wal_autocheckpoint=4000")  # pages (~16 MB) between checkpoints
+    cur.close()
+
+def __getattr__(name):
+    # `from .db import engine` keeps working; it just builds the engine at that point
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(name)
 
 def init_db(reset: bool = False):
     from . import models  # import models before touching metadata
+    engine = get_engine()
     # Only auto-drop for local SQLite if explicitly asked
     if reset and db_url.startswith("sqlite"):
         SQLModel.metadata.drop_all(engine)
         print("[DB] Dropped all tables for clean reset.")
     SQLModel.metadata.create_all(engine)
+    # create_all skips tables that already exist, so add nullable columns and indexes declared on them later
+    insp = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in have and col.nullable:
+                ddl = col.type.compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {ddl}'))
+                print(f"[DB] Added column {table.name}.{col.name}")
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
     print("[DB] Created/ensured all tables.")
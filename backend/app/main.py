@@ -1,179 +1,904 @@
 # backend/app/main.py
+from time import perf_counter
+_t_import = perf_counter()  # restart-to-ready is measured from here
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from datetime import datetime
+from datetime import datetime, timezone
 from sqlmodel import Session, select
 import threading
+import numpy as np
 from .config import get_settings
-from .db import init_db, engine
+from .db import init_db, get_engine
 from .models import Device, TelemetryDC, TelemetryAC, Alert
 from .services.mailer import Mailer
+from .services.mail_queue import MailQueue
+from .services.notifier import NotificationDispatcher, WebhookSink
 from .services.mqtt_bridge import MQTTBridge
 from .services.idle_detector import IdleDetector
 from .services.rolling_stats import RollingStats
-from .routers import health, devices, telementry, ac_telemetry, alerts, reports, debug, agent
+from .services.device_state import DeviceStateStore, LatestPayloads, KIND_DC, KIND_AC
+from .services.deadline_scheduler import DeadlineScheduler
+from .services.anomaly_detector import AnomalyDetector
+from .services.state_snapshot import StateSnapshotter
+from .services.alert_index import OpenAlertIndex, ACTIONABLE, PENDING
+from .services.switch_commands import SwitchCommander
+from .services.clock import Clock
+from .services.capture import TrafficRecorder
+from .services.lifecycle import Readiness, ReadinessGate
+from .services.shared_state import SharedLiveState
+from .services.fleet_summary import FleetSummary
+from .services.dedup import SampleDeduper
+from .services.backfill import BackfillWriter
+from .services.admission import AdmissionController, NORMAL, COALESCING, SHEDDING
+from .services.whatif import WhatIfJobs
+from .services.power_sketch import PowerSketches
+from .services.telemetry_writer import TelemetryWriter
+from .services.retention import RawRetention
+from .services.edge_sync import RollupForwarder
+from .services.device_index import RuntimeIndex
+from .services.compression import IngestCompressor
+from .services.metrics import (
+    REGISTRY, MetricsMiddleware, INGEST_SAMPLES, INGEST_STORED, INGEST_DUPLICATES, INGEST_LAG, DEVICE_INGEST_LAG, ALERTS,
+    BACKFILL_SAMPLES, STAGE_BACKFILL_DB, STAGE_DB_INSERT, STAGE_DB_COMMIT, STAGE_ROLLING, STAGE_IDLE, STAGE_ANOMALY, STAGE_ALERT, STAGE_LIVE_STATE,
+)
+from .routers import health, devices, telementry, ac_telemetry, alerts, reports, debug, agent, profiling, fleet, simulations, edge
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="Smart Power Optimizer (Backend)")
-# Add this RIGHT AFTER creating the app
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins during development
-    allow_credentials=True,
-    allow_methods=["*"],  # Allow all HTTP methods
-    allow_headers=["*"],  # Allow all headers
-)
 settings = get_settings()
+clock = Clock()  # every service reads "now" from here, so replays can run in virtual time
 mailer = Mailer()
+mail_queue = MailQueue(
+    mailer,
+    workers=settings.mail_workers,
+    maxsize=settings.mail_queue_size,
+    rate_per_min=settings.mail_rate_per_min,
+    max_retries=settings.mail_max_retries,
+    digest_s=settings.mail_digest_sec,
+) if settings.mail_workers > 0 else None
+mailer.queue = mail_queue
+# Built by _init_services() during warm-up: they hold the DB engine, an HTTP pool, a TLS MQTT client or a mapped file
+engine = None
+notifier = None
+switch_commands = None
+mqtt = None
+backfill = None
+whatif = None
+power_sketches = None
+telemetry_writer = None  # TelemetryWriter when TELEMETRY_BATCH_MS > 0 (group commit instead of one per sample)
+retention = None
+edge_sync = None  # RollupForwarder when EDGE_SYNC_URL is set
+live = None  # SharedLiveState when SHARED_STATE_PATH is set: what other workers read for this process's devices
 
 
 # -------- In-memory stores / services --------
-latest_dc = {}  # device_id -> last DC payload
-latest_ac = {}  # device_id -> last AC payload
-rolling = RollingStats()
+store = DeviceStateStore(clock=clock)  # device_id -> slot; owns all per-device runtime arrays below
+latest_dc = LatestPayloads(store, KIND_DC)  # device_id -> last DC payload
+latest_ac = LatestPayloads(store, KIND_AC)  # device_id -> last AC payload
+rolling = RollingStats(store, clock=clock)
 detector = IdleDetector(
     default_threshold_w=settings.idle_power_threshold_w,
     default_duration_s=settings.idle_duration_sec,
-    window=1,
+    window_s=settings.idle_window_sec,
+    store=store,
+    clock=clock,
+)
+anomalies = AnomalyDetector(
+    z_spike=settings.anomaly_z_spike,
+    stuck_on_min_w=settings.anomaly_stuck_on_min_w,
+    stuck_on_sec=settings.anomaly_stuck_on_sec,
+    store=store,
+    clock=clock,
+) if settings.anomaly_detection else None
+admission = AdmissionController(
+    soft_limit=settings.admission_soft_limit,
+    hard_limit=settings.admission_hard_limit,
+    target_wait_s=settings.admission_target_wait_ms / 1000,
+    http_slots=settings.admission_http_slots,
+) if settings.admission_control else None
+deduper = SampleDeduper(store, window=settings.dedup_window) if settings.dedup_window > 0 else None
+compressor = IngestCompressor(  # which live samples get a telemetry row; analytics see them all
+    store,
+    mode=settings.ingest_compression,
+    tolerance_w=settings.compression_tolerance_w,
+    max_gap_s=settings.compression_max_gap_sec,
+)
+alert_index = OpenAlertIndex()  # device_id -> {reason: alert_id} of actionable alerts
+fleet_summary = FleetSummary()  # running totals + top/bottom-N for GET /fleet/summary
+runtime_index = RuntimeIndex()  # idle set + power bands for GET /devices filters
+offline_devices = set()  # device_ids whose last-seen timeout fired (dropped on eviction)
+ingest_lag: dict = {}  # device_id -> seconds from device timestamp to persisted, last sample
+scheduler = DeadlineScheduler(on_fire=lambda kind, device_id, due: _on_deadline(kind, device_id, due), clock=clock)
+snapshotter = StateSnapshotter(
+    store,
+    path=settings.snapshot_path,
+    interval_s=settings.snapshot_interval_sec,
+    extra=lambda: {"offline": np.array(sorted(offline_devices), dtype=str)},
 )
 
 # -------- Helpers --------
+def _payload_ts(payload: dict) -> float | None:
+    """Device timestamp as epoch seconds (accepts epoch s/ms or ISO-8601), None if absent/invalid."""
+    raw = payload.get("ts")
+    if raw is None or raw == "":
+        return None
+    try:
+        if isinstance(raw, (int, float)):
+            t = float(raw)
+            return t / 1000.0 if t > 1e11 else t  # epoch ms from some firmwares
+        dt = datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)  # naive timestamps are UTC throughout this app
+        return dt.timestamp()
+    except (TypeError, ValueError):
+        return None
+
 def _apply_device_overrides_from_db():
+    now = clock()
     with Session(engine) as s:
-        for d in s.exec(select(Device)).all():
-            detector.set_overrides(d.device_id, d.idle_threshold_w, d.idle_duration_sec)
+        # Plain column tuples: no ORM objects to build for the whole fleet
+        rows = s.exec(select(Device.device_id, Device.idle_threshold_w, Device.idle_duration_sec,
+                             Device.last_seen_at, Device.location,
+                             Device.compression, Device.compression_tolerance_w)).all()
+    for device_id, th, du, last_seen_at, location, cmode, ctol in rows:
+        detector.set_overrides(device_id, th, du)
+        if cmode is not None or ctol is not None:
+            try:
+                compressor.set_overrides(device_id, cmode, ctol)
+            except ValueError as e:
+                print(f"[Compression] ignoring config of {device_id}: {e}")
+        fleet_summary.set_location(device_id, location)
+        # Seed last-seen timers so devices that never report again after a restart still go offline
+        if last_seen_at and settings.offline_after_sec > 0 and device_id not in store:
+            seen = last_seen_at.replace(tzinfo=timezone.utc).timestamp()
+            scheduler.schedule(device_id, "offline", max(seen + settings.offline_after_sec, now))
 
-def _raise_alert(device_id: str, power_w: float):
-    # Create alert and send an email (fire-and-forget thread)
+def _raise_alert(device_id: str, power_w: float, reason: str = "idle_detected",
+                 threshold_w: float | None = None, duration_s: int | None = None):
+    # Create alert (+ webhook outbox rows in the same transaction) and send an email (fire-and-forget).
+    # For anomaly reasons power_w is the offending reading and threshold_w the expected value.
+    t0 = perf_counter()
+    th, du = detector._cfg(device_id)
+    th = th if threshold_w is None else threshold_w
+    du = du if duration_s is None else duration_s
     with Session(engine) as s:
-        th, du = detector._cfg(device_id)
         a = Alert(
             device_id=device_id,
+            reason=reason,
             threshold_w=th,
             duration_s=du,
             status="open",
+            ts_open=datetime.utcfromtimestamp(clock()),
         )
         s.add(a)
+        s.flush()  # assigns a.id for the event payload
+        notifier.enqueue(s, "alert.created", {
+            "alert_id": a.id, "device_id": device_id, "reason": reason,
+            "value": power_w, "threshold_w": th, "duration_s": du, "ts_open": a.ts_open,
+        })
         s.commit()
         s.refresh(a)  # ensure a.id is populated
+        alert_index.confirm(device_id, reason, a.id)
         d = s.exec(select(Device).where(Device.device_id == device_id)).first()
+    notifier.wake()
+    STAGE_ALERT.since(t0)
+    ALERTS.labels(reason).inc()
 
     def _send_email():
         try:
-            mailer.send_alert_created(
-                device_id=device_id,
-                device_name=d.name if d else device_id,
-                power_w=power_w or 0.0,
-                threshold_w=th,
-                duration_s=du,
-                alert_id=a.id,
-            )
+            if reason == "device_offline":
+                mailer.send_device_offline(
+                    device_id=device_id,
+                    device_name=d.name if d else device_id,
+                    offline_after_s=du,
+                    alert_id=a.id,
+                )
+            elif reason != "idle_detected":
+                mailer.send_anomaly(
+                    device_id=device_id,
+                    device_name=d.name if d else device_id,
+                    reason=reason,
+                    value=power_w,
+                    expected=th,
+                    alert_id=a.id,
+                )
+            else:
+                mailer.send_alert_created(
+                    device_id=device_id,
+                    device_name=d.name if d else device_id,
+                    power_w=power_w or 0.0,
+                    threshold_w=th,
+                    duration_s=du,
+                    alert_id=a.id,
+                )
         except Exception as e:
             print("[MAIL] Error:", e)
 
-    # start the email thread OUTSIDE the function body
-    threading.Thread(target=_send_email, daemon=True).start()
+    if not mailer.enabled:
+        return
+    if mailer.queue is not None:
+        _send_email()  # only composes and enqueues; pooled workers do the SMTP
+    else:
+        threading.Thread(target=_send_email, daemon=True).start()
 
-def _handle_idle(device_id: str, power_w: float):
-    if detector.add(device_id, float(power_w or 0)):
-        print(f"[IdleDetector] sustained idle: {device_id} → creating alert if none open")
-        with Session(engine) as s:
-            existing = s.exec(
-                select(Alert).where(
-                    Alert.device_id == device_id,
-                    Alert.status.in_(("open", "snoozed", "ack")),
-                    )
-            ).first()
-        if not existing:
-            _raise_alert(device_id, power_w)
+def _on_control(fn, *args):
+    """Alert open/close writes go on the admission control lane, ahead of queued telemetry (inline without it)."""
+    if admission is not None and admission.running:
+        admission.submit("control", fn, *args)
+    else:
+        fn(*args)
+
+def _alert_if_none_open(device_id: str, power_w: float, reason: str = "idle_detected", **alert_kw):
+    # Dict lookup + atomic reserve; no query per sample once a device sits past its deadline
+    if not alert_index.claim(device_id, reason):
+        return
+    _on_control(_raise_claimed, device_id, power_w, reason, alert_kw)
+
+def _raise_claimed(device_id: str, power_w: float, reason: str, alert_kw: dict):
+    try:
+        _raise_alert(device_id, power_w, reason, **alert_kw)
+    except Exception:
+        alert_index.release(device_id, reason)
+        raise
+
+def _load_open_alerts() -> int:
+    with Session(engine) as s:
+        # Alerts mirrored from edge sites are closed by their site's events, not by this instance
+        rows = s.exec(select(Alert.id, Alert.device_id, Alert.reason)
+                      .where(Alert.status.in_(ACTIONABLE), Alert.site.is_(None))).all()
+    return alert_index.load(rows)
+
+def _handle_idle(device_id: str, power_w: float, ts: float | None = None):
+    t0 = perf_counter()
+    fired = detector.add(device_id, float(power_w or 0), ts=ts)
+    STAGE_IDLE.since(t0)
+    if fired:
+        _alert_if_none_open(device_id, power_w)
+
+_KIND_NAMES = {KIND_DC: "dc", KIND_AC: "ac"}
+
+def _update_fleet(device_id: str, kind: int, power_w: float):
+    avg_5m = rolling._avg_since(device_id, 300)
+    fleet_summary.update(device_id, _KIND_NAMES[kind], power_w, avg_5m,
+                         detector.idle_remaining(device_id) is not None)
+    # Same rule as the `idle` column of GET /devices, so ?idle= filters agree with the rows
+    th, _ = detector._cfg(device_id)
+    runtime_index.update(device_id, power_w, (avg_5m if avg_5m is not None else power_w) < (th or 0.0))
+
+def _handle_anomalies(device_id: str, payload: dict, ts: float | None = None):
+    if anomalies is None:
+        return
+    t0 = perf_counter()
+    found = anomalies.update(device_id, payload, ts)
+    STAGE_ANOMALY.since(t0)
+    for reason, value, expected in found:
+        du = settings.anomaly_stuck_on_sec if reason == "stuck_on" else 0
+        _alert_if_none_open(device_id, value, reason, threshold_w=expected, duration_s=du)
+
+def _track_deadlines(device_id: str, admitted: bool = False):
+    """Re-arm the idle deadline and last-seen timeout after a sample (O(1) unless a deadline moves earlier)."""
+    now = clock()
+    # A freshly (re)admitted device may have been evicted while an offline alert was still open
+    if admitted or device_id in offline_devices:
+        _mark_online(device_id)
+    if settings.offline_after_sec > 0:
+        scheduler.schedule(device_id, "offline", now + settings.offline_after_sec)
+    if settings.device_state_ttl_sec > 0:
+        scheduler.schedule(device_id, "evict", now + settings.device_state_ttl_sec)
+    remaining = detector.idle_remaining(device_id)
+    if remaining is not None and remaining > 0:
+        scheduler.schedule(device_id, "idle", now + remaining)
+    else:
+        # Not idle, or already past the deadline (the sample path raised the alert itself)
+        scheduler.cancel(device_id, "idle")
+
+def _last_power(device_id: str) -> float:
+    k = store.get(device_id)
+    return float(store.power_w[k]) if k is not None else 0.0
+
+def _evict(device_id: str):
+    """Forget all runtime state of a device that has been silent longer than the TTL."""
+    _store_rows(device_id, compressor.drain(device_id))
+    store.evict(device_id)
+    fleet_summary.remove(device_id)
+    runtime_index.remove(device_id)
+    ingest_lag.pop(device_id, None)
+    scheduler.cancel(device_id, "idle")
+    scheduler.cancel(device_id, "offline")
+    offline_devices.discard(device_id)
+
+def _make_room(device_id: str):
+    """MAX_DEVICES: evict the least recently seen device before a new one gets state."""
+    if settings.max_devices <= 0 or device_id in store or len(store) < settings.max_devices:
+        return
+    victim = store.least_recent()
+    if victim is not None:
+        print(f"[State] device cap {settings.max_devices} reached, evicting {victim}")
+        _evict(victim)
+
+def _mark_online(device_id: str):
+    offline_devices.discard(device_id)
+    if alert_index.has(device_id, "device_offline"):
+        _on_control(_close_offline_alert, device_id)  # queued after the alert's creation, if that is pending
+
+def _close_offline_alert(device_id: str):
+    alert_id = alert_index.get(device_id, "device_offline")
+    if alert_id is None or alert_id == PENDING:
+        return
+    with Session(engine) as s:
+        a = s.get(Alert, alert_id)
+        if a and a.status in ACTIONABLE:
+            a.status = "closed"
+            a.ts_close = datetime.utcfromtimestamp(clock())
+            s.add(a)
+            notifier.enqueue(s, "alert.closed", {  # same transaction as the close (outbox)
+                "alert_id": alert_id, "device_id": device_id, "reason": "device_offline",
+                "ts_close": a.ts_close,
+            })
+            s.commit()
+    alert_index.release(device_id, "device_offline", alert_id)
+    notifier.wake()
+
+def _on_deadline(kind: str, device_id: str, due: float):
+    if kind == "idle":
+        # Still below threshold with no newer sample to say otherwise
+        if detector.idle_remaining(device_id) is not None:
+            _alert_if_none_open(device_id, _last_power(device_id))
+    elif kind == "offline":
+        _store_rows(device_id, compressor.drain(device_id))  # close the segment at the last sample
+        offline_devices.add(device_id)
+        fleet_summary.set_offline(device_id)
+        _alert_if_none_open(device_id, 0.0, reason="device_offline",
+                            threshold_w=0.0, duration_s=settings.offline_after_sec)
+    elif kind == "evict":
+        _evict(device_id)
+    elif kind == "switch_ack":
+        switch_commands.on_timeout(device_id)  # keyed by command id
+
+def _on_command_settled(cmd):
+    # In ack mode an alert is closed by the switch confirming OFF, not by the request that asked for it
+    if not (switch_commands.require_ack and cmd.alert_id and cmd.status in ("acked", "coalesced")):
+        return
+    with Session(engine) as s:
+        a = s.get(Alert, cmd.alert_id)
+        if not a or a.status not in ACTIONABLE:
+            return
+        reason = a.reason
+        a.status = "closed"
+        a.ts_close = datetime.utcfromtimestamp(clock())
+        s.add(a)
+        notifier.enqueue(s, "alert.closed", {
+            "alert_id": cmd.alert_id, "device_id": cmd.device_id, "reason": reason,
+            "action": "OFF", "command_id": cmd.id,
+        })
+        s.commit()
+    alert_index.release(cmd.device_id, reason, cmd.alert_id)
+    notifier.wake()
 
 # -------- Ingest callbacks --------
-def _on_dc(device_id: str, payload: dict):
-    print("DC IN:", device_id, payload)
-    latest_dc[device_id] = payload
-    v = float(payload.get("v") or 0)
-    i = float(payload.get("i") or 0)
-    p = float(payload.get("p") or 0)
-    ts = datetime.utcnow()
+_INGESTED = {KIND_DC: INGEST_SAMPLES.labels("dc"), KIND_AC: INGEST_SAMPLES.labels("ac")}
+_DUPLICATES = {KIND_DC: INGEST_DUPLICATES.labels("dc"), KIND_AC: INGEST_DUPLICATES.labels("ac")}
+
+def _sample_key(payload: dict) -> float | None:
+    """Idempotency key of a sample: the device's sequence number if it sends one, else its timestamp."""
+    seq = payload.get("seq")
+    if seq is not None:
+        try:
+            return float(seq)
+        except (TypeError, ValueError):
+            pass
+    return _payload_ts(payload)
+
+def _persist(device_id: str, payload: dict, rows: list):
+    """_store_rows for a live sample; a failed write releases its dedup key so a retry isn't dropped."""
+    try:
+        _store_rows(device_id, rows)
+    except Exception:
+        if deduper is not None:
+            deduper.release(device_id, _sample_key(payload))
+        raise
+
+def _is_duplicate(device_id: str, kind: int, payload: dict) -> bool:
+    if deduper is None or not deduper.seen(device_id, _sample_key(payload)):
+        return False
+    _DUPLICATES[kind].inc()  # counted, not logged: redelivery storms would flood stdout
+    return True
+
+def _publish_live(device_id: str, kind: int, payload: dict):
+    if live is None:
+        return
+    t0 = perf_counter()
+    k = store.get(device_id)
+    if k is not None:
+        live.write(device_id, kind, payload, float(store.last_seen[k]),
+                   ring=rolling.ring(device_id), idle=detector.window_state(device_id))
+    STAGE_LIVE_STATE.since(t0)
+
+_TELEMETRY_TABLES = {KIND_DC: TelemetryDC, KIND_AC: TelemetryAC}
+_STORED = {KIND_DC: INGEST_STORED.labels("dc"), KIND_AC: INGEST_STORED.labels("ac")}
+
+def _store_rows(device_id: str, rows: list):
+    """Write the (kind, row) pairs the compressor let through; the Device hints follow the newest one."""
+    if not rows or engine is None:
+        return
+    for kind, _ in rows:
+        _STORED[kind].inc()
+    if telemetry_writer is not None:
+        for kind, row in rows:
+            telemetry_writer.add(kind, row)
+        return
+    t0 = perf_counter()
     with Session(engine) as s:
-        s.add(TelemetryDC(device_id=device_id, voltage_v=v, current_a=i, power_w=p, ts=ts))
+        for kind, row in rows:
+            s.add(_TELEMETRY_TABLES[kind](**row))
         d = s.exec(select(Device).where(Device.device_id == device_id)).first()
         if d:
-            d.last_seen_at = ts
-            d.current_power_w = p
+            d.last_seen_at = rows[-1][1]["ts"]
+            d.current_power_w = rows[-1][1]["power_w"]
             s.add(d)
+        t1 = perf_counter()
         s.commit()
-    rolling.add(device_id, p)
-    _handle_idle(device_id, p)
+    STAGE_DB_INSERT.observe(t1 - t0)
+    STAGE_DB_COMMIT.since(t1)
+
+def _record_persisted(device_id: str, kind: int, device_ts: float | None):
+    _INGESTED[kind].inc()
+    if device_ts is not None:
+        lag = clock() - device_ts
+        INGEST_LAG.observe(lag)
+        ingest_lag[device_id] = lag
+
+def _analyze(device_id: str, kind: int, payload: dict, p: float, device_ts: float | None, admitted: bool,
+             rolling_ts: float | None = None):
+    """Everything after a sample is persisted: rollups, idle/anomaly alerts, fleet views, deadlines."""
+    t0 = perf_counter()
+    rolling.add(device_id, p, rolling_ts)
+    if power_sketches is not None:
+        power_sketches.add(device_id, p, rolling_ts)
+    STAGE_ROLLING.since(t0)
+    _handle_idle(device_id, p, device_ts)
+    _handle_anomalies(device_id, payload, device_ts)
+    _update_fleet(device_id, kind, p)
+    _publish_live(device_id, kind, payload)
+    _track_deadlines(device_id, admitted)
+
+def _on_dc(device_id: str, payload: dict):
+    v = float(payload.get("v") or 0)
+    i = float(payload.get("i") or 0)
+    p = float(payload.get("p") or 0)
+    _make_room(device_id)
+    admitted = device_id not in store  # before the dedup check, which claims the slot
+    if _is_duplicate(device_id, KIND_DC, payload):
+        return
+    store.touch(device_id, KIND_DC, payload, p)
+    now = clock()
+    row = {"device_id": device_id, "voltage_v": v, "current_a": i, "power_w": p,
+           "ts": datetime.utcfromtimestamp(now)}
+    _persist(device_id, payload, compressor.offer(device_id, KIND_DC, now, p, row))
+    device_ts = _payload_ts(payload)
+    _record_persisted(device_id, KIND_DC, device_ts)
+    _analyze(device_id, KIND_DC, payload, p, device_ts, admitted)
 
 def _on_ac(device_id: str, payload: dict):
-    print("AC IN:", device_id, payload)
-    latest_ac[device_id] = payload
     v  = float(payload.get("v") or 0)
     i  = float(payload.get("i") or 0)
     p  = float(payload.get("p") or 0)
+    _make_room(device_id)
+    admitted = device_id not in store  # before the dedup check, which claims the slot
+    if _is_duplicate(device_id, KIND_AC, payload):
+        return
+    store.touch(device_id, KIND_AC, payload, p)
     pf = payload.get("pf"); pf = float(pf) if pf is not None else None
     f  = payload.get("f");  f  = float(f)  if f  is not None else None
     e  = payload.get("e_wh"); e = float(e) if e is not None else None
-    ts = datetime.utcnow()
-    with Session(engine) as s:
-        s.add(TelemetryAC(device_id=device_id, voltage_v=v, current_a=i,
-                          power_w=p, pf=pf, frequency_hz=f, energy_wh=e, ts=ts))
-        d = s.exec(select(Device).where(Device.device_id == device_id)).first()
-        if d:
-            d.last_seen_at = ts
-            d.current_power_w = p
-            s.add(d)
-        s.commit()
-    rolling.add(device_id, p)
-    _handle_idle(device_id, p)
-
-# -------- Single MQTT bridge (HiveMQ-ready) --------
-mqtt = MQTTBridge(
-    host=settings.mqtt_host,
-    port=settings.mqtt_port,
-    base=settings.mqtt_base,
-    on_dc_measure=_on_dc,
-    on_ac_measure=_on_ac,
-    username=settings.mqtt_username,
-    password=settings.mqtt_password,
-    use_tls=settings.mqtt_tls,
-    use_ws=settings.mqtt_ws,
-    ws_path=settings.mqtt_ws_path,
-    keepalive=settings.mqtt_keepalive,
-    client_id=settings.mqtt_client_id,
-)
+    now = clock()
+    row = {"device_id": device_id, "voltage_v": v, "current_a": i, "power_w": p,
+           "pf": pf, "frequency_hz": f, "energy_wh": e, "ts": datetime.utcfromtimestamp(now)}
+    _persist(device_id, payload, compressor.offer(device_id, KIND_AC, now, p, row))
+    device_ts = _payload_ts(payload)
+    _record_persisted(device_id, KIND_AC, device_ts)
+    _analyze(device_id, KIND_AC, payload, p, device_ts, admitted)
+
+_BACKFILL_KINDS = {"dc": KIND_DC, "ac": KIND_AC}
+
+def _on_backfill(device_id: str, kind: str, samples: list) -> dict:
+    """
+    Samples a device buffered while offline, uploaded in one go after it reconnects.
+
+    All are stored with their device timestamps in bulk. Those newer than
+    BACKFILL_LIVE_CUTOFF_SEC then run through the live analytics in time order (they can
+    still raise alerts); older ones only fill the rolling-average and power-sketch buckets
+    they fall in.
+    """
+    k = _BACKFILL_KINDS.get(kind)
+    if k is None:
+        raise ValueError(f"kind must be one of {sorted(_BACKFILL_KINDS)}")
+    _make_room(device_id)
+    parsed = []
+    for payload in samples:
+        ts = _payload_ts(payload) if isinstance(payload, dict) else None
+        if ts is not None:
+            parsed.append((ts, payload))
+    parsed.sort(key=lambda x: x[0])
+    fresh, db_s = backfill.write(k, device_id, parsed)
+    STAGE_BACKFILL_DB.observe(db_s)
+    result = {"received": len(samples), "inserted": len(fresh), "duplicates": len(parsed) - len(fresh),
+              "rejected": len(samples) - len(parsed), "live": 0}
+    now = clock()
+    live_from = now - settings.backfill_live_cutoff_sec
+    rollup_from = now - (rolling.n_buckets - 1) * rolling.bucket_s
+    for ts, payload in fresh:
+        p = float(payload.get("p") or 0)
+        if ts < live_from:
+            if power_sketches is not None:
+                power_sketches.add(device_id, p, ts)
+            if ts >= rollup_from:
+                rolling.add(device_id, p, ts)
+            continue
+        admitted = device_id not in store
+        if deduper is not None:
+            deduper.seen(device_id, _sample_key(payload))  # so a live redelivery of it is dropped
+        store.touch(device_id, k, payload, p)
+        _analyze(device_id, k, payload, p, ts, admitted, rolling_ts=ts)
+        result["live"] += 1
+    for name in ("inserted", "duplicates", "rejected"):
+        BACKFILL_SAMPLES.labels(kind, name).inc(result[name])
+    print(f"[Backfill] {device_id} ({kind}): {result}")
+    return result
+
+# -------- Warm start --------
+def _replay_since(since: datetime) -> int:
+    """Feed telemetry persisted after `since` through the in-memory analytics (no DB writes, no alerts)."""
+    n = 0
+    for table, kind in ((TelemetryDC, KIND_DC), (TelemetryAC, KIND_AC)):
+        with Session(engine) as s:
+            rows = s.exec(select(table).where(table.ts > since).order_by(table.ts)).all()
+        if not rows:
+            continue
+        ids, tss, watts = [], [], []
+        for r in rows:
+            ts = r.ts.replace(tzinfo=timezone.utc).timestamp()
+            payload = {"v": r.voltage_v, "i": r.current_a, "p": r.power_w, "ts": r.ts.isoformat()}
+            if kind == KIND_AC:
+                payload.update({"pf": r.pf, "f": r.frequency_hz, "e_wh": r.energy_wh})
+            store.touch(r.device_id, kind, payload, r.power_w, ts)
+            rolling.add(r.device_id, r.power_w, ts)
+            if anomalies is not None:
+                anomalies.update(r.device_id, payload, ts)
+            ids.append(r.device_id)
+            tss.append(ts)
+            watts.append(r.power_w)
+        detector.add_batch(ids, tss, watts)
+        n += len(rows)
+    return n
+
+def _seed_fleet_summary():
+    """Totals and rankings for the devices restored from the snapshot (offline ones stay out)."""
+    for device_id in list(store.ids):
+        k = store.get(device_id) if device_id else None
+        if k is None or int(store.kind[k]) not in _KIND_NAMES:
+            continue
+        if device_id in offline_devices:
+            fleet_summary.set_offline(device_id)
+        else:
+            _update_fleet(device_id, int(store.kind[k]), float(store.power_w[k]))
 
-# -------- Routers --------
-app.include_router(health.router, prefix="", tags=["health"])
-app.include_router(devices.router, prefix="/devices", tags=["devices"])
-app.include_router(telementry.router, prefix="/telemetry", tags=["telemetry-dc"])
-app.include_router(ac_telemetry.router, prefix="/telemetry", tags=["telemetry-ac"])
-app.include_router(alerts.router, prefix="/alerts", tags=["alerts"])
-app.include_router(alerts.router, prefix="/alerts", tags=["alerts"])
-app.include_router(reports.router, prefix="/reports", tags=["reports"])
-app.include_router(debug.router, prefix="", tags=["debug"])
-app.include_router(agent.router, tags=["agent"])
-
-# -------- Shared state injection --------
-app.state.engine = engine
-app.state.latest_dc = latest_dc
-app.state.latest_ac = latest_ac
-app.state.rolling = rolling
-app.state.detector = detector
-app.state.publish_switch = mqtt.publish_switch
-app.state.handle_dc = _on_dc
-app.state.handle_ac = _on_ac
-app.state.mailer = mailer
+def _rearm_deadlines():
+    now = clock()
+    for device_id in list(store.ids):
+        k = store.get(device_id) if device_id else None
+        if k is None:
+            continue
+        seen = float(store.last_seen[k])
+        if settings.offline_after_sec > 0 and device_id not in offline_devices:
+            scheduler.schedule(device_id, "offline", max(seen + settings.offline_after_sec, now))
+        if settings.device_state_ttl_sec > 0:
+            scheduler.schedule(device_id, "evict", max(seen + settings.device_state_ttl_sec, now))
+        remaining = detector.idle_remaining(device_id)
+        if remaining is not None and remaining > 0:
+            scheduler.schedule(device_id, "idle", now + remaining)
+
+def _restore_state() -> dict:
+    """Load the last snapshot and replay only the telemetry written since it was taken."""
+    t0 = perf_counter()
+    arrays = snapshotter.load()
+    report = {"snapshot": arrays is not None, "load_ms": round((perf_counter() - t0) * 1000, 1)}
+    if arrays is not None:
+        offline_devices.update(str(d) for d in arrays.get("app.offline", ()))
+        taken_at = float(arrays["meta.taken_at"])
+        t1 = perf_counter()
+        report["replayed_rows"] = _replay_since(datetime.fromtimestamp(taken_at, timezone.utc).replace(tzinfo=None))
+        report["replay_ms"] = round((perf_counter() - t1) * 1000, 1)
+        report["snapshot_age_s"] = round(clock() - taken_at, 1)
+    report["devices"] = len(store)
+    return report
+
+# -------- DB-, network- and TLS-backed services (lazy) --------
+def _init_services():
+    global engine, notifier, switch_commands, mqtt, backfill, whatif, power_sketches, live
+    global telemetry_writer, retention, edge_sync
+    if mqtt is not None:
+        return
+    engine = get_engine()
+    backfill = BackfillWriter(engine, batch_size=settings.backfill_batch_size)
+    whatif = WhatIfJobs(engine, settings.resolved_db_url, detector, workers=settings.whatif_workers,
+                        tariff_usd_per_kwh=settings.tariff_usd_per_kwh, clock=clock)
+    power_sketches = PowerSketches(engine, bucket_s=settings.power_sketch_bucket_sec,
+                                   flush_s=settings.power_sketch_flush_sec, clock=clock)
+    if settings.telemetry_batch_ms > 0:
+        telemetry_writer = TelemetryWriter(engine, interval_s=settings.telemetry_batch_ms / 1000,
+                                           max_rows=settings.telemetry_batch_max_rows)
+    retention = RawRetention(engine, max_age_s=settings.raw_retention_hours * 3600,
+                             max_rows=settings.raw_retention_max_rows, clock=clock)
+    site = settings.edge_site_id or settings.mqtt_client_id
+    edge_headers = {"X-Edge-Site": site}
+    if settings.edge_sync_token:
+        edge_headers["Authorization"] = f"Bearer {settings.edge_sync_token}"
+    if settings.edge_sync_url:
+        edge_sync = RollupForwarder(engine, settings.edge_sync_url, site, token=settings.edge_sync_token,
+                                    interval_s=settings.edge_sync_interval_sec, batch=settings.edge_sync_batch,
+                                    clock=clock)
+    if settings.shared_state_path:
+        live = SharedLiveState(settings.shared_state_path, capacity=settings.shared_state_capacity,
+                               n_buckets=rolling.n_buckets, bucket_s=rolling.bucket_s, clock=clock)
+    notifier = NotificationDispatcher(
+        engine,
+        [
+            WebhookSink(
+                url.strip(),
+                None,  # dispatcher attaches its pooled AsyncClient on start
+                headers={"Authorization": f"Bearer {settings.webhook_token}"} if settings.webhook_token else None,
+                max_batch=settings.webhook_batch_size,
+                concurrency=settings.webhook_concurrency,
+            )
+            for url in (settings.webhook_urls or "").split(",") if url.strip()
+        ] + ([
+            # Edge: alerts reach the central instance through the outbox (kept until it accepts them)
+            WebhookSink(settings.edge_sync_url.rstrip("/") + "/edge/events", None, headers=edge_headers,
+                        max_batch=settings.webhook_batch_size, concurrency=1)
+        ] if settings.edge_sync_url else []),
+        max_attempts=settings.webhook_max_attempts,
+    )
+    switch_commands = SwitchCommander(
+        lambda *a, **kw: mqtt.publish_switch(*a, **kw),
+        engine,
+        scheduler,
+        ack_timeout_s=settings.switch_ack_timeout_sec,
+        max_retries=settings.switch_max_retries,
+        require_ack=settings.switch_require_ack,
+        ack_wait_s=settings.switch_ack_wait_sec,
+        on_settled=_on_command_settled,
+        clock=clock,
+    )
+    # Single MQTT bridge (HiveMQ-ready)
+    mqtt = MQTTBridge(
+        host=settings.mqtt_host,
+        port=settings.mqtt_port,
+        base=settings.mqtt_base,
+        on_dc_measure=_on_dc,
+        on_ac_measure=_on_ac,
+        on_backfill=_on_backfill,
+        on_switch_report=switch_commands.on_report,
+        on_puback=switch_commands.on_puback,
+        qos=settings.switch_qos,
+        command_json=settings.switch_command_json,
+        username=settings.mqtt_username,
+        password=settings.mqtt_password,
+        use_tls=settings.mqtt_tls,
+        use_ws=settings.mqtt_ws,
+        ws_path=settings.mqtt_ws_path,
+        keepalive=settings.mqtt_keepalive,
+        client_id=settings.mqtt_client_id,
+    )
+
+def _attach_services(app: FastAPI):
+    app.state.engine = engine
+    app.state.notifier = notifier
+    app.state.switch_commands = switch_commands
+    app.state.publish_switch = mqtt.publish_switch
+    mqtt.submit = admission.submit if admission is not None else None
+    app.state.whatif = whatif
+    app.state.power_sketches = power_sketches
+    app.state.telemetry_writer = telemetry_writer
+    app.state.retention = retention
+    app.state.edge_sync = edge_sync
+    app.state.mqtt = mqtt
+    app.state.live = live
+
+# -------- Metrics (read at scrape time, nothing on the ingest path) --------
+DEVICE_INGEST_LAG.set_function(lambda: dict(ingest_lag))
+REGISTRY.gauge("spo_devices", "Devices with in-memory state", fn=lambda: len(store))
+REGISTRY.gauge("spo_devices_offline", "Devices past their last-seen timeout", fn=lambda: len(offline_devices))
+REGISTRY.gauge("spo_alerts_actionable", "Open/ack/snoozed alerts", fn=lambda: len(alert_index))
+REGISTRY.gauge("spo_power_sketch_pending", "(device, bucket) power sketches not yet flushed",
+               fn=lambda: power_sketches.pending() if power_sketches is not None else 0)
+REGISTRY.gauge("spo_ingest_compression_ratio", "Live telemetry samples received per row stored",
+               fn=lambda: compressor.ratio())
+REGISTRY.gauge("spo_deadline_timers", "Pending idle/offline/evict/ack deadlines", fn=lambda: len(scheduler))
+REGISTRY.gauge("spo_queue_depth", "Items waiting per in-process queue", ("queue",), fn=lambda: {
+    "mail": mail_queue.depth() if mail_queue is not None else 0,
+    "switch_commands": len(switch_commands.pending()) if switch_commands is not None else 0,
+    "telemetry_writer": telemetry_writer.depth() if telemetry_writer is not None else 0,
+    **({f"admission_{lane}": n for lane, n in admission.snapshot()["lanes"].items()} if admission is not None else {}),
+})
+_ADMISSION_STATES = {NORMAL: 0, COALESCING: 1, SHEDDING: 2}
+REGISTRY.gauge("spo_admission_state", "Telemetry overload state (0 normal, 1 coalescing, 2 shedding)",
+               fn=lambda: _ADMISSION_STATES[admission.state] if admission is not None else 0)
 
 # -------- Lifecycle --------
-@app.on_event("startup")
-def _startup():
-    init_db(reset=False)
-    _apply_device_overrides_from_db()
-    if not getattr(app.state, "mqtt_started", False):
-        mqtt.start()
-        app.state.mqtt_started = True
-
-@app.get("/")
-def root():
-    return {"name": "spo-backend", "env": settings.app_env}
+def _warm_up(app: FastAPI):
+    """Everything that touches the DB, disk or network; runs after the port is already serving /livez."""
+    r: Readiness = app.state.readiness
+    r.state = "warming"
+    t0 = perf_counter()
+    try:
+        with r.phase("services"):
+            _init_services()
+            _attach_services(app)
+        with r.phase("init_db"):
+            init_db(reset=False)
+        with r.phase("restore"):
+            report = _restore_state()
+        with r.phase("open_alerts"):
+            report["open_alerts"] = _load_open_alerts()
+        with r.phase("device_overrides"):
+            _apply_device_overrides_from_db()
+            _rearm_deadlines()
+            _seed_fleet_summary()
+        with r.phase("workers"):
+            scheduler.start()
+            snapshotter.start()
+            power_sketches.start()
+            retention.start()
+            if telemetry_writer is not None:
+                telemetry_writer.start()
+            if edge_sync is not None:
+                edge_sync.start()
+            if mail_queue is not None:
+                mail_queue.start()
+            notifier.start()
+            if admission is not None:
+                admission.start()
+        # Ingest attaches last, once the state it feeds is in place
+        with r.phase("mqtt"):
+            if settings.mqtt_capture_path and mqtt.recorder is None:
+                mqtt.recorder = TrafficRecorder(settings.mqtt_capture_path)
+            if not getattr(app.state, "mqtt_started", False):
+                mqtt.start()
+                app.state.mqtt_started = True
+    except Exception as e:
+        r.fail(e)
+        print("[Startup] warm-up failed:", r.error)
+        return
+    report["startup_ms"] = round((perf_counter() - t0) * 1000, 1)
+    app.state.startup_report = report
+    r.set_ready()
+    report["restart_to_ready_ms"] = r.marks["ready"]
+    print("[Startup]", report, r.report())
+    if r.over_budget:
+        print(f"[Startup] WARNING: ready after {r.marks['ready']} ms, budget {r.budget_ms} ms")
+
+def _shutdown(app: FastAPI, warm: threading.Thread):
+    app.state.readiness.state = "stopping"
+    warm.join(timeout=30)  # don't stop services that are still being started
+    if mqtt is not None:
+        mqtt.stop()  # no new samples while admission, the compressor and the writer drain below
+    snapshotter.stop()
+    scheduler.stop()
+    if mail_queue is not None:
+        mail_queue.stop()
+    if notifier is not None:
+        notifier.stop()
+    if whatif is not None:
+        whatif.close()
+    if admission is not None:
+        admission.stop()  # drains queued telemetry before the final snapshot
+    if mqtt is not None and mqtt.recorder is not None:
+        mqtt.recorder.close()
+    if retention is not None:
+        retention.stop()
+    if edge_sync is not None:
+        edge_sync.stop()
+    if engine is not None:
+        try:
+            for device_id in list(store.ids):
+                if device_id:
+                    _store_rows(device_id, compressor.drain(device_id))  # held samples of open segments
+        except Exception as e:
+            print("[Compression] final drain failed:", e)
+    if telemetry_writer is not None:
+        try:
+            telemetry_writer.stop()  # commits the last batch (after the admission drain)
+        except Exception as e:
+            print("[TelemetryWriter] final batch failed:", e)
+    if power_sketches is not None:
+        power_sketches.stop()
+        try:
+            power_sketches.flush()  # after the admission drain, so queued samples are in it
+        except Exception as e:
+            print("[PowerSketch] final flush failed:", e)
+    if not app.state.readiness.ready:
+        return  # never restored, so a snapshot now would overwrite the last good one
+    try:
+        snapshotter.save()
+    except Exception as e:
+        print("[Snapshot] final save failed:", e)
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    app.state.readiness.mark("live")
+    warm = threading.Thread(target=_warm_up, args=(app,), name="warm-up", daemon=True)
+    warm.start()
+    try:
+        yield
+    finally:
+        _shutdown(app, warm)
+
+def create_app() -> FastAPI:
+    """
+    Build the ASGI app. Importing this module and calling this does no I/O: the DB
+    engine, MQTT client, webhook pool and state restore are set up by the lifespan in a
+    background warm-up, while /livez already answers and other routes return 503 until
+    /readyz does. Services are per process, so build one app per worker.
+    """
+    readiness = Readiness(_t_import, settings.startup_budget_ms)
+    app = FastAPI(title="Smart Power Optimizer (Backend)", lifespan=_lifespan)
+    app.add_middleware(ReadinessGate, readiness=readiness)  # innermost, so its 503s still carry CORS headers
+    # Add this RIGHT AFTER creating the app
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Allow all origins during development
+        allow_credentials=True,
+        allow_methods=["*"],  # Allow all HTTP methods
+        allow_headers=["*"],  # Allow all headers
+        expose_headers=["X-Next-Cursor"],  # GET /devices paging
+    )
+    app.add_middleware(MetricsMiddleware)  # per-route latency for /metrics
+
+    # -------- Routers --------
+    app.include_router(health.router, prefix="", tags=["health"])
+    app.include_router(devices.router, prefix="/devices", tags=["devices"])
+    app.include_router(telementry.router, prefix="/telemetry", tags=["telemetry-dc"])
+    app.include_router(ac_telemetry.router, prefix="/telemetry", tags=["telemetry-ac"])
+    app.include_router(alerts.router, prefix="/alerts", tags=["alerts"])
+    app.include_router(alerts.router, prefix="/alerts", tags=["alerts"])
+    app.include_router(reports.router, prefix="/reports", tags=["reports"])
+    app.include_router(fleet.router, prefix="/fleet", tags=["fleet"])
+    app.include_router(simulations.router, prefix="/simulations", tags=["simulations"])
+    app.include_router(edge.router, tags=["edge"])
+    app.include_router(debug.router, prefix="", tags=["debug"])
+    app.include_router(profiling.router, tags=["debug"])
+    app.include_router(agent.router, tags=["agent"])
+
+    # -------- Shared state injection --------
+    app.state.readiness = readiness
+    app.state.store = store
+    app.state.latest_dc = latest_dc
+    app.state.latest_ac = latest_ac
+    app.state.rolling = rolling
+    app.state.detector = detector
+    app.state.scheduler = scheduler
+    app.state.anomalies = anomalies
+    app.state.offline_devices = offline_devices
+    app.state.alert_index = alert_index
+    app.state.fleet_summary = fleet_summary
+    app.state.runtime_index = runtime_index
+    app.state.compressor = compressor
+    app.state.handle_dc = _on_dc
+    app.state.handle_ac = _on_ac
+    app.state.handle_backfill = _on_backfill
+    app.state.admission = admission
+    app.state.mailer = mailer
+    app.state.snapshotter = snapshotter
+    app.state.metrics = REGISTRY
+    app.state.clock = clock
+    if mqtt is not None:
+        _attach_services(app)
+
+    @app.get("/")
+    def root():
+        return {"name": "spo-backend", "env": settings.app_env}
+
+    readiness.mark("app_built")
+    return app
+
+app = create_app()
@@ -1,6 +1,6 @@
 from typing import Optional
 from datetime import datetime
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, Integer, Index, LargeBinary
 from sqlmodel import SQLModel, Field
 
 
@@ -8,13 +8,16 @@ from sqlmodel import SQLModel, Field
 class Device(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     device_id: str = Field(index=True, unique=True)  # e.g., "dc-esp32-1" or "ac-printer-1"
-    name: str = "Unnamed"
+    name: str = Field(default="Unnamed", index=True)  # prefix search
     kind: str = "dc_sensor"  # "dc_sensor" | "ac_sensor" | "switch"
     location: Optional[str] = None
 
     # Per-device idle config (overrides global defaults)
     idle_threshold_w: Optional[float] = None
     idle_duration_sec: Optional[int] = None
+    # Per-device ingest compression (overrides INGEST_COMPRESSION / COMPRESSION_TOLERANCE_W)
+    compression: Optional[str] = None
+    compression_tolerance_w: Optional[float] = None
 
     # Switch mapping for control (if applicable)
     switch_id: str | None = Field(
@@ -31,6 +34,12 @@ class Device(SQLModel, table=True):
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+    __table_args__ = (
+        # Keyset paging inside a filter: WHERE kind/location = ? AND device_id > ? ORDER BY device_id
+        Index("ix_device_kind_device_id", "kind", "device_id"),
+        Index("ix_device_location_device_id", "location", "device_id"),
+    )
+
 class Approval(SQLModel, table=True):
     __tablename__ = "approvals"
 
@@ -49,6 +58,8 @@ class TelemetryDC(SQLModel, table=True):
     power_w: float
     ts: datetime = Field(default_factory=datetime.utcnow)
 
+    __table_args__ = (Index("ix_telemetrydc_device_id_ts", "device_id", "ts"),)  # windowed averages
+
 
 # Telemetry (AC) 
 class TelemetryAC(SQLModel, table=True):
@@ -62,6 +73,8 @@ class TelemetryAC(SQLModel, table=True):
     energy_wh: Optional[float] = None
     ts: datetime = Field(default_factory=datetime.utcnow)
 
+    __table_args__ = (Index("ix_telemetryac_device_id_ts", "device_id", "ts"),)
+
 
 #Alerts 
 class Alert(SQLModel, table=True):
@@ -70,10 +83,13 @@ class Alert(SQLModel, table=True):
     reason: str = "idle_detected"
     threshold_w: float
     duration_s: int
-    status: str = "open"  # "open" | "ack" | "snoozed" | "closed"
+    status: str = Field(default="open", index=True)  # "open" | "ack" | "snoozed" | "closed"
     ts_open: datetime = Field(default_factory=datetime.utcnow)
     ts_close: Optional[datetime] = None
     snooze_until: Optional[datetime] = None
+    # Set on a central instance for alerts forwarded by an edge gateway (POST /edge/events)
+    site: Optional[str] = Field(default=None, index=True)
+    site_alert_id: Optional[int] = None
 
 
 # Actions (audit)
@@ -85,3 +101,50 @@ class Action(SQLModel, table=True):
     manager_id: Optional[str] = None
     reason: Optional[str] = None
     ts: datetime = Field(default_factory=datetime.utcnow)
+    # Switch command tracking (set when the action published an MQTT switch command)
+    command_id: Optional[str] = Field(default=None, index=True)  # correlation id
+    switch_id: Optional[str] = None
+    channel: Optional[str] = None
+    state: Optional[str] = None  # "ON" | "OFF"
+    status: Optional[str] = None  # "queued" | "sent" | "acked" | "failed" | "superseded" | "coalesced"
+    attempts: Optional[int] = None
+    ts_settled: Optional[datetime] = None
+    latency_ms: Optional[float] = None  # publish -> device ack
+
+
+# Notification outbox (webhooks etc.; rows survive restarts until delivered)
+class NotificationOutbox(SQLModel, table=True):
+    __tablename__ = "notification_outbox"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sink: str = Field(index=True)  # e.g. "webhook:https://hooks.example.com/spo"
+    event_type: str  # "alert.created" | "alert.closed" | ...
+    payload: str  # JSON
+    status: str = Field(default="pending", index=True)  # "pending" | "sent" | "dead"
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+
+# Power distribution per device and time bucket (mergeable log-bucket sketch, see services/power_sketch.py)
+class PowerSketch(SQLModel, table=True):
+    __tablename__ = "power_sketch"
+    __table_args__ = (Index("ux_power_sketch_device_id_bucket", "device_id", "bucket_start", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: str
+    bucket_start: datetime = Field(index=True)  # UTC, aligned to POWER_SKETCH_BUCKET_SEC
+    samples: int = 0
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))  # QuantileSketch.to_bytes()
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# Resumable upload positions of the edge forwarder (one row per stream)
+class SyncCursor(SQLModel, table=True):
+    __tablename__ = "sync_cursor"
+
+    name: str = Field(primary_key=True)  # e.g. "power_sketch"
+    position: str  # opaque keyset position, see services/edge_sync.py
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -5,6 +5,7 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from sqlmodel import Session, select
 from ..models import TelemetryAC
+from ..services.device_state import KIND_AC
 
 router = APIRouter()
 
@@ -19,7 +20,13 @@ class ACLastReading(BaseModel):
 
 @router.get("/ac/{device_id}", response_model=ACLastReading)
 def last_ac(device_id: str, request: Request):
-    """Return the most recent AC reading from the database."""
+    """Return the most recent AC reading (worker-shared live state first, then the database)."""
+    live = getattr(request.app.state, "live", None)
+    rec = live.read(device_id) if live is not None else None
+    if rec is not None and rec["kind"] == KIND_AC:
+        p = rec["payload"]
+        return {"v": p.get("v"), "i": p.get("i"), "p": p.get("p"), "pf": p.get("pf"), "f": p.get("f"),
+                "e_wh": p.get("e_wh"), "ts": datetime.utcfromtimestamp(rec["last_seen"])}
     engine = request.app.state.engine
     with Session(engine) as s:
         row = s.exec(
@@ -1,9 +1,24 @@
 # app/routers/agent.py
-from fastapi import APIRouter, Request
+from contextlib import contextmanager
+from fastapi import APIRouter, HTTPException, Request
 from datetime import datetime
 
 router = APIRouter()
 
+
+@contextmanager
+def _admitted(request: Request):
+    """Hold an HTTP ingest slot; 503 + Retry-After while overloaded, so the device retries later."""
+    admission = request.app.state.admission
+    if admission is None:
+        yield
+        return
+    with admission.http_slot() as ok:
+        if not ok:
+            raise HTTPException(status_code=503, detail=f"ingest overloaded ({admission.state})",
+                                headers={"Retry-After": "5"})
+        yield
+
 @router.post("/agent/telemetry/dc/{device_id}")
 def agent_dc(device_id: str, body: dict, request: Request):
     """HTTP DC ingest compatible with your MQTT handlers."""
@@ -13,8 +28,10 @@ def agent_dc(device_id: str, body: dict, request: Request):
         "i": body.get("i"),
         "p": body.get("p"),
         "ts": body.get("ts") or datetime.utcnow().isoformat(),
+        "seq": body.get("seq"),  # lets retried posts be dropped as duplicates
     }
-    request.app.state.handle_dc(device_id, payload)
+    with _admitted(request):
+        request.app.state.handle_dc(device_id, payload)
     return {"ok": True}
 
 @router.post("/agent/telemetry/ac/{device_id}")
@@ -27,6 +44,21 @@ def agent_ac(device_id: str, body: dict, request: Request):
         "f": body.get("f"),
         "e_wh": body.get("e_wh"),
         "ts": body.get("ts") or datetime.utcnow().isoformat(),
+        "seq": body.get("seq"),
     }
-    request.app.state.handle_ac(device_id, payload)
+    with _admitted(request):
+        request.app.state.handle_ac(device_id, payload)
     return {"ok": True}
+
+@router.post("/agent/telemetry/{kind}/{device_id}/backfill")
+def agent_backfill(kind: str, device_id: str, body: dict, request: Request):
+    """Buffered samples from a reconnecting device: {"samples": [{"ts": ..., "v": ..., "p": ...}, ...]}."""
+    samples = body.get("samples")
+    if not isinstance(samples, list):
+        raise HTTPException(status_code=400, detail="samples must be a list")
+    try:
+        with _admitted(request):
+            result = request.app.state.handle_backfill(device_id, kind, samples)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, **result}
@@ -14,11 +14,32 @@ class ShutdownBody(BaseModel):
     reason: Optional[str] = None
 
 
+def _close_or_wait(request: Request, cmd, alert_id: int, device_id: str, reason: str) -> bool:
+    """Close the alert now, or (SWITCH_REQUIRE_ACK) wait briefly for the switch to confirm OFF."""
+    commands = request.app.state.switch_commands
+    if commands.require_ack:
+        return commands.wait(cmd)  # the ack handler closes the alert, even if it acks after we return
+    notifier = request.app.state.notifier
+    with Session(request.app.state.engine) as s:
+        a = s.get(Alert, alert_id)
+        a.status = "closed"
+        a.ts_close = datetime.utcnow()
+        s.add(a)
+        notifier.enqueue(s, "alert.closed", {  # committed with the close, so a crash can't lose it
+            "alert_id": alert_id, "device_id": device_id, "reason": reason, "action": "OFF",
+            "command_id": cmd.id,
+        })
+        s.commit()
+    request.app.state.alert_index.release(device_id, reason, alert_id)
+    notifier.wake()
+    return True
+
+
 @router.post("/{alert_id}/shutdown")
 @router.post("/{alert_id}/shutdown/")
 def shutdown_alert(alert_id: int, body: ShutdownBody, request: Request):
     engine = request.app.state.engine
-    publish = request.app.state.publish_switch
+    commands = request.app.state.switch_commands
 
     with Session(engine) as s:
         a = s.get(Alert, alert_id)
@@ -27,7 +48,10 @@ def shutdown_alert(alert_id: int, body: ShutdownBody, request: Request):
 
         status = a.status  # capture while bound
         device_id = a.device_id  # capture while bound
+        reason = a.reason
 
+        if a.site is not None:
+            raise HTTPException(400, f"alert mirrored from edge site {a.site}; act on it there")
         if status not in ALLOWED_FOR_SHUTDOWN:
             raise HTTPException(400, f"alert not actionable (status={status})")
 
@@ -38,14 +62,10 @@ def shutdown_alert(alert_id: int, body: ShutdownBody, request: Request):
         switch_id = d.switch_id
         channel = d.switch_channel
 
-        # Publish OFF command
-        publish(switch_id, "OFF", channel)
-
-        # Close alert
-        a.status = "closed"
-        a.ts_close = datetime.utcnow()
-        s.add(a)
-        s.commit()
+    # Publish OFF command (QoS 1, tracked until the switch acks)
+    cmd = commands.submit(device_id, switch_id, channel, "OFF", action="shutdown",
+                          alert_id=alert_id, reason=body.reason)
+    closed = _close_or_wait(request, cmd, alert_id, device_id, reason)
 
     # Now we return only captured primitives (no detached ORM access)
     return {
@@ -54,7 +74,8 @@ def shutdown_alert(alert_id: int, body: ShutdownBody, request: Request):
         "device_id": device_id,
         "action": "OFF",
         "published": {"switch_id": switch_id, "channel": channel},
-        "closed": True,
+        "command": cmd.as_dict(),
+        "closed": closed,
     }
 
 
@@ -62,12 +83,12 @@ def shutdown_alert(alert_id: int, body: ShutdownBody, request: Request):
 @router.post("/shutdown-latest/")
 def shutdown_latest(request: Request):
     engine = request.app.state.engine
-    publish = request.app.state.publish_switch
+    commands = request.app.state.switch_commands
 
     with Session(engine) as s:
         a = s.exec(
             select(Alert)
-            .where(Alert.status == "open")
+            .where(Alert.status == "open", Alert.site.is_(None))  # not alerts mirrored from edge sites
             .order_by(Alert.id.desc())
             .limit(1)
         ).first()
@@ -76,6 +97,7 @@ def shutdown_latest(request: Request):
 
         alert_id = a.id
         device_id = a.device_id
+        reason = a.reason
 
         d = s.exec(select(Device).where(Device.device_id == device_id)).first()
         if not d or not d.switch_id:
@@ -84,12 +106,8 @@ def shutdown_latest(request: Request):
         switch_id = d.switch_id
         channel = d.switch_channel
 
-        publish(switch_id, "OFF", channel)
-
-        a.status = "closed"
-        a.ts_close = datetime.utcnow()
-        s.add(a)
-        s.commit()
+    cmd = commands.submit(device_id, switch_id, channel, "OFF", action="shutdown", alert_id=alert_id)
+    closed = _close_or_wait(request, cmd, alert_id, device_id, reason)
 
     return {
         "ok": True,
@@ -97,7 +115,8 @@ def shutdown_latest(request: Request):
         "device_id": device_id,
         "action": "OFF",
         "published": {"switch_id": switch_id, "channel": channel},
-        "closed": True,
+        "command": cmd.as_dict(),
+        "closed": closed,
     }
 
 
@@ -1,6 +1,13 @@
-from fastapi import APIRouter, Request, HTTPException
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Request, HTTPException
 from pydantic import BaseModel, EmailStr
 
+from ..config import get_settings
+from ..services.capture import TrafficRecorder
+from .profiling import require_admin
+
 router = APIRouter()
 
 class TestEmailBody(BaseModel):
@@ -20,3 +27,99 @@ def send_test_email(body: TestEmailBody, request: Request):
         return {"ok": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"send error: {e}")
+
+
+@router.get("/debug/mail")
+def mail_queue_stats(request: Request):
+    q = request.app.state.mailer.queue
+    if q is None:
+        return {"queued_delivery": False}
+    return {"queued_delivery": True, **q.snapshot()}
+
+
+@router.get("/debug/notifications")
+def notification_stats(request: Request):
+    return request.app.state.notifier.snapshot()
+
+
+@router.get("/debug/commands")
+def switch_command_stats(request: Request):
+    return request.app.state.switch_commands.snapshot()
+
+
+@router.get("/debug/commands/{command_id}")
+def switch_command(command_id: str, request: Request):
+    cmd = request.app.state.switch_commands.get(command_id)
+    if cmd is None:
+        raise HTTPException(404, "command not pending (settled commands are in the Action table)")
+    return cmd.as_dict()
+
+
+@router.get("/debug/admission")
+def admission_stats(request: Request):
+    """Ingest lanes, overload state and shed counts."""
+    admission = request.app.state.admission
+    if admission is None:
+        return {"admission_control": False}
+    return {"admission_control": True, **admission.snapshot()}
+
+
+@router.get("/debug/edge")
+def edge_stats(request: Request):
+    """Edge profile: write batching, device cap, raw retention and upstream sync position."""
+    settings = get_settings()
+    writer, retention, sync = (request.app.state.telemetry_writer, request.app.state.retention,
+                               request.app.state.edge_sync)
+    return {
+        "edge_profile": settings.edge_profile,
+        "telemetry_writer": writer.snapshot() if writer is not None else None,
+        "devices": {"in_memory": len(request.app.state.store), "max": settings.max_devices or None},
+        "retention": {"max_age_h": settings.raw_retention_hours or None,
+                      "max_rows": settings.raw_retention_max_rows or None,
+                      "deleted": retention.deleted, "last_prune_ms": retention.last_prune_ms},
+        "sync": sync.snapshot() if sync is not None else None,
+    }
+
+
+@router.get("/debug/compression")
+def compression_stats(request: Request, device_id: Optional[str] = None):
+    """Ingest compression: samples received vs rows stored and the reconstruction error bound."""
+    snap = request.app.state.compressor.snapshot(device_id)
+    snap["energy_bound_wh_per_h"] = snap["max_error_w"]  # |stored - received energy| per hour of telemetry
+    return snap
+
+
+class CaptureBody(BaseModel):
+    name: str  # bare file name, created in MQTT_CAPTURE_DIR
+
+
+def _capture_path(name: str) -> str:
+    if not name or name in (".", "..") or "/" in name or "\\" in name or "\0" in name:
+        raise HTTPException(400, "name must be a bare file name (no directories)")
+    directory = get_settings().mqtt_capture_dir
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+@router.post("/debug/capture", dependencies=[Depends(require_admin)])
+def start_capture(body: CaptureBody, request: Request):
+    """Start recording raw MQTT traffic to MQTT_CAPTURE_DIR/<name> for later replay (python -m bench.replay)."""
+    bridge = request.app.state.mqtt
+    if bridge.recorder is not None:
+        raise HTTPException(409, f"already capturing to {bridge.recorder.path}")
+    path = _capture_path(body.name)
+    try:
+        bridge.recorder = TrafficRecorder(path)
+    except OSError as e:
+        raise HTTPException(400, f"cannot open {path}: {e}")
+    return {"capturing": True, "path": path}
+
+
+@router.delete("/debug/capture", dependencies=[Depends(require_admin)])
+def stop_capture(request: Request):
+    bridge = request.app.state.mqtt
+    rec, bridge.recorder = bridge.recorder, None
+    if rec is None:
+        return {"capturing": False}
+    rec.close()
+    return {"capturing": False, "path": rec.path, "messages": rec.count}
@@ -1,10 +1,10 @@
-from typing import Optional, List, Tuple
-from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, Request
+from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from sqlmodel import Session, select
-from sqlalchemy import func
-from ..models import Device, TelemetryDC, TelemetryAC
+from ..models import Device
+from ..services.device_index import decode_cursor, encode_cursor, page_readings, query_devices
+from ..services.compression import MODES
 
 
 router = APIRouter()
@@ -34,81 +34,91 @@ class DeviceRow(BaseModel):
     idle: bool
 
 
-# ---------- Helpers ----------
-def _tables_for(kind: str):
-    if kind == "dc_sensor":
-        return TelemetryDC
-    elif kind == "ac_sensor":
-        return TelemetryAC
-    return None  # switches don't produce telemetry
-
-
-def _latest_power(session: Session, table, device_id: str) -> Optional[float]:
-    row = session.exec(
-        select(table.power_w)
-        .where(table.device_id == device_id)
-        .order_by(table.ts.desc())
-        .limit(1)
-    ).first()
-    return float(row) if row is not None else None
-
-
-def _avg_power_since(session: Session, table, device_id: str, since: datetime) -> Optional[float]:
-    avg_val = session.exec(
-        select(func.avg(table.power_w))
-        .where(table.device_id == device_id, table.ts >= since)
-    ).first()
-    return float(avg_val) if avg_val is not None else None
-
-
-def _rolling_averages(session: Session, table, device_id: str) -> Tuple[
-    Optional[float], Optional[float], Optional[float]]:
-    now = datetime.utcnow()
-    return (
-        _avg_power_since(session, table, device_id, now - timedelta(minutes=1)),
-        _avg_power_since(session, table, device_id, now - timedelta(minutes=5)),
-        _avg_power_since(session, table, device_id, now - timedelta(minutes=10)),
-    )
-
-
 # ---------- Routes ----------
 @router.get("")  # /devices
 @router.get("/")  # /devices/
-def list_devices(request: Request) -> List[DeviceRow]:
+def list_devices(
+    request: Request,
+    response: Response,
+    kind: Optional[str] = None,
+    location: Optional[str] = None,
+    q: Optional[str] = Query(None, description="device_id or name prefix (case-sensitive)"),
+    idle: Optional[bool] = None,
+    offline: Optional[bool] = None,
+    power_min: Optional[float] = Query(None, description="current power, W"),
+    power_max: Optional[float] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+) -> List[DeviceRow]:
+    """
+    Devices ordered by device_id. Without `limit` every match is returned; with it, the
+    X-Next-Cursor response header holds the `cursor` for the next page. `idle`, `offline`
+    and `power_*` filter on live runtime state, so devices this process holds none for
+    only match idle=false / offline=false.
+    """
     engine = request.app.state.engine
     detector = request.app.state.detector  # reads per-device overrides
+    runtime = request.app.state.runtime_index
+    offline_devices = request.app.state.offline_devices
+    live = getattr(request.app.state, "live", None)
+    now = request.app.state.clock()
+
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "bad cursor")
+
+    # Runtime filters: sets of ids known to match, plus exact per-id checks for the negations
+    candidates = None
+    for ids in (
+        set(runtime.idle) if idle else None,
+        runtime.in_power_range(power_min, power_max) if (power_min, power_max) != (None, None) else None,
+        set(offline_devices) if offline else None,
+    ):
+        if ids is not None:
+            candidates = ids if candidates is None else candidates & ids
+    checks = []
+    if idle is False:
+        checks.append(lambda d: d not in runtime.idle)
+    if offline is False:
+        checks.append(lambda d: d not in offline_devices)
+    keep = (lambda d: all(c(d) for c in checks)) if checks else None
 
     rows: List[DeviceRow] = []
     with Session(engine) as s:
-        devices = s.exec(select(Device)).all()  # DB is the source of truth :contentReference[oaicite:2]{index=2}
-        for d in devices:
-            table = _tables_for(d.kind)
-
-            if not table:  # e.g., "switch" device
-                rows.append(DeviceRow(
-                    device_id=d.device_id, name=d.name, kind=d.kind, location=d.location,
-                    current_power_w=None, avg_1m_w=None, avg_5m_w=None, avg_10m_w=None, idle=False
-                ))
-                continue
-
-            current_w = _latest_power(s, table, d.device_id)
-            avg_1m, avg_5m, avg_10m = _rolling_averages(s, table, d.device_id)
-
-            th, _du = detector._cfg(d.device_id)
-            basis = avg_5m if (avg_5m is not None) else (current_w or 0.0)
-            is_idle = basis < (th or 0.0)
-
+        # DB is the source of truth :contentReference[oaicite:2]{index=2}
+        devices, last = query_devices(s, kind=kind, location=location, q=q, candidates=candidates,
+                                      keep=keep, after=after, limit=limit)
+        readings = page_readings(s, devices, request.app.state.rolling, live, now)
+    for device_id, name, d_kind, d_location, _ in devices:
+        got = readings.get(device_id)
+        if got is None:  # e.g., "switch" device
             rows.append(DeviceRow(
-                device_id=d.device_id,
-                name=d.name,
-                kind=d.kind,
-                location=d.location,
-                current_power_w=current_w,
-                avg_1m_w=avg_1m,
-                avg_5m_w=avg_5m,
-                avg_10m_w=avg_10m,
-                idle=bool(is_idle),
+                device_id=device_id, name=name, kind=d_kind, location=d_location,
+                current_power_w=None, avg_1m_w=None, avg_5m_w=None, avg_10m_w=None, idle=False
             ))
+            continue
+        current_w, (avg_1m, avg_5m, avg_10m) = got
+
+        th, _du = detector._cfg(device_id)
+        basis = avg_5m if (avg_5m is not None) else (current_w or 0.0)
+        is_idle = basis < (th or 0.0)
+
+        rows.append(DeviceRow(
+            device_id=device_id,
+            name=name,
+            kind=d_kind,
+            location=d_location,
+            current_power_w=current_w,
+            avg_1m_w=avg_1m,
+            avg_5m_w=avg_5m,
+            avg_10m_w=avg_10m,
+            idle=bool(is_idle),
+        ))
+    if last is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(last)
     return rows
 
 
@@ -138,12 +148,15 @@ def upsert_device(body: DeviceUpsert, request: Request):
         dur = d.idle_duration_sec
 
     detector.set_overrides(body.device_id, thr, dur)  # safe: using plain values
+    request.app.state.fleet_summary.set_location(body.device_id, body.location)
     return {"ok": True}
 
 
 class DeviceConfigPatch(BaseModel):
     idle_threshold_w: Optional[float] = None
     idle_duration_sec: Optional[int] = None
+    compression: Optional[str] = None  # "off" | "deadband" | "swinging_door"
+    compression_tolerance_w: Optional[float] = None
 
 
 @router.patch("/{device_id}/config")
@@ -151,10 +164,18 @@ class DeviceConfigPatch(BaseModel):
 def patch_config(device_id: str, body: DeviceConfigPatch, request: Request):
     engine = request.app.state.engine
     detector = request.app.state.detector
+    if body.compression is not None and body.compression not in MODES:
+        raise HTTPException(status_code=400, detail=f"compression must be one of {MODES}")
+    if body.compression_tolerance_w is not None and body.compression_tolerance_w < 0:
+        raise HTTPException(status_code=400, detail="compression_tolerance_w must be >= 0")
     with Session(engine) as s:
         d = s.exec(select(Device).where(Device.device_id == device_id)).first()
         if not d:
             raise HTTPException(status_code=404, detail="device not found")
+        if body.compression is not None:
+            d.compression = body.compression
+        if body.compression_tolerance_w is not None:
+            d.compression_tolerance_w = body.compression_tolerance_w
         if body.idle_threshold_w is not None:
             d.idle_threshold_w = body.idle_threshold_w
         if body.idle_duration_sec is not None:
@@ -163,7 +184,9 @@ def patch_config(device_id: str, body: DeviceConfigPatch, request: Request):
         s.commit()
         thr = d.idle_threshold_w
         dur = d.idle_duration_sec
+        cmode, ctol = d.compression, d.compression_tolerance_w
     detector.set_overrides(device_id, thr, dur)
+    request.app.state.compressor.set_overrides(device_id, cmode, ctol)
     return {"ok": True}
 
 
@@ -174,7 +197,7 @@ class CommandBody(BaseModel):
 @router.post("/{device_id}/command")
 @router.post("/{device_id}/command/")
 def device_command(device_id: str, body: CommandBody, request: Request):
-    publish = request.app.state.publish_switch
+    commands = request.app.state.switch_commands
     engine = request.app.state.engine
     with Session(engine) as s:
         d = s.exec(select(Device).where(Device.device_id == device_id)).first()
@@ -183,8 +206,9 @@ def device_command(device_id: str, body: CommandBody, request: Request):
         if not d.switch_id:
             raise HTTPException(status_code=400, detail="device has no switch mapping")
         state = "ON" if body.action.lower() == "on" else "OFF"
-        publish(d.switch_id, state, d.switch_channel)
-        return {"ok": True, "published": {"switch_id": d.switch_id, "channel": d.switch_channel, "state": state}}
+        cmd = commands.submit(device_id, d.switch_id, d.switch_channel, state)
+        return {"ok": True, "published": {"switch_id": d.switch_id, "channel": d.switch_channel, "state": state},
+                "command": cmd.as_dict()}
 
 
 router = APIRouter()
@@ -214,81 +238,91 @@ class DeviceRow(BaseModel):
     idle: bool
 
 
-# ---------- Helpers ----------
-def _tables_for(kind: str):
-    if kind == "dc_sensor":
-        return TelemetryDC
-    elif kind == "ac_sensor":
-        return TelemetryAC
-    return None  # switches don't produce telemetry
-
-
-def _latest_power(session: Session, table, device_id: str) -> Optional[float]:
-    row = session.exec(
-        select(table.power_w)
-        .where(table.device_id == device_id)
-        .order_by(table.ts.desc())
-        .limit(1)
-    ).first()
-    return float(row) if row is not None else None
-
-
-def _avg_power_since(session: Session, table, device_id: str, since: datetime) -> Optional[float]:
-    avg_val = session.exec(
-        select(func.avg(table.power_w))
-        .where(table.device_id == device_id, table.ts >= since)
-    ).first()
-    return float(avg_val) if avg_val is not None else None
-
-
-def _rolling_averages(session: Session, table, device_id: str) -> Tuple[
-    Optional[float], Optional[float], Optional[float]]:
-    now = datetime.utcnow()
-    return (
-        _avg_power_since(session, table, device_id, now - timedelta(minutes=1)),
-        _avg_power_since(session, table, device_id, now - timedelta(minutes=5)),
-        _avg_power_since(session, table, device_id, now - timedelta(minutes=10)),
-    )
-
-
 # ---------- Routes ----------
 @router.get("")  # /devices
 @router.get("/")  # /devices/
-def list_devices(request: Request) -> List[DeviceRow]:
+def list_devices(
+    request: Request,
+    response: Response,
+    kind: Optional[str] = None,
+    location: Optional[str] = None,
+    q: Optional[str] = Query(None, description="device_id or name prefix (case-sensitive)"),
+    idle: Optional[bool] = None,
+    offline: Optional[bool] = None,
+    power_min: Optional[float] = Query(None, description="current power, W"),
+    power_max: Optional[float] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+) -> List[DeviceRow]:
+    """
+    Devices ordered by device_id. Without `limit` every match is returned; with it, the
+    X-Next-Cursor response header holds the `cursor` for the next page. `idle`, `offline`
+    and `power_*` filter on live runtime state, so devices this process holds none for
+    only match idle=false / offline=false.
+    """
     engine = request.app.state.engine
     detector = request.app.state.detector  # reads per-device overrides
+    runtime = request.app.state.runtime_index
+    offline_devices = request.app.state.offline_devices
+    live = getattr(request.app.state, "live", None)
+    now = request.app.state.clock()
+
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "bad cursor")
+
+    # Runtime filters: sets of ids known to match, plus exact per-id checks for the negations
+    candidates = None
+    for ids in (
+        set(runtime.idle) if idle else None,
+        runtime.in_power_range(power_min, power_max) if (power_min, power_max) != (None, None) else None,
+        set(offline_devices) if offline else None,
+    ):
+        if ids is not None:
+            candidates = ids if candidates is None else candidates & ids
+    checks = []
+    if idle is False:
+        checks.append(lambda d: d not in runtime.idle)
+    if offline is False:
+        checks.append(lambda d: d not in offline_devices)
+    keep = (lambda d: all(c(d) for c in checks)) if checks else None
 
     rows: List[DeviceRow] = []
     with Session(engine) as s:
-        devices = s.exec(select(Device)).all()  # DB is the source of truth :contentReference[oaicite:2]{index=2}
-        for d in devices:
-            table = _tables_for(d.kind)
-
-            if not table:  # e.g., "switch" device
-                rows.append(DeviceRow(
-                    device_id=d.device_id, name=d.name, kind=d.kind, location=d.location,
-                    current_power_w=None, avg_1m_w=None, avg_5m_w=None, avg_10m_w=None, idle=False
-                ))
-                continue
-
-            current_w = _latest_power(s, table, d.device_id)
-            avg_1m, avg_5m, avg_10m = _rolling_averages(s, table, d.device_id)
-
-            th, _du = detector._cfg(d.device_id)
-            basis = avg_5m if (avg_5m is not None) else (current_w or 0.0)
-            is_idle = basis < (th or 0.0)
-
+        # DB is the source of truth :contentReference[oaicite:2]{index=2}
+        devices, last = query_devices(s, kind=kind, location=location, q=q, candidates=candidates,
+                                      keep=keep, after=after, limit=limit)
+        readings = page_readings(s, devices, request.app.state.rolling, live, now)
+    for device_id, name, d_kind, d_location, _ in devices:
+        got = readings.get(device_id)
+        if got is None:  # e.g., "switch" device
             rows.append(DeviceRow(
-                device_id=d.device_id,
-                name=d.name,
-                kind=d.kind,
-                location=d.location,
-                current_power_w=current_w,
-                avg_1m_w=avg_1m,
-                avg_5m_w=avg_5m,
-                avg_10m_w=avg_10m,
-                idle=bool(is_idle),
+                device_id=device_id, name=name, kind=d_kind, location=d_location,
+                current_power_w=None, avg_1m_w=None, avg_5m_w=None, avg_10m_w=None, idle=False
             ))
+            continue
+        current_w, (avg_1m, avg_5m, avg_10m) = got
+
+        th, _du = detector._cfg(device_id)
+        basis = avg_5m if (avg_5m is not None) else (current_w or 0.0)
+        is_idle = basis < (th or 0.0)
+
+        rows.append(DeviceRow(
+            device_id=device_id,
+            name=name,
+            kind=d_kind,
+            location=d_location,
+            current_power_w=current_w,
+            avg_1m_w=avg_1m,
+            avg_5m_w=avg_5m,
+            avg_10m_w=avg_10m,
+            idle=bool(is_idle),
+        ))
+    if last is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(last)
     return rows
 
 
@@ -318,12 +352,15 @@ def upsert_device(body: DeviceUpsert, request: Request):
         dur = d.idle_duration_sec
 
     detector.set_overrides(body.device_id, thr, dur)  # safe: using plain values
+    request.app.state.fleet_summary.set_location(body.device_id, body.location)
     return {"ok": True}
 
 
 class DeviceConfigPatch(BaseModel):
     idle_threshold_w: Optional[float] = None
     idle_duration_sec: Optional[int] = None
+    compression: Optional[str] = None  # "off" | "deadband" | "swinging_door"
+    compression_tolerance_w: Optional[float] = None
 
 
 @router.patch("/{device_id}/config")
@@ -331,10 +368,18 @@ class DeviceConfigPatch(BaseModel):
 def patch_config(device_id: str, body: DeviceConfigPatch, request: Request):
     engine = request.app.state.engine
     detector = request.app.state.detector
+    if body.compression is not None and body.compression not in MODES:
+        raise HTTPException(status_code=400, detail=f"compression must be one of {MODES}")
+    if body.compression_tolerance_w is not None and body.compression_tolerance_w < 0:
+        raise HTTPException(status_code=400, detail="compression_tolerance_w must be >= 0")
     with Session(engine) as s:
         d = s.exec(select(Device).where(Device.device_id == device_id)).first()
         if not d:
             raise HTTPException(status_code=404, detail="device not found")
+        if body.compression is not None:
+            d.compression = body.compression
+        if body.compression_tolerance_w is not None:
+            d.compression_tolerance_w = body.compression_tolerance_w
         if body.idle_threshold_w is not None:
             d.idle_threshold_w = body.idle_threshold_w
         if body.idle_duration_sec is not None:
@@ -343,7 +388,9 @@ def patch_config(device_id: str, body: DeviceConfigPatch, request: Request):
         s.commit()
         thr = d.idle_threshold_w
         dur = d.idle_duration_sec
+        cmode, ctol = d.compression, d.compression_tolerance_w
     detector.set_overrides(device_id, thr, dur)
+    request.app.state.compressor.set_overrides(device_id, cmode, ctol)
     return {"ok": True}
 
 
@@ -354,7 +401,7 @@ class CommandBody(BaseModel):
 @router.post("/{device_id}/command")
 @router.post("/{device_id}/command/")
 def device_command(device_id: str, body: CommandBody, request: Request):
-    publish = request.app.state.publish_switch
+    commands = request.app.state.switch_commands
     engine = request.app.state.engine
     with Session(engine) as s:
         d = s.exec(select(Device).where(Device.device_id == device_id)).first()
@@ -363,5 +410,6 @@ def device_command(device_id: str, body: CommandBody, request: Request):
         if not d.switch_id:
             raise HTTPException(status_code=400, detail="device has no switch mapping")
         state = "ON" if body.action.lower() == "on" else "OFF"
-        publish(d.switch_id, state, d.switch_channel)
-        return {"ok": True, "published": {"switch_id": d.switch_id, "channel": d.switch_channel, "state": state}}
+        cmd = commands.submit(device_id, d.switch_id, d.switch_channel, state)
+        return {"ok": True, "published": {"switch_id": d.switch_id, "channel": d.switch_channel, "state": state},
+                "command": cmd.as_dict()}
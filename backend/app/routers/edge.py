@@ -0,0 +1,61 @@
+import gzip
+import hmac
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session
+
+from ..config import get_settings
+from ..services.edge_sync import store_alert_events, store_rollups
+
+
+def require_edge(authorization: Optional[str] = Header(None), x_edge_site: Optional[str] = Header(None)) -> str:
+    token = get_settings().edge_ingest_token
+    if not token:
+        raise HTTPException(404, "edge intake disabled (set EDGE_INGEST_TOKEN)")
+    if not authorization or not hmac.compare_digest(authorization, f"Bearer {token}"):
+        raise HTTPException(403, "edge token required")
+    if not x_edge_site:
+        raise HTTPException(400, "X-Edge-Site header required")
+    return x_edge_site
+
+
+router = APIRouter(prefix="/edge")
+
+
+async def _json(request: Request) -> dict:
+    raw = await request.body()
+    try:
+        if request.headers.get("content-encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        return json.loads(raw)
+    except (OSError, ValueError) as e:
+        raise HTTPException(400, f"bad body: {e}")
+
+
+def _write(engine, fn, *args) -> int:
+    with Session(engine) as s:
+        n = fn(s, *args)
+        s.commit()
+    return n
+
+
+@router.post("/rollups")
+async def receive_rollups(request: Request, site: str = Depends(require_edge)):
+    """Power sketch rows from an edge gateway's RollupForwarder; replaces the buckets it sends."""
+    body = await _json(request)
+    try:
+        n = await run_in_threadpool(_write, request.app.state.engine, store_rollups, body.get("sketches") or [])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(400, f"bad sketch: {e!r}")
+    return {"ok": True, "site": site, "rows": n}
+
+
+@router.post("/events")
+async def receive_events(request: Request, site: str = Depends(require_edge)):
+    """Alert events from an edge gateway's notification outbox (at-least-once; applied idempotently)."""
+    body = await _json(request)
+    n = await run_in_threadpool(_write, request.app.state.engine, store_alert_events, site, body.get("events") or [])
+    return {"ok": True, "site": site, "alerts": n}
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+
+router = APIRouter()
+
+@router.get("/summary")
+def fleet_summary(request: Request, n: int = Query(20, ge=1, le=500), by: str = "current"):
+    """
+    Total fleet power (overall, per kind, per location), top-N and bottom-N consumers by
+    current or 5-minute power, and idle/offline counts. Maintained at ingest, so this is
+    O(n log n), independent of fleet size.
+    """
+    try:
+        return request.app.state.fleet_summary.summary(n, by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
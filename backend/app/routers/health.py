@@ -1,6 +1,5 @@
-from time import time
-
 from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sqlmodel import Session
 
 router = APIRouter()
@@ -16,6 +15,23 @@ def health(request: Request):
         db_ok = False
     return {"ok": True, "db": db_ok}
 
+@router.get("/livez")
+def livez(request: Request):
+    """The process is up and serving HTTP (answers during warm-up too)."""
+    return {"ok": True, "state": request.app.state.readiness.state}
+
+@router.get("/readyz")
+def readyz(request: Request):
+    """503 until warm-up finished (schema, state restore, workers, MQTT ingest attached)."""
+    r = request.app.state.readiness
+    return JSONResponse(r.report(), status_code=200 if r.ready else 503)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics(request: Request):
+    """Prometheus text exposition (stage timings, ingest lag, HTTP latency, queue depths)."""
+    return PlainTextResponse(request.app.state.metrics.expose(), media_type="text/plain; version=0.0.4")
+
+
 @router.post("/__test_email")
 def test_email(request: Request):
     m = getattr(request.app.state, "mailer", None)
@@ -27,19 +43,55 @@ def test_email(request: Request):
 
 @router.get("/debug/idle/{device_id}")
 def idle_debug(device_id: str, request: Request):
-    det = request.app.state.detector
-    buf = list(det.buffers.get(device_id, []))
-    th, du = det._cfg(device_id)
-    below_since = det.below_since.get(device_id)
-    now = time()
+    detector = request.app.state.detector
+    live = getattr(request.app.state, "live", None)
+    rec = live.read(device_id) if live is not None else None
+    if rec is None:
+        return detector.debug_state(device_id)
+    # Same answer from every worker: the idle window as last published by the ingesting process
+    idle = rec["idle"]
+    since = idle["below_since"]
     return {
         "device": device_id,
-        "threshold_w": th,
-        "duration_s": du,
-        "window": det.window,
-        "samples": buf,
-        "avg_w": (sum(buf)/len(buf) if buf else None),
-        "below_since": below_since,
-        "elapsed_s": (now - below_since) if below_since else 0,
+        "threshold_w": idle["threshold_w"],
+        "duration_s": idle["duration_s"],
+        "window_s": detector.window_s,
+        "samples": None,  # individual samples stay in the ingesting process
+        "window_samples": idle["samples"],
+        "avg_w": idle["avg_w"],
+        "below_since": since,
+        "elapsed_s": (request.app.state.clock() - since) if since else 0,
+        "source": "shared",
+        "writer_pid": rec["writer_pid"],
     }
 
+
+@router.get("/debug/anomaly/{device_id}")
+def anomaly_debug(device_id: str, request: Request):
+    anomalies = request.app.state.anomalies
+    if anomalies is None:
+        return {"device": device_id, "enabled": False}
+    return anomalies.debug_state(device_id)
+
+
+@router.get("/debug/memory")
+def memory_report(request: Request):
+    """Per-device runtime state footprint (slots, arrays, window buffers) and timer count."""
+    report = request.app.state.store.memory_report()
+    report["timers"] = len(request.app.state.scheduler)
+    live = getattr(request.app.state, "live", None)
+    if live is not None:
+        report["shared_state"] = live.report()
+    return report
+
+
+@router.get("/debug/startup")
+def startup_report(request: Request):
+    """How the last start went: snapshot restore, replayed rows, warm-up phases and time to ready."""
+    snap = request.app.state.snapshotter
+    return {
+        **getattr(request.app.state, "startup_report", {}),
+        "readiness": request.app.state.readiness.report(),
+        "last_snapshot_at": snap.last_saved_at,
+        "last_snapshot_ms": snap.last_save_ms,
+    }
@@ -0,0 +1,67 @@
+import hmac
+import threading
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from ..config import get_settings
+from ..services.profiler import MemoryTracer, StackSampler
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    token = get_settings().admin_token
+    if not token:
+        raise HTTPException(404, "profiling disabled (set ADMIN_TOKEN)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, token):
+        raise HTTPException(403, "admin token required")
+
+
+router = APIRouter(prefix="/debug/profile", dependencies=[Depends(require_admin)])
+
+_cpu_busy = threading.Lock()
+_memory = MemoryTracer()
+
+
+@router.get("/cpu")
+def cpu_profile(
+        seconds: float = Query(10.0, gt=0, le=120),
+        interval_ms: float = Query(5.0, ge=1, le=100),
+        format: Literal["collapsed", "top"] = "collapsed",
+        include_idle: bool = False,
+):
+    """
+    Sample every thread's stack for `seconds`. "collapsed" is flamegraph input
+    (flamegraph.pl / speedscope / inferno); "top" is a self/total per-function table.
+    """
+    if not _cpu_busy.acquire(blocking=False):
+        raise HTTPException(409, "a CPU profile is already running")
+    try:
+        sampler = StackSampler(interval_s=interval_ms / 1000).run(seconds, include_idle=include_idle)
+    finally:
+        _cpu_busy.release()
+    if format == "top":
+        return sampler.top()
+    return PlainTextResponse(sampler.collapsed())
+
+
+@router.post("/memory/start")
+def memory_start(frames: int = Query(10, ge=1, le=50)):
+    """Start tracemalloc (if needed) and take the baseline snapshot."""
+    _memory.start(frames)
+    return {"tracing": True, "frames": frames}
+
+
+@router.get("/memory/diff")
+def memory_diff(key: Literal["lineno", "filename", "traceback"] = "lineno", limit: int = Query(30, ge=1, le=500)):
+    """Allocation growth since /memory/start, biggest first."""
+    try:
+        return _memory.diff(key, limit)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+
+
+@router.delete("/memory")
+def memory_stop():
+    current, peak = _memory.stop()
+    return {"tracing": False, "traced_bytes": current, "peak_bytes": peak}
@@ -1,8 +1,9 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, HTTPException, Request
 from sqlmodel import Session, select
-from ..models import TelemetryAC, TelemetryDC
+from ..models import Device, TelemetryAC, TelemetryDC
+from ..services.power_sketch import QuantileSketch, RELATIVE_ACCURACY
 from ..config import get_settings
 
 router = APIRouter()
@@ -68,3 +69,70 @@ def energy_report(request: Request, device_id: Optional[str] = None,
         "cost_usd": round(kwh * settings.tariff_usd_per_kwh, 2),
         "co2_kg": round(kwh * settings.co2_kg_per_kwh, 3),
     }
+
+
+def _epoch(dt: datetime) -> float:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)  # naive timestamps are UTC throughout this app
+    return dt.timestamp()
+
+@router.get("/power-quantiles")
+def power_quantiles(request: Request, device_id: Optional[str] = None, location: Optional[str] = None,
+                    start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    group: str = "device", interval: str = "total", q: str = "0.05,0.5,0.95"):
+    """
+    Power percentiles (default p5/p50/p95) from the per-device bucket sketches, merged over
+    the range (default: last 24 h) and grouped per device, per location or for the whole
+    fleet; `interval=bucket` keeps one row per time bucket (hourly by default). Ranges
+    resolve to whole buckets. Estimates are within RELATIVE_ACCURACY of a real reading.
+    """
+    sketches = request.app.state.power_sketches
+    if group not in ("device", "location", "fleet") or interval not in ("total", "bucket"):
+        raise HTTPException(status_code=400, detail="group: device|location|fleet, interval: total|bucket")
+    try:
+        qs = [float(x) for x in q.split(",") if x.strip()]
+    except ValueError:
+        qs = []
+    if not qs or any(not 0 <= x <= 1 for x in qs):
+        raise HTTPException(status_code=400, detail="q: comma-separated quantiles in [0, 1]")
+    t_end = _epoch(end) if end else request.app.state.clock()
+    t_start = _epoch(start) if start else t_end - 86400
+
+    ids, locations = None, {}
+    if location or group == "location":
+        with Session(request.app.state.engine) as s:
+            qd = select(Device.device_id, Device.location)
+            if location:
+                qd = qd.where(Device.location == location)
+            locations = dict(s.exec(qd).all())
+        if location:
+            ids = set(locations)
+    if device_id:
+        ids = {device_id} & ids if ids is not None else {device_id}
+
+    groups = {}
+    for dev, b, sketch in sketches.load(t_start, t_end, ids):
+        name = {"device": dev, "location": locations.get(dev), "fleet": "all"}[group]
+        key = (name, b if interval == "bucket" else None)
+        acc = groups.get(key)
+        if acc is None:
+            acc = groups[key] = QuantileSketch()
+        acc.merge(sketch)
+
+    rows = []
+    for (name, b), sketch in sorted(groups.items(), key=lambda kv: (str(kv[0][0]), kv[0][1] or 0)):
+        n = sketch.count
+        row = {group: name, "samples": n, "mean_w": round(sketch.sum / n, 3),
+               "min_w": round(sketch.min, 3), "max_w": round(sketch.max, 3)}
+        if b is not None:
+            row["bucket_start"] = datetime.fromtimestamp(b, timezone.utc).isoformat()
+        for qv, v in zip(qs, sketch.quantiles(qs)):
+            row[f"p{qv * 100:g}"] = round(v, 3)
+        rows.append(row)
+    return {
+        "start": datetime.fromtimestamp(sketches.bucket(t_start), timezone.utc).isoformat(),
+        "end": datetime.fromtimestamp(t_end, timezone.utc).isoformat(),
+        "bucket_sec": sketches.bucket_s,
+        "relative_accuracy": RELATIVE_ACCURACY,
+        "groups": rows,
+    }
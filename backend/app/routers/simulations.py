@@ -0,0 +1,72 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, Field
+
+from .devices import DeviceConfigPatch, patch_config
+
+router = APIRouter()
+
+
+class IdleWhatIfBody(BaseModel):
+    days: float = Field(7, gt=0, le=90)
+    device_ids: Optional[List[str]] = None  # default: every DC/AC sensor
+    thresholds_w: List[float] = [2, 5, 10, 20, 50]
+    durations_sec: List[int] = [120, 300, 600, 1800]
+    max_alerts_per_day: float = 3.0  # alert budget for the recommendation
+    max_threshold_frac: float = Field(0.5, gt=0, le=1)  # recommended threshold <= this x the device's p90 power
+    max_gap_s: float = 600.0  # longer sample gaps (device offline) count as this much
+
+
+class ApplyBody(BaseModel):
+    device_ids: Optional[List[str]] = None  # default: every device with a recommendation
+
+
+def _job(request: Request, job_id: str) -> dict:
+    job = request.app.state.whatif.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@router.post("/idle")
+def start_idle_whatif(body: IdleWhatIfBody, request: Request):
+    """
+    Replay stored telemetry through the idle rule for every threshold x duration pair.
+    Runs in the background; poll GET /simulations/idle/{job_id}.
+    """
+    if not body.thresholds_w or not body.durations_sec:
+        raise HTTPException(status_code=400, detail="thresholds_w and durations_sec must not be empty")
+    return request.app.state.whatif.start(**body.model_dump())
+
+
+@router.get("/idle")
+def list_idle_whatif(request: Request):
+    return request.app.state.whatif.list()
+
+
+@router.get("/idle/{job_id}")
+def get_idle_whatif(job_id: str, request: Request, grid: bool = True):
+    """Per device: alerts / avoidable kWh and cost now, over the grid, and the recommended config."""
+    job = _job(request, job_id)
+    results = job["results"] if grid else [{k: v for k, v in r.items() if k != "grid"} for r in job["results"]]
+    return {**request.app.state.whatif.summary(job), "results": results}
+
+
+@router.post("/idle/{job_id}/apply")
+def apply_idle_whatif(job_id: str, body: ApplyBody, request: Request):
+    """Apply the recommended configs of a finished job through PATCH /devices/{id}/config."""
+    job = _job(request, job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"job is {job['status']}")
+    wanted = set(body.device_ids) if body.device_ids is not None else None
+    applied = []
+    for r in job["results"]:
+        if r["recommended"] is None or (wanted is not None and r["device_id"] not in wanted):
+            continue
+        try:
+            patch_config(r["device_id"], DeviceConfigPatch(**r["recommended"]), request)
+        except HTTPException:
+            continue  # device deleted since the run
+        applied.append({"device_id": r["device_id"], **r["recommended"]})
+    return {"ok": True, "applied": applied}
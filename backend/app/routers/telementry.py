@@ -5,6 +5,7 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from sqlmodel import Session, select
 from ..models import TelemetryDC
+from ..services.device_state import KIND_DC
 
 router = APIRouter()
 
@@ -17,7 +18,12 @@ class DCLastReading(BaseModel):
 @router.get("/dc/{device_id}", response_model=DCLastReading)
 def last_dc(device_id: str, request: Request):
     print("device ID: ", device_id)
-    """Return the most recent DC reading from the database."""
+    """Return the most recent DC reading (worker-shared live state first, then the database)."""
+    live = getattr(request.app.state, "live", None)
+    rec = live.read(device_id) if live is not None else None
+    if rec is not None and rec["kind"] == KIND_DC:
+        p = rec["payload"]
+        return {"v": p.get("v"), "i": p.get("i"), "p": p.get("p"), "ts": datetime.utcfromtimestamp(rec["last_seen"])}
     engine = request.app.state.engine
     with Session(engine) as s:
         row = s.exec(
@@ -0,0 +1,182 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic
+from typing import Callable, Dict, Hashable, Optional
+
+from .metrics import ADMISSION_SHED
+
+NORMAL, COALESCING, SHEDDING = "normal", "coalescing", "shedding"
+
+
+class AdmissionController:
+    """
+    Priority lanes in front of the DB-bound ingest work, with load shedding for telemetry.
+
+    The MQTT network thread only enqueues, so switch commands keep going out and acks keep
+    coming in while the DB is slow. The "control" lane (switch acks/state reports and alert
+    open/close writes) has its own worker and never waits behind telemetry. The "telemetry" lane is served by a second
+    worker, which turns to the "bulk" lane (backfill uploads) only once telemetry is empty.
+
+    The telemetry lane degrades in steps, judged from its depth and from how long its head
+    has been waiting:
+      normal      every sample is queued
+      coalescing  a sample for a device that already has one queued replaces it (latest wins)
+      shedding    as coalescing, and samples for devices with nothing queued are dropped
+    and recovers with hysteresis (below half the limits). HTTP telemetry is not queued
+    (the caller gets its answer after the write) but takes one of `http_slots`; when none
+    is free, or while shedding, it is turned away with a 503 so it can retry, and the
+    remaining threads and DB connections stay free for commands and reads.
+    """
+
+    def __init__(self, soft_limit: int = 2000, hard_limit: int = 20000, target_wait_s: float = 2.0,
+                 http_slots: int = 4, clock: Callable[[], float] = monotonic):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.target_wait_s = target_wait_s
+        self.clock = clock
+        self.state = NORMAL
+        self._cond = threading.Condition()
+        self._lanes: Dict[str, deque] = {"control": deque(), "telemetry": deque(), "bulk": deque()}
+        self._queued: Dict[Hashable, list] = {}  # telemetry key -> its queued entry
+        self._http = threading.BoundedSemaphore(http_slots)
+        self.http_slots = http_slots
+        self._http_busy = 0
+        self.shed: Dict[str, int] = {"coalesced": 0, "dropped": 0, "http_rejected": 0}
+        self.state_changes = 0
+        self._threads: list = []
+        self._stopping = False
+
+    # -------- Overload state --------
+    def _head_wait(self, now: float) -> float:
+        lane = self._lanes["telemetry"]
+        return now - lane[0][3] if lane else 0.0
+
+    def _update_state(self, now: float):
+        depth, wait = len(self._lanes["telemetry"]), self._head_wait(now)
+        state = self.state
+        if state == NORMAL and (depth >= self.soft_limit or wait >= self.target_wait_s):
+            state = COALESCING
+        if state != SHEDDING and depth >= self.hard_limit:
+            state = SHEDDING
+        elif state == SHEDDING and depth < self.hard_limit // 2:
+            state = COALESCING
+        if state == COALESCING and depth < self.soft_limit // 2 and wait < self.target_wait_s / 2:
+            state = NORMAL
+        if state != self.state:
+            print(f"[Admission] {self.state} -> {state} (telemetry depth {depth}, head wait {wait:.2f}s)")
+            self.state = state
+            self.state_changes += 1
+
+    # -------- Submit --------
+    def submit(self, lane: str, fn: Callable, *args, key: Optional[Hashable] = None) -> bool:
+        """Queue fn(*args) on a lane; telemetry needs a `key` (e.g. (kind, device_id)). False if shed."""
+        with self._cond:
+            now = self.clock()
+            if lane == "telemetry":
+                self._update_state(now)
+                entry = self._queued.get(key) if self.state != NORMAL else None
+                if entry is not None:
+                    entry[1] = args  # keep the latest value per device
+                    self.shed["coalesced"] += 1
+                    ADMISSION_SHED.labels("coalesced").inc()
+                    return True
+                if self.state == SHEDDING:
+                    self.shed["dropped"] += 1
+                    ADMISSION_SHED.labels("dropped").inc()
+                    return False
+                entry = [fn, args, key, now]
+                self._queued[key] = entry
+            else:
+                entry = [fn, args, None, now]
+            self._lanes[lane].append(entry)
+            self._cond.notify_all()
+            return True
+
+    @contextmanager
+    def http_slot(self):
+        """`with admission.http_slot() as ok:`; ok is False when HTTP telemetry should get a 503."""
+        ok = self.state != SHEDDING and self._http.acquire(blocking=False)
+        if not ok:
+            with self._cond:
+                self.shed["http_rejected"] += 1
+            ADMISSION_SHED.labels("http_rejected").inc()
+            yield False
+            return
+        with self._cond:
+            self._http_busy += 1
+        try:
+            yield True
+        finally:
+            with self._cond:
+                self._http_busy -= 1
+            self._http.release()
+
+    # -------- Workers --------
+    def _next(self, lanes) -> Optional[list]:
+        with self._cond:
+            while not self._stopping:
+                for name in lanes:
+                    lane = self._lanes[name]
+                    if lane:
+                        entry = lane.popleft()
+                        if entry[2] is not None and self._queued.get(entry[2]) is entry:
+                            del self._queued[entry[2]]
+                        if name == "telemetry":
+                            self._update_state(self.clock())
+                        return entry
+                self._cond.wait(1.0)
+            return None
+
+    def _work(self, lanes):
+        while True:
+            entry = self._next(lanes)
+            if entry is None:
+                return
+            try:
+                entry[0](*entry[1])
+            except Exception as e:
+                print(f"[Admission] {lanes[0]} task failed: {e!r}")
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        for name, lanes in (("control", ("control",)), ("ingest", ("telemetry", "bulk"))):
+            t = threading.Thread(target=self._work, args=(lanes,), name=f"admission-{name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop after the queued work drains (or `timeout`)."""
+        deadline = monotonic() + timeout
+        while self.depth() and monotonic() < deadline:
+            with self._cond:
+                self._cond.wait(0.05)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        self._threads = []
+
+    # -------- Introspection --------
+    @property
+    def running(self) -> bool:
+        return bool(self._threads) and not self._stopping
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self._lanes.values())
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "state": self.state,
+                "state_changes": self.state_changes,
+                "lanes": {name: len(q) for name, q in self._lanes.items()},
+                "telemetry_head_wait_s": round(self._head_wait(self.clock()), 3),
+                "http_busy": self._http_busy,
+                "http_slots": self.http_slots,
+                "shed": dict(self.shed),
+                "limits": {"soft": self.soft_limit, "hard": self.hard_limit, "target_wait_s": self.target_wait_s},
+            }
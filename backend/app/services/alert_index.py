@@ -0,0 +1,66 @@
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+ACTIONABLE = ("open", "snoozed", "ack")
+PENDING = -1  # claimed, row not committed yet
+
+
+class OpenAlertIndex:
+    """
+    In-memory index of actionable alerts (open / ack / snoozed): device_id -> {reason: alert_id}.
+
+    Loaded once at startup, then kept in sync by `_raise_alert` and the close paths, so the
+    "is there already an alert?" check on the ingest path is a dict lookup instead of a
+    query per sample. `claim` is an atomic check-and-reserve: of several ingest threads
+    racing for the same (device, reason), exactly one gets to create the row.
+    """
+
+    def __init__(self):
+        self._by_device: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(r) for r in self._by_device.values())
+
+    def load(self, rows: Iterable[Tuple[int, str, str]]) -> int:
+        """Replace the index with (alert_id, device_id, reason) rows of actionable alerts."""
+        by_device: Dict[str, Dict[str, int]] = {}
+        for alert_id, device_id, reason in rows:
+            by_device.setdefault(device_id, {})[reason] = alert_id
+        with self._lock:
+            self._by_device = by_device
+        return len(self)
+
+    def get(self, device_id: str, reason: str) -> Optional[int]:
+        return self._by_device.get(device_id, {}).get(reason)
+
+    def has(self, device_id: str, reason: str) -> bool:
+        return reason in self._by_device.get(device_id, ())
+
+    def for_device(self, device_id: str) -> Dict[str, int]:
+        return dict(self._by_device.get(device_id, {}))
+
+    def claim(self, device_id: str, reason: str) -> bool:
+        """Reserve (device, reason) if no actionable alert exists; False if one already does."""
+        with self._lock:
+            reasons = self._by_device.setdefault(device_id, {})
+            if reason in reasons:
+                return False
+            reasons[reason] = PENDING
+            return True
+
+    def confirm(self, device_id: str, reason: str, alert_id: int):
+        with self._lock:
+            self._by_device.setdefault(device_id, {})[reason] = alert_id
+
+    def release(self, device_id: str, reason: str, alert_id: Optional[int] = None):
+        """Drop the entry (on close, or when creating a claimed alert failed)."""
+        with self._lock:
+            reasons = self._by_device.get(device_id)
+            if not reasons or reason not in reasons:
+                return
+            if alert_id is not None and reasons[reason] not in (alert_id, PENDING):
+                return  # a newer alert already took the slot
+            del reasons[reason]
+            if not reasons:
+                del self._by_device[device_id]
@@ -0,0 +1,192 @@
+import math
+from time import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .device_state import DeviceStateStore
+
+METRICS = ("v", "i", "p", "pf", "f")
+_LABELS = ("voltage", "current", "power", "power_factor", "frequency")
+_P = METRICS.index("p")
+# Sensor resolution per metric; std never drops below this (or 1% of the mean) so a perfectly
+# flat signal doesn't turn the next 0.1 W wiggle into an infinite z-score.
+_NOISE_FLOOR = (0.05, 0.01, 0.5, 0.01, 0.02)
+
+# Per-(device, metric) fields, laid out as state[slot, field, metric]
+MEAN, VAR, BASE, CUSUM_POS, CUSUM_NEG, COUNT, LAST_FIRED = range(7)
+_FIELD_FILL = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0, -np.inf)
+# Per-device fields, laid out as dev[slot, field]
+STEADY_SINCE, STUCK_FIRED = range(2)
+_DEV_FILL = (np.nan, -np.inf)
+
+
+class AnomalyDetector:
+    """
+    Streaming per-device, per-metric anomaly detection (v, i, p, pf, f).
+
+    Each device owns one contiguous (fields x metrics) float64 slab in `state`, indexed by
+    its DeviceStateStore slot:
+      - EWMA mean/variance -> z-score spikes ("<metric>_spike", e.g. "power_spike")
+      - slow EWMA baseline + two-sided CUSUM on the standardized residual -> sustained
+        level shifts such as a DC rail sagging ("<metric>_drift", e.g. "voltage_drift")
+    plus a per-device steady-high timer on power for loads left running ("stuck_on").
+
+    `update` is O(1): it pulls the device's slab into Python floats, runs the recurrences
+    and writes it back. Each (device, metric) is silent during warmup and for `cooldown_s`
+    after it fires.
+    """
+
+    def __init__(
+            self,
+            *,
+            alpha: float = 0.05,
+            baseline_alpha: float = 0.002,
+            z_spike: float = 6.0,
+            cusum_k: float = 0.5,
+            cusum_h: float = 12.0,
+            warmup: int = 30,
+            cooldown_s: float = 900.0,
+            stuck_on_min_w: float = 50.0,
+            stuck_on_rel_std: float = 0.05,
+            stuck_on_sec: float = 8 * 3600,
+            store: Optional[DeviceStateStore] = None,
+            clock: Callable[[], float] = time,
+    ):
+        self.alpha = alpha
+        self.baseline_alpha = baseline_alpha
+        self.z_spike = z_spike
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.warmup = warmup
+        self.cooldown_s = cooldown_s
+        self.stuck_on_min_w = stuck_on_min_w
+        self.stuck_on_rel_std = stuck_on_rel_std
+        self.stuck_on_sec = stuck_on_sec
+        self.clock = clock
+        self.store = store if store is not None else DeviceStateStore()
+        self._lock = self.store.lock
+        self.state = np.empty((0, len(_FIELD_FILL), len(METRICS)))
+        self.dev = np.empty((0, len(_DEV_FILL)))
+        self.store.attach(self)
+
+    # -------- Slots (DeviceStateStore component) --------
+    def _resize(self, capacity: int):
+        state = np.empty((capacity,) + self.state.shape[1:])
+        state[:] = np.array(_FIELD_FILL)[:, None]
+        state[:len(self.state)] = self.state
+        dev = np.empty((capacity, len(_DEV_FILL)))
+        dev[:] = _DEV_FILL
+        dev[:len(self.dev)] = self.dev
+        self.state, self.dev = state, dev
+
+    def _clear_slot(self, k: int, device_id: str):
+        self.state[k] = np.array(_FIELD_FILL)[:, None]
+        self.dev[k] = _DEV_FILL
+
+    def _memory(self) -> dict:
+        return {"bytes": self.state.nbytes + self.dev.nbytes}
+
+    def _export(self, n: int) -> dict:
+        return {"state": self.state[:n].copy(), "dev": self.dev[:n].copy()}
+
+    def _import(self, arrays: dict):
+        if arrays["state"].shape[1:] != self.state.shape[1:]:
+            return  # layout changed between versions; start cold
+        n = len(arrays["state"])
+        self.state[:n] = arrays["state"]
+        self.dev[:n] = arrays["dev"]
+
+    def update(self, device_id: str, payload: dict, ts: Optional[float] = None) -> List[Tuple[str, float, float]]:
+        """
+        Feed one reading (payload keys v, i, p, pf, f; missing ones are skipped).
+        Returns the anomalies raised by this sample as (reason, value, expected).
+        """
+        now = self.clock() if ts is None else ts
+        out: List[Tuple[str, float, float]] = []
+        with self._lock:
+            k = self.store.slot(device_id)
+            mean, var, base, cp, cn, cnt, last = self.state[k].tolist()
+            for j, m in enumerate(METRICS):
+                x = payload.get(m)
+                if x is None:
+                    continue
+                try:
+                    x = float(x)
+                except (TypeError, ValueError):
+                    continue
+                if x != x:
+                    continue
+                n = cnt[j]
+                if n == 0:
+                    mean[j] = base[j] = x
+                mu = mean[j]
+                std = max(math.sqrt(var[j]), _NOISE_FLOOR[j], 0.01 * abs(mu))
+                diff = x - mu
+                z = diff / std
+                spike = False
+                if n >= self.warmup:
+                    # Drift: CUSUM against the slow baseline, spikes clipped so one outlier can't trip it
+                    zb = max(-self.z_spike, min(self.z_spike, (x - base[j]) / std))
+                    cp[j] = max(0.0, cp[j] + zb - self.cusum_k)
+                    cn[j] = max(0.0, cn[j] - zb - self.cusum_k)
+                    spike = abs(z) > self.z_spike
+                    drift = cp[j] > self.cusum_h or cn[j] > self.cusum_h
+                    quiet = now - last[j] >= self.cooldown_s
+                    if spike and quiet:
+                        out.append((f"{_LABELS[j]}_spike", x, mu))
+                        last[j] = now
+                    elif drift and quiet:
+                        out.append((f"{_LABELS[j]}_drift", x, base[j]))
+                        last[j] = now
+                    if drift:
+                        # Re-baseline after a shift so it's reported once, not on every sample
+                        base[j] = mu
+                        cp[j] = cn[j] = 0.0
+                    if spike:
+                        # Clip before it enters the averages so one outlier doesn't poison them
+                        diff = math.copysign(self.z_spike * std, diff)
+                # Bias-corrected EWMA: plain running mean until 1/n drops below alpha
+                a = max(self.alpha, 1.0 / (n + 1))
+                incr = a * diff
+                mean[j] = mu + incr
+                var[j] = (1 - a) * (var[j] + diff * incr)
+                if not spike:
+                    base[j] += max(self.baseline_alpha, 1.0 / (n + 1)) * (x - base[j])
+                cnt[j] = n + 1
+            self.state[k] = (mean, var, base, cp, cn, cnt, last)
+
+            # Stuck-on: power high and flat for a long time
+            if cnt[_P] >= self.warmup and payload.get("p") is not None:
+                steady_since, stuck_fired = self.dev[k].tolist()
+                m_p = mean[_P]
+                if m_p >= self.stuck_on_min_w and math.sqrt(var[_P]) <= self.stuck_on_rel_std * m_p:
+                    if steady_since != steady_since:
+                        steady_since = now
+                    elif now - steady_since >= self.stuck_on_sec and now - stuck_fired >= self.stuck_on_sec:
+                        stuck_fired = now
+                        out.append(("stuck_on", m_p, self.stuck_on_min_w))
+                else:
+                    steady_since = np.nan
+                self.dev[k] = (steady_since, stuck_fired)
+        return out
+
+    def debug_state(self, device_id: str) -> dict:
+        k = self.store.get(device_id)
+        if k is None:
+            return {"device": device_id, "metrics": {}}
+        st = self.state[k]
+        metrics = {}
+        for j, m in enumerate(METRICS):
+            if st[COUNT, j] == 0:
+                continue
+            metrics[m] = {
+                "mean": float(st[MEAN, j]),
+                "std": float(math.sqrt(st[VAR, j])),
+                "baseline": float(st[BASE, j]),
+                "cusum_pos": float(st[CUSUM_POS, j]),
+                "cusum_neg": float(st[CUSUM_NEG, j]),
+                "count": int(st[COUNT, j]),
+            }
+        since = self.dev[k, STEADY_SINCE]
+        return {"device": device_id, "metrics": metrics, "steady_since": None if since != since else float(since)}
@@ -0,0 +1,368 @@
+import csv
+import os
+import warnings
+from datetime import datetime
+from time import perf_counter, time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from ..models import Device, TelemetryAC, TelemetryDC
+from .power_sketch import PowerSketches
+
+COLUMNS = {
+    "dc": ("device_id", "ts", "voltage_v", "current_a", "power_w"),
+    "ac": ("device_id", "ts", "voltage_v", "current_a", "power_w", "pf", "frequency_hz", "energy_wh"),
+}
+_TABLES = {"dc": TelemetryDC, "ac": TelemetryAC}
+_NULLABLE = {"pf", "frequency_hz", "energy_wh"}
+_MIN_TS = datetime(2000, 1, 1).timestamp()
+
+
+# -------- Readers: yield {column: values} blocks --------
+def csv_chunks(path: str, columns: Sequence[str], chunk: int, delimiter: str = ",") -> Iterator[Dict[str, list]]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None) or []
+        pos = {name: header.index(name) for name in columns if name in header}
+        missing = [c for c in columns if c not in pos]
+        if missing:
+            raise ValueError(f"{path}: no column(s) {missing} in header {header}")
+        rows: List[list] = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= chunk:
+                yield _columnar(rows, pos)
+                rows = []
+        if rows:
+            yield _columnar(rows, pos)
+
+
+def _columnar(rows: List[list], pos: Dict[str, int]) -> Dict[str, list]:
+    width = max(pos.values()) + 1
+    rows = [r if len(r) >= width else r + [""] * (width - len(r)) for r in rows]
+    return {name: [r[i] for r in rows] for name, i in pos.items()}
+
+
+def parquet_chunks(path: str, columns: Sequence[str], chunk: int) -> Iterator[Dict[str, object]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("reading Parquet needs pyarrow (pip install pyarrow)") from e
+    f = pq.ParquetFile(path)
+    missing = [c for c in columns if c not in f.schema_arrow.names]
+    if missing:
+        raise ValueError(f"{path}: no column(s) {missing} in {f.schema_arrow.names}")
+    for batch in f.iter_batches(batch_size=chunk, columns=list(columns)):
+        yield {name: batch.column(name).to_numpy(zero_copy_only=False) for name in columns}
+
+
+# -------- Vectorized parsing and validation --------
+def to_floats(values) -> np.ndarray:
+    """Float array; blanks and unparsable cells become NaN."""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    text = np.asarray(values, dtype=str)
+    try:
+        return np.where(np.char.strip(text) == "", "nan", text).astype(np.float64)  # blank cells
+    except ValueError:
+        out = np.empty(len(values))
+        for k, v in enumerate(values):
+            try:
+                out[k] = float(v)
+            except (TypeError, ValueError):
+                out[k] = np.nan
+        return out
+
+
+def to_epochs(values) -> np.ndarray:
+    """Epoch seconds from epoch s/ms numbers, ISO-8601 strings or datetime64; NaN when invalid."""
+    arr = np.asarray(values)
+    if np.issubdtype(arr.dtype, np.datetime64):
+        return np.where(np.isnat(arr), np.nan, arr.astype("datetime64[us]").astype(np.int64) / 1e6)
+    if arr.dtype.kind in "fiu":
+        nums = arr.astype(np.float64)
+    else:
+        text = arr.astype(str)
+        iso = (np.char.find(text, "-") > 0) | (np.char.find(text, ":") >= 0)  # dates vs plain numbers
+        nums = np.full(len(text), np.nan)
+        if (~iso).any():
+            nums[~iso] = to_floats(text[~iso])
+        if iso.any():
+            nums[iso] = _iso_epochs(text[iso])
+    return np.where(nums > 1e11, nums / 1000.0, nums)  # epoch ms from some exports
+
+
+def _iso_epochs(texts: np.ndarray) -> np.ndarray:
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")  # numpy only warns on zone offsets; those take the slow path
+            dt = np.array(texts, dtype="datetime64[us]")  # naive ISO: UTC, as everywhere in this app
+        return np.where(np.isnat(dt), np.nan, dt.astype(np.int64) / 1e6)
+    except (ValueError, Warning):
+        return np.array([_iso(str(t)) for t in texts])
+
+
+def _iso(text: str) -> float:
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return np.nan
+    if dt.tzinfo is None:
+        return (dt - datetime(1970, 1, 1)).total_seconds()
+    return dt.timestamp()
+
+
+# -------- Writers --------
+def _datetime64(ts: np.ndarray) -> np.ndarray:
+    return np.round(ts * 1e6).astype(np.int64).astype("datetime64[us]")
+
+
+class _SqliteSink:
+    """Plain DB-API executemany in large transactions; synchronous=OFF while loading."""
+
+    def __init__(self, engine, table, columns: Sequence[str]):
+        self.conn = engine.raw_connection()
+        self.cur = self.conn.cursor()
+        self.synchronous = self.cur.execute("PRAGMA synchronous").fetchone()[0]
+        self.cur.execute("PRAGMA synchronous=OFF")
+        self.sql = (f'INSERT INTO "{table.__tablename__}" ({", ".join(columns)}) '
+                    f'VALUES ({", ".join("?" * len(columns))})')
+
+    @staticmethod
+    def ts_values(ts: np.ndarray) -> list:
+        # the exact text SQLAlchemy stores for DateTime on SQLite, so range queries keep working
+        return np.char.replace(np.datetime_as_string(_datetime64(ts), unit="us"), "T", " ").tolist()
+
+    def write(self, rows: list):
+        self.cur.executemany(self.sql, rows)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.cur.execute(f"PRAGMA synchronous={int(self.synchronous)}")
+        self.conn.close()
+
+
+class _PostgresSink:
+    """COPY ... FROM STDIN through psycopg 3."""
+
+    def __init__(self, engine, table, columns: Sequence[str]):
+        self.conn = engine.raw_connection()
+        self.cur = self.conn.cursor()
+        self.sql = f'COPY "{table.__tablename__}" ({", ".join(columns)}) FROM STDIN'
+
+    @staticmethod
+    def ts_values(ts: np.ndarray) -> list:
+        return _datetime64(ts).astype(datetime).tolist()
+
+    def write(self, rows: list):
+        with self.cur.copy(self.sql) as copy:
+            for row in rows:
+                copy.write_row(row)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class _OrmSink:
+    """Any other backend: multi-row INSERT through SQLAlchemy."""
+
+    def __init__(self, engine, table, columns: Sequence[str]):
+        self.session = Session(engine)
+        self.table = table
+        self.columns = columns
+
+    ts_values = staticmethod(_PostgresSink.ts_values)
+
+    def write(self, rows: list):
+        self.session.execute(insert(self.table), [dict(zip(self.columns, r)) for r in rows])
+
+    def commit(self):
+        self.session.commit()
+
+    def close(self):
+        self.session.close()
+
+
+def _sink_for(engine):
+    name = engine.dialect.name
+    return _SqliteSink if name == "sqlite" else _PostgresSink if name == "postgresql" else _OrmSink
+
+
+# -------- Loader --------
+class BulkLoader:
+    """
+    Offline load of historical telemetry exports into TelemetryDC/TelemetryAC.
+
+    Files are streamed in blocks of `chunk` rows; each block is parsed and validated with
+    numpy (rows without a device, timestamp or finite power, or with |power| above
+    `max_power_w`, are counted and skipped) and written with the fastest path the backend
+    has: executemany on SQLite (synchronous=OFF, a commit every `txn_rows`), COPY on
+    Postgres. Every accepted reading also goes into the per-device power sketches (the
+    hourly rollups behind /reports/power-quantiles), flushed at each commit, and into a
+    per-device energy total computed like /reports/energy (meter counter delta for AC
+    rows that carry energy_wh, trapezoid over power otherwise). Rows are not checked
+    against what the DB already has, so loading the same export twice duplicates it.
+    """
+
+    def __init__(self, engine, kind: str, *, mapping: Optional[Dict[str, str]] = None,
+                 device_id: Optional[str] = None, power_scale: float = 1.0, energy_scale: float = 1.0,
+                 chunk: int = 50000,
+                 txn_rows: int = 500000, max_power_w: float = 1e6, rollups: bool = True,
+                 sketch_bucket_s: int = 3600, progress: Optional[Callable[[dict], None]] = None):
+        if kind not in COLUMNS:
+            raise ValueError(f"kind must be one of {sorted(COLUMNS)}")
+        self.engine = engine
+        self.kind = kind
+        self.table = _TABLES[kind]
+        self.mapping = mapping or {}
+        self.device_id = device_id
+        self.power_scale = power_scale
+        self.energy_scale = energy_scale
+        self.chunk = chunk
+        self.txn_rows = txn_rows
+        self.max_power_w = max_power_w
+        self.progress = progress
+        self.sketches = PowerSketches(engine, bucket_s=sketch_bucket_s, flush_s=0) if rollups else None
+        self.stats = {"rows": 0, "inserted": 0, "rejected": 0, "seconds": 0.0, "rows_per_s": 0.0}
+        self._energy: Dict[str, list] = {}  # device_id -> [last_ts, last_w, wh, first_counter, last_counter]
+        self.devices: set = set()
+
+    def _wanted(self, available: Optional[Sequence[str]] = None) -> List[str]:
+        cols = [c for c in COLUMNS[self.kind] if not (c == "device_id" and self.device_id)]
+        optional = {"voltage_v", "current_a"} | _NULLABLE
+        if available is not None:
+            cols = [c for c in cols if c not in optional or self.mapping.get(c, c) in available]
+        return cols
+
+    def _blocks(self, path: str, fmt: str, delimiter: str):
+        available = _header(path, fmt, delimiter)
+        wanted = self._wanted(available)
+        src = [self.mapping.get(c, c) for c in wanted]
+        reader = (csv_chunks(path, src, self.chunk, delimiter) if fmt == "csv"
+                  else parquet_chunks(path, src, self.chunk))
+        for block in reader:
+            yield {c: block[s] for c, s in zip(wanted, src)}
+
+    def _parse(self, block: dict):
+        n = len(next(iter(block.values())))
+        ids = (np.full(n, self.device_id, dtype=object) if self.device_id
+               else np.asarray([str(v).strip() if v is not None else "" for v in block["device_id"]], dtype=object))
+        ts = to_epochs(block["ts"])
+        cols = {name: to_floats(block[name]) if name in block else np.full(n, np.nan)
+                for name in ("voltage_v", "current_a", "power_w", "pf", "frequency_hz", "energy_wh")}
+        cols["power_w"] = cols["power_w"] * self.power_scale
+        cols["energy_wh"] = cols["energy_wh"] * self.energy_scale
+        ok = (ids != "") & np.isfinite(ts) & (ts >= _MIN_TS) & (ts <= time() + 86400) \
+            & np.isfinite(cols["power_w"]) & (np.abs(cols["power_w"]) <= self.max_power_w)
+        order = np.lexsort((ts[ok], ids[ok].astype(str)))
+        return ids[ok][order], ts[ok][order], {k: v[ok][order] for k, v in cols.items()}, n - int(ok.sum())
+
+    def _track(self, ids: np.ndarray, ts: np.ndarray, cols: dict):
+        """Rollups and energy for one validated block (sorted by device, ts)."""
+        keys, starts = np.unique(ids.astype(str), return_index=True)
+        bounds = list(starts[1:]) + [len(ids)]
+        for device_id, a, b in zip(keys.tolist(), starts.tolist(), bounds):
+            t, w, e = ts[a:b], cols["power_w"][a:b], cols["energy_wh"][a:b]
+            self.devices.add(device_id)
+            if self.sketches is not None:
+                self.sketches.add_many(device_id, w, t)
+            st = self._energy.get(device_id)
+            if st is None:
+                st = self._energy[device_id] = [None, None, 0.0, None, None]
+            if st[0] is not None and t[0] >= st[0]:  # join with the previous block
+                t, w = np.concatenate([[st[0]], t]), np.concatenate([[st[1]], w])
+            st[2] += float(np.sum((w[1:] + w[:-1]) / 2 * np.diff(t)) / 3600.0)
+            st[0], st[1] = float(t[-1]), float(w[-1])
+            counters = e[np.isfinite(e)]
+            if len(counters):
+                st[3] = float(counters[0]) if st[3] is None else st[3]
+                st[4] = float(counters[-1])
+
+    def _rows(self, sink, ids, ts, cols) -> list:
+        parts = [ids.tolist(), sink.ts_values(ts)]
+        for name in COLUMNS[self.kind][2:]:
+            v = cols[name]
+            if name in _NULLABLE:
+                parts.append([None if x != x else x for x in v.tolist()])
+            else:
+                parts.append(np.nan_to_num(v, nan=0.0).tolist())
+        return list(zip(*parts))
+
+    def load(self, paths: Sequence[str], fmt: Optional[str] = None, delimiter: str = ",") -> dict:
+        t0 = perf_counter()
+        sink = _sink_for(self.engine)(self.engine, self.table, COLUMNS[self.kind])
+        in_txn = 0
+        try:
+            for path in paths:
+                f = fmt or ("parquet" if path.lower().endswith((".parquet", ".pq")) else "csv")
+                for block in self._blocks(path, f, delimiter):
+                    ids, ts, cols, rejected = self._parse(block)
+                    self.stats["rows"] += len(ids) + rejected
+                    self.stats["rejected"] += rejected
+                    if len(ids):
+                        sink.write(self._rows(sink, ids, ts, cols))
+                        self._track(ids, ts, cols)
+                        in_txn += len(ids)
+                        self.stats["inserted"] += len(ids)
+                    if in_txn >= self.txn_rows:
+                        self._commit(sink)
+                        in_txn = 0
+                    self._report(t0, path)
+            self._commit(sink)
+        finally:
+            sink.close()
+        self._report(t0, None)
+        return self.summary()
+
+    def _commit(self, sink):
+        sink.commit()
+        if self.sketches is not None:
+            self.sketches.flush()
+
+    def _report(self, t0: float, path: Optional[str]):
+        secs = perf_counter() - t0
+        self.stats["seconds"] = round(secs, 2)
+        self.stats["rows_per_s"] = round(self.stats["rows"] / secs) if secs > 0 else 0.0
+        if self.progress and path is not None:
+            self.progress({"file": os.path.basename(path), **self.stats})
+
+    def create_devices(self, location: Optional[str] = None) -> int:
+        """Add Device rows for loaded device ids the DB doesn't know yet."""
+        kind = "dc_sensor" if self.kind == "dc" else "ac_sensor"
+        with Session(self.engine) as s:
+            known = set(s.exec(select(Device.device_id).where(Device.device_id.in_(list(self.devices)))).all())
+            new = sorted(self.devices - known)
+            for device_id in new:
+                s.add(Device(device_id=device_id, kind=kind, location=location))
+            s.commit()
+        return len(new)
+
+    def summary(self) -> dict:
+        energy = {}
+        for device_id, (_, _, wh, first, last) in sorted(self._energy.items()):
+            if self.kind == "ac" and first is not None and last is not None and last > first:
+                wh = last - first  # meter counters, as /reports/energy does for AC
+            energy[device_id] = round(wh / 1000.0, 3)
+        return {**self.stats, "devices": len(self.devices), "kwh_total": round(sum(energy.values()), 3),
+                "kwh_by_device": energy}
+
+
+def _header(path: str, fmt: str, delimiter: str) -> List[str]:
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("reading Parquet needs pyarrow (pip install pyarrow)") from e
+        return list(pq.ParquetFile(path).schema_arrow.names)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f, delimiter=delimiter), [])
@@ -0,0 +1,73 @@
+import gzip
+import struct
+import threading
+from time import time
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple
+
+# File: b"SPOCAP1\n" then gzip-compressed records of
+#   <d: receive ts> <I: topic id> <I: payload len> <payload>
+# where a topic id not seen before is followed by <H: topic len> <topic utf-8>. Topics
+# repeat per device, so each is written once; payloads are the raw MQTT bytes.
+MAGIC = b"SPOCAP1\n"
+_REC = struct.Struct("<dII")
+_TOPIC = struct.Struct("<H")
+
+
+class TrafficRecorder:
+    """Append raw MQTT (topic, payload) messages with their receive time to a compact capture file."""
+
+    def __init__(self, path: str, clock: Callable[[], float] = time):
+        self.path = path
+        self.clock = clock
+        self.count = 0
+        self._topics = {}
+        self._lock = threading.Lock()
+        raw = open(path, "wb")
+        raw.write(MAGIC)
+        self._f: Optional[BinaryIO] = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+        self._raw = raw
+
+    def record(self, topic: str, payload: bytes, ts: Optional[float] = None):
+        ts = self.clock() if ts is None else ts
+        with self._lock:
+            if self._f is None:
+                return
+            tid = self._topics.get(topic)
+            if tid is None:
+                tid = self._topics[topic] = len(self._topics)
+                t = topic.encode("utf-8")
+                self._f.write(_REC.pack(ts, tid, len(payload)) + _TOPIC.pack(len(t)) + t + payload)
+            else:
+                self._f.write(_REC.pack(ts, tid, len(payload)) + payload)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._raw.close()
+                self._f = None
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, str, bytes]]:
+    """Yield (receive_ts, topic, payload) from a capture file in recorded order."""
+    with open(path, "rb") as raw:
+        if raw.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        f = gzip.GzipFile(fileobj=raw, mode="rb")
+        topics = {}
+        while True:
+            try:
+                head = f.read(_REC.size)
+                if len(head) < _REC.size:
+                    return
+                ts, tid, n = _REC.unpack(head)
+                if tid not in topics:
+                    (tlen,) = _TOPIC.unpack(f.read(_TOPIC.size))
+                    topics[tid] = f.read(tlen).decode("utf-8")
+                payload = f.read(n)
+            except (EOFError, struct.error):
+                return  # capture cut short (crash, still being written): stop at the last whole record
+            if len(payload) < n:
+                return
+            yield ts, topics[tid], payload
@@ -0,0 +1,59 @@
+import threading
+from time import monotonic, time
+from typing import Callable, Optional
+
+
+class Clock:
+    """
+    The app's notion of "now" (epoch seconds), shared by every service.
+
+    Services take a `clock: Callable[[], float]` (default `time.time`); main.py passes
+    one Clock instance to all of them. It delegates to the wall clock until a replay
+    swaps in a `ReplayClock`, at which point idle windows, rolling buckets, anomaly
+    cooldowns and deadlines all follow replayed time together.
+    """
+
+    def __init__(self, source: Callable[[], float] = time):
+        self._source = source
+
+    def __call__(self) -> float:
+        return self._source()
+
+    def use(self, source: Optional[Callable[[], float]]):
+        """Switch the time source (None -> back to the wall clock)."""
+        self._source = source or time
+
+
+class ReplayClock:
+    """
+    Virtual time for replays.
+
+    With `speed` set (1.0, 100.0, ...) time runs continuously at that multiple of the
+    wall clock from `start`. With speed None ("as fast as possible") it only moves when
+    the replayer calls `advance_to` with the next message's timestamp. Either way it
+    never goes backwards.
+    """
+
+    def __init__(self, start: float, speed: Optional[float] = None):
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._base = start
+        self._wall0 = monotonic()
+
+    def __call__(self) -> float:
+        if self.speed is None:
+            return self._base
+        return self._base + (monotonic() - self._wall0) * self.speed
+
+    def advance_to(self, t: float):
+        with self._lock:
+            now = self()
+            if t > now:
+                self._base = t
+                self._wall0 = monotonic()
+
+    def wall_delay(self, t: float) -> float:
+        """Wall seconds until virtual time reaches t (0 when unpaced or already past)."""
+        if self.speed is None:
+            return 0.0
+        return max(0.0, (t - self()) / self.speed)
@@ -0,0 +1,105 @@
+import heapq
+import threading
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+Key = Tuple[str, str]  # (device_id, kind)
+
+
+class DeadlineScheduler:
+    """
+    Heap-based per-device timers (idle deadline, last-seen timeout, ...).
+
+    `schedule` only records the due time in a dict; a heap entry is pushed when the new
+    deadline is earlier than the one already queued for that key. A device that keeps
+    moving its deadline forward (last-seen refresh on every sample) therefore costs O(1)
+    per sample and at most one O(log n) re-push per period. Popped entries are checked
+    against the dict and either fired, re-queued at the current due time, or dropped, so
+    nothing ever scans the whole fleet.
+    """
+
+    def __init__(self, on_fire: Callable[[str, str, float], None], clock: Callable[[], float] = time):
+        self.on_fire = on_fire  # (kind, device_id, due) -> None, called outside the lock
+        self.clock = clock
+        self._due: Dict[Key, float] = {}     # current deadline per key
+        self._queued: Dict[Key, float] = {}  # earliest heap entry per key
+        self._heap: List[Tuple[float, str, str]] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, device_id: str, kind: str, due: float):
+        key = (device_id, kind)
+        with self._cond:
+            self._due[key] = due
+            queued = self._queued.get(key)
+            if queued is None or due < queued:
+                self._queued[key] = due
+                heapq.heappush(self._heap, (due, device_id, kind))
+                if self._heap[0][0] == due:
+                    self._cond.notify()  # new earliest deadline: wake the timer thread
+
+    def cancel(self, device_id: str, kind: str):
+        with self._cond:
+            self._due.pop((device_id, kind), None)  # heap entry is dropped lazily when popped
+
+    def due(self, device_id: str, kind: str) -> Optional[float]:
+        return self._due.get((device_id, kind))
+
+    def _pop_due(self, now: float) -> List[Tuple[str, str, float]]:
+        fired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            at, device_id, kind = heapq.heappop(heap)
+            key = (device_id, kind)
+            if self._queued.get(key) != at:
+                continue  # superseded by an earlier entry for the same key
+            del self._queued[key]
+            due = self._due.get(key)
+            if due is None:
+                continue  # cancelled
+            if due > now:
+                self._queued[key] = due
+                heapq.heappush(heap, (due, device_id, kind))
+                continue
+            del self._due[key]
+            fired.append((kind, device_id, due))
+        return fired
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Fire every deadline that is due at `now`; returns how many fired."""
+        with self._cond:
+            fired = self._pop_due(self.clock() if now is None else now)
+        for kind, device_id, due in fired:
+            try:
+                self.on_fire(kind, device_id, due)
+            except Exception as e:
+                print(f"[Deadline] {kind} handler error for {device_id}:", e)
+        return len(fired)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = self.clock()
+                wait = (self._heap[0][0] - now) if self._heap else None
+                if wait is None or wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+            self.run_due()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name="deadline-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
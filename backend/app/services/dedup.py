@@ -0,0 +1,78 @@
+from typing import Optional
+
+import numpy as np
+
+from .device_state import DeviceStateStore
+
+
+class SampleDeduper:
+    """
+    Rejects repeat deliveries of a telemetry sample, keyed on (device_id, seq or device ts).
+
+    Each device slot keeps the keys of its last `window` accepted samples in a small ring,
+    so a QoS 1 redelivery or a retried HTTP post is caught with one vectorized compare
+    in memory, never a DB lookup. Keys older than the ring are accepted again; with the
+    default 64 that is minutes of history even for fast reporters, well past broker and
+    gateway retry horizons. Rings are part of the state snapshot, so redeliveries right
+    after a restart are caught too.
+    """
+
+    def __init__(self, store: DeviceStateStore, window: int = 64):
+        self.store = store
+        self.window = window
+        self._lock = store.lock
+        self._keys = np.empty((0, window))
+        self._pos = np.empty(0, dtype=np.int32)
+        self.duplicates = 0
+        store.attach(self)
+
+    # -------- Slots (DeviceStateStore component) --------
+    def _resize(self, capacity: int):
+        keys = np.full((capacity, self.window), np.nan)
+        keys[:len(self._keys)] = self._keys
+        pos = np.zeros(capacity, dtype=np.int32)
+        pos[:len(self._pos)] = self._pos
+        self._keys, self._pos = keys, pos
+
+    def _clear_slot(self, k: int, device_id: str):
+        self._keys[k] = np.nan
+        self._pos[k] = 0
+
+    def _memory(self) -> dict:
+        return {"bytes": self._keys.nbytes + self._pos.nbytes, "duplicates": self.duplicates}
+
+    def _export(self, n: int) -> dict:
+        return {"keys": self._keys[:n].copy(), "pos": self._pos[:n].copy()}
+
+    def _import(self, arrays: dict):
+        if arrays["keys"].shape[1] != self.window:
+            return  # window size changed; rings refill with the next samples
+        n = len(arrays["keys"])
+        self._keys[:n] = arrays["keys"]
+        self._pos[:n] = arrays["pos"]
+
+    # -------- Ingest --------
+    def seen(self, device_id: str, key: Optional[float]) -> bool:
+        """True if `key` was already accepted for this device; otherwise claims it (undo: release). None keys always pass."""
+        if key is None:
+            return False
+        with self._lock:
+            k = self.store.slot(device_id)
+            row = self._keys[k]
+            if (row == key).any():
+                self.duplicates += 1
+                return True
+            p = self._pos[k]
+            row[p] = key
+            self._pos[k] = (p + 1) % self.window
+            return False
+
+    def release(self, device_id: str, key: Optional[float]):
+        """Forget a key claimed by `seen` whose sample was not persisted, so the sender's retry gets in."""
+        if key is None:
+            return
+        with self._lock:
+            k = self.store.get(device_id)
+            if k is not None:
+                row = self._keys[k]
+                row[row == key] = np.nan
@@ -0,0 +1,196 @@
+import base64
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, case, func, or_
+from sqlmodel import Session, select
+
+from ..models import Device, TelemetryAC, TelemetryDC
+
+
+class RuntimeIndex:
+    """
+    device_id sets by runtime state, for device queries: idle or not, and power band.
+
+    Maintained from the ingest callbacks next to FleetSummary. Power bands split at
+    `edges` (W), so "devices drawing 10-100 W" is one set lookup plus an exact check on
+    the bands that straddle the requested range.
+    """
+
+    def __init__(self, edges: Iterable[float] = (1.0, 10.0, 100.0, 1000.0)):
+        self.edges = tuple(edges)
+        self._lock = threading.Lock()
+        self._power: Dict[str, float] = {}
+        self._band_of: Dict[str, int] = {}
+        self._bands: List[Set[str]] = [set() for _ in range(len(self.edges) + 1)]
+        self.idle: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._power)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._power
+
+    def update(self, device_id: str, power_w: float, idle: bool):
+        b = bisect_right(self.edges, power_w)
+        with self._lock:
+            old = self._band_of.get(device_id)
+            if old != b:
+                if old is not None:
+                    self._bands[old].discard(device_id)
+                self._bands[b].add(device_id)
+                self._band_of[device_id] = b
+            self._power[device_id] = power_w
+            if idle:
+                self.idle.add(device_id)
+            else:
+                self.idle.discard(device_id)
+
+    def remove(self, device_id: str):
+        with self._lock:
+            b = self._band_of.pop(device_id, None)
+            if b is not None:
+                self._bands[b].discard(device_id)
+            self._power.pop(device_id, None)
+            self.idle.discard(device_id)
+
+    def power(self, device_id: str) -> Optional[float]:
+        return self._power.get(device_id)
+
+    def in_power_range(self, power_min: Optional[float], power_max: Optional[float]) -> Set[str]:
+        lo = 0 if power_min is None else bisect_right(self.edges, power_min)
+        hi = len(self._bands) - 1 if power_max is None else bisect_right(self.edges, power_max)
+        out: Set[str] = set()
+        with self._lock:
+            for b in range(lo, hi + 1):
+                band = self._bands[b]
+                if b in (lo, hi):  # edge bands: only part of them is in range
+                    out.update(d for d in band if _within(self._power[d], power_min, power_max))
+                else:
+                    out |= band
+        return out
+
+
+def _within(w: float, lo: Optional[float], hi: Optional[float]) -> bool:
+    return (lo is None or w >= lo) and (hi is None or w <= hi)
+
+
+# -------- Cursors --------
+def encode_cursor(device_id: str) -> str:
+    return base64.urlsafe_b64encode(device_id.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    """Raises ValueError on anything encode_cursor didn't produce."""
+    raw = base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True)
+    return raw.decode("utf-8")
+
+
+# -------- Query --------
+_IN_LIST_MAX = 5000  # runtime candidate sets up to this size are paged in memory, larger ones by DB scan
+_COLS = (Device.device_id, Device.name, Device.kind, Device.location, Device.current_power_w)
+
+
+def _prefix(col, q: str):
+    # Range instead of LIKE so a plain b-tree index serves it (case-sensitive, as the index is)
+    return and_(col >= q, col < q + "\U0010ffff")
+
+
+def query_devices(session: Session, *, kind: Optional[str] = None, location: Optional[str] = None,
+                  q: Optional[str] = None, candidates: Optional[Set[str]] = None,
+                  keep: Optional[Callable[[str], bool]] = None, after: Optional[str] = None,
+                  limit: Optional[int] = None) -> Tuple[list, Optional[str]]:
+    """
+    Keyset page of Device rows (device_id, name, kind, location, current_power_w) ordered by device_id.
+
+    Persistent filters (kind, location, name/device_id prefix) go to the DB and its
+    indexes. Runtime filters come as `candidates` (ids known to match; small sets are
+    paged in memory and looked up with IN) and/or `keep` (exact per-id predicate, applied
+    while scanning DB chunks). Returns (rows, last device_id if there may be more).
+    """
+    conds = []
+    if kind is not None:
+        conds.append(Device.kind == kind)
+    if location is not None:
+        conds.append(Device.location == location)
+    if q:
+        conds.append(or_(_prefix(Device.device_id, q), _prefix(Device.name, q)))
+
+    rows: list = []
+    want = limit if limit is not None else None
+    if candidates is not None and len(candidates) <= _IN_LIST_MAX:
+        ids = sorted(d for d in candidates if after is None or d > after)
+        step = max(2 * (want or 250), 100)
+        for i in range(0, len(ids), step):
+            chunk = ids[i:i + step]
+            got = session.exec(select(*_COLS).where(Device.device_id.in_(chunk), *conds)
+                               .order_by(Device.device_id)).all()
+            rows.extend(r for r in got if keep is None or keep(r[0]))
+            if want is not None and len(rows) > want:
+                break
+    else:
+        step = max(4 * (want or 250), 200)
+        cursor = after
+        while True:
+            stmt = select(*_COLS).where(*conds)
+            if cursor is not None:
+                stmt = stmt.where(Device.device_id > cursor)
+            got = session.exec(stmt.order_by(Device.device_id).limit(step)).all()
+            for r in got:
+                if (keep is None or keep(r[0])) and (candidates is None or r[0] in candidates):
+                    rows.append(r)
+            if len(got) < step or (want is not None and len(rows) > want):
+                break
+            cursor = got[-1][0]
+    if want is not None and len(rows) > want:
+        rows = rows[:want]
+        return rows, rows[-1][0]
+    return rows, None
+
+
+# -------- Readings for a page --------
+_TABLES = {"dc_sensor": TelemetryDC, "ac_sensor": TelemetryAC}
+_WINDOWS = (60, 300, 600)
+
+
+def page_readings(session: Session, rows: list, rolling, live=None,
+                  now: Optional[float] = None) -> Dict[str, Tuple[Optional[float], tuple]]:
+    """
+    device_id -> (current W, (avg 1m, 5m, 10m)) for a page of query_devices rows.
+
+    Worker-shared live state first, then this process's RollingStats; devices in neither
+    get Device.current_power_w and their averages from one grouped query per telemetry
+    table for the whole page, instead of four queries per device.
+    """
+    now = rolling.clock() if now is None else now
+    store = rolling.store
+    out: Dict[str, Tuple[Optional[float], tuple]] = {}
+    missing: Dict[object, list] = {}
+    for device_id, _, kind, _, current_w in rows:
+        table = _TABLES.get(kind)
+        if table is None:
+            continue  # switches don't produce telemetry
+        rec = live.read(device_id, now) if live is not None else None
+        if rec is not None:
+            out[device_id] = (rec["payload"].get("p"), (rec["avg_1m_w"], rec["avg_5m_w"], rec["avg_10m_w"]))
+            continue
+        k = store.get(device_id)
+        if k is not None:
+            st = rolling.stats(device_id, now)
+            out[device_id] = (float(store.power_w[k]), (st["avg_1m_w"], st["avg_5m_w"], st["avg_10m_w"]))
+            continue
+        out[device_id] = (current_w, (None, None, None))
+        missing.setdefault(table, []).append(device_id)
+    wall = datetime.utcfromtimestamp(now)
+    for table, ids in missing.items():
+        windows = [func.avg(case((table.ts >= wall - timedelta(seconds=h), table.power_w))) for h in _WINDOWS]
+        got = session.exec(
+            select(table.device_id, *windows)
+            .where(table.device_id.in_(ids), table.ts >= wall - timedelta(seconds=max(_WINDOWS)))
+            .group_by(table.device_id)
+        ).all()
+        for device_id, *avgs in got:
+            out[device_id] = (out[device_id][0], tuple(float(a) if a is not None else None for a in avgs))
+    return out
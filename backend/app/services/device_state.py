@@ -0,0 +1,223 @@
+import json
+import sys
+import threading
+from collections.abc import Mapping
+from time import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+KIND_NONE, KIND_DC, KIND_AC = 0, 1, 2
+
+
+class DeviceStateStore:
+    """
+    Single owner of per-device runtime state.
+
+    Maps device_id -> dense slot index and keeps the hot fields (last seen, current power,
+    kind, last payload) in typed arrays indexed by slot. Services that keep their own
+    per-device arrays (IdleDetector, AnomalyDetector, RollingStats) `attach` here and
+    share the slot numbering and lock, so evicting a silent device frees its state
+    everywhere at once and the slot is reused by the next new device.
+
+    Attached components implement:
+      _resize(capacity)            grow their arrays to `capacity` slots
+      _clear_slot(slot, device_id) reset one slot to its initial state
+      _memory() -> dict            {"bytes": int, ...} for the memory report
+      _export(n) -> dict           arrays describing slots [0, n) for snapshots
+      _import(arrays)              load what _export produced (slot layout is preserved)
+    """
+
+    _INITIAL_CAPACITY = 64
+
+    def __init__(self, capacity: int = _INITIAL_CAPACITY, clock: Callable[[], float] = time):
+        self.clock = clock
+        self.lock = threading.RLock()
+        self._slots: Dict[str, int] = {}
+        self.ids: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._components: list = []
+        self.capacity = 0
+        self.last_seen = np.empty(0)
+        self.power_w = np.empty(0)
+        self.kind = np.empty(0, dtype=np.uint8)
+        self.payload = np.empty(0, dtype=object)
+        self.evicted_total = 0
+        self._resize(max(1, capacity))
+
+    # -------- Layout --------
+    def _resize(self, capacity: int):
+        old = self.capacity
+        for name, dtype, fill in (("last_seen", np.float64, np.nan), ("power_w", np.float64, np.nan),
+                                  ("kind", np.uint8, KIND_NONE), ("payload", object, None)):
+            arr = np.full(capacity, fill, dtype=dtype)
+            arr[:old] = getattr(self, name)
+            setattr(self, name, arr)
+        self.capacity = capacity
+        for c in self._components:
+            c._resize(capacity)
+
+    def attach(self, component):
+        with self.lock:
+            self._components.append(component)
+            component._resize(self.capacity)
+
+    # -------- Slots --------
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._slots
+
+    def get(self, device_id: str) -> Optional[int]:
+        return self._slots.get(device_id)
+
+    def slot(self, device_id: str) -> int:
+        """Slot for device_id, allocating (or reusing an evicted) one on first sight."""
+        k = self._slots.get(device_id)
+        if k is not None:
+            return k
+        with self.lock:
+            k = self._slots.get(device_id)
+            if k is not None:
+                return k
+            if self._free:
+                k = self._free.pop()
+                self.ids[k] = device_id
+            else:
+                k = len(self.ids)
+                if k >= self.capacity:
+                    self._resize(self.capacity * 2)
+                self.ids.append(device_id)
+            self._slots[device_id] = k
+            return k
+
+    def touch(self, device_id: str, kind: int, payload: dict, power_w: float, ts: Optional[float] = None) -> bool:
+        """Record a reading's hot fields; returns True when the device was just (re)admitted."""
+        with self.lock:
+            new = device_id not in self._slots
+            k = self.slot(device_id)
+            self.last_seen[k] = self.clock() if ts is None else ts
+            self.power_w[k] = power_w
+            self.kind[k] = kind
+            self.payload[k] = payload
+            return new
+
+    def latest(self, device_id: str, kind: Optional[int] = None) -> Optional[dict]:
+        k = self._slots.get(device_id)
+        if k is None or (kind is not None and self.kind[k] != kind):
+            return None
+        return self.payload[k]
+
+    # -------- Eviction --------
+    def evict(self, device_id: str) -> bool:
+        with self.lock:
+            k = self._slots.pop(device_id, None)
+            if k is None:
+                return False
+            for c in self._components:
+                c._clear_slot(k, device_id)
+            self.last_seen[k] = np.nan
+            self.power_w[k] = np.nan
+            self.kind[k] = KIND_NONE
+            self.payload[k] = None
+            self.ids[k] = None
+            self._free.append(k)
+            self.evicted_total += 1
+            return True
+
+    def least_recent(self) -> Optional[str]:
+        """The device seen longest ago (what a memory cap evicts first), None if there is none."""
+        with self.lock:
+            n = len(self.ids)
+            seen = np.nan_to_num(self.last_seen[:n], nan=np.inf)
+            seen[self._free] = np.inf
+            if not n:
+                return None
+            k = int(np.argmin(seen))
+            return self.ids[k] if np.isfinite(seen[k]) else None
+
+    # -------- Snapshot --------
+    def export_state(self) -> Dict[str, np.ndarray]:
+        """Copy of every slot's state (store + attached components) as flat numpy arrays.
+
+        "store.taken_at" is the clock read under the lock: every sample ingested before it is
+        in the copy, every later one is not.
+        """
+        with self.lock:
+            n = len(self.ids)
+            out = {
+                "store.taken_at": np.array(self.clock()),
+                "store.ids": np.array([d or "" for d in self.ids], dtype=str),
+                "store.last_seen": self.last_seen[:n].copy(),
+                "store.power_w": self.power_w[:n].copy(),
+                "store.kind": self.kind[:n].copy(),
+                "store.payload": np.array([json.dumps(p) if p is not None else "" for p in self.payload[:n]],
+                                          dtype=str),
+            }
+            for c in self._components:
+                prefix = type(c).__name__ + "."
+                out.update({prefix + k: v for k, v in c._export(n).items()})
+            return out
+
+    def import_state(self, arrays: Dict[str, np.ndarray]) -> int:
+        """Load an `export_state` result into this (empty) store; returns the number of devices restored."""
+        with self.lock:
+            if self._slots:
+                raise RuntimeError("import_state needs an empty store")
+            ids = [str(d) for d in arrays["store.ids"]]
+            n = len(ids)
+            self._resize(max(self.capacity, n))
+            self.ids = [d or None for d in ids]
+            self._slots = {d: k for k, d in enumerate(ids) if d}
+            self._free = [k for k, d in enumerate(ids) if not d]
+            self.last_seen[:n] = arrays["store.last_seen"]
+            self.power_w[:n] = arrays["store.power_w"]
+            self.kind[:n] = arrays["store.kind"]
+            self.payload[:n] = [json.loads(p) if p else None for p in arrays["store.payload"]]
+            for c in self._components:
+                prefix = type(c).__name__ + "."
+                part = {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+                if part:
+                    c._import(part)
+            return len(self._slots)
+
+    # -------- Introspection --------
+    def memory_report(self) -> dict:
+        with self.lock:
+            arrays = sum(getattr(self, n).nbytes for n in ("last_seen", "power_w", "kind", "payload"))
+            payloads = sum(sys.getsizeof(p) for p in self.payload if p is not None)
+            components = {type(c).__name__: c._memory() for c in self._components}
+            return {
+                "devices": len(self._slots),
+                "capacity": self.capacity,
+                "free_slots": len(self._free),
+                "evicted_total": self.evicted_total,
+                "store_bytes": arrays + payloads + sys.getsizeof(self._slots),
+                "components": components,
+                "total_bytes": arrays + payloads + sys.getsizeof(self._slots)
+                               + sum(c.get("bytes", 0) for c in components.values()),
+            }
+
+
+class LatestPayloads(Mapping):
+    """Read-only device_id -> last payload view over the store for one telemetry kind."""
+
+    def __init__(self, store: DeviceStateStore, kind: int):
+        self.store = store
+        self.kind = kind
+
+    def __getitem__(self, device_id: str) -> dict:
+        p = self.store.latest(device_id, self.kind)
+        if p is None:
+            raise KeyError(device_id)
+        return p
+
+    def __iter__(self):
+        for k, device_id in enumerate(list(self.store.ids)):
+            if device_id is not None and self.store.kind[k] == self.kind:
+                yield device_id
+
+    def __len__(self) -> int:
+        n = len(self.store.ids)
+        return int(np.count_nonzero(self.store.kind[:n] == self.kind))
@@ -0,0 +1,181 @@
+import base64
+import gzip
+import json
+import threading
+from datetime import datetime
+from time import time
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select
+
+from ..models import Alert, PowerSketch, SyncCursor
+from .power_sketch import QuantileSketch
+
+_START = (datetime(1970, 1, 1), 0)
+
+
+class RollupForwarder:
+    """
+    Edge -> central upload of the per-device power sketches (the compressed hourly rollups).
+
+    Rows are read in keyset order of (updated_at, id) after a cursor kept in the
+    sync_cursor table, posted gzip-compressed to `<url>/edge/rollups`, and the cursor only
+    moves once the central instance answered 2xx. A link outage or a restart therefore
+    resumes exactly where the last accepted upload ended; a bucket that gets more samples
+    later is re-sent whole (the central side replaces it). Rows written in the last
+    `settle_s` are left for the next round so an in-flight flush is never skipped.
+    Alerts travel separately, through the notification outbox (see main._init_services).
+    """
+
+    STREAM = "power_sketch"
+
+    def __init__(self, engine, url: str, site: str, token: Optional[str] = None, interval_s: float = 60.0,
+                 batch: int = 500, settle_s: float = 5.0, max_backoff_s: float = 900.0,
+                 client: Optional[httpx.Client] = None, clock: Callable[[], float] = time):
+        self.engine = engine
+        self.url = url.rstrip("/") + "/edge/rollups"
+        self.site = site
+        self.interval_s = interval_s
+        self.batch = batch
+        self.settle_s = settle_s
+        self.max_backoff_s = max_backoff_s
+        self.clock = clock
+        self.headers = {"Content-Type": "application/json", "Content-Encoding": "gzip", "X-Edge-Site": site}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        self.client = client
+        self.stats: Dict[str, object] = {"uploads": 0, "rows": 0, "bytes": 0, "failures": 0,
+                                         "last_ok_at": None, "last_error": None}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -------- Cursor --------
+    def cursor(self) -> Tuple[datetime, int]:
+        with Session(self.engine) as s:
+            row = s.get(SyncCursor, self.STREAM)
+        if row is None:
+            return _START
+        ts, _, last_id = row.position.partition("|")
+        return datetime.fromisoformat(ts), int(last_id)
+
+    def _save_cursor(self, ts: datetime, last_id: int):
+        with Session(self.engine) as s:
+            row = s.get(SyncCursor, self.STREAM) or SyncCursor(name=self.STREAM, position="")
+            row.position, row.updated_at = f"{ts.isoformat()}|{last_id}", datetime.utcnow()
+            s.add(row)
+            s.commit()
+
+    # -------- Upload --------
+    def _page(self, after: Tuple[datetime, int]) -> list:
+        ts, last_id = after
+        settled = datetime.utcfromtimestamp(self.clock() - self.settle_s)
+        with Session(self.engine) as s:
+            return s.exec(
+                select(PowerSketch)
+                .where(or_(PowerSketch.updated_at > ts, and_(PowerSketch.updated_at == ts, PowerSketch.id > last_id)),
+                       PowerSketch.updated_at < settled)
+                .order_by(PowerSketch.updated_at, PowerSketch.id)
+                .limit(self.batch)
+            ).all()
+
+    def _post(self, rows: list):
+        body = gzip.compress(json.dumps({"site": self.site, "sketches": [
+            {"device_id": r.device_id, "bucket_start": r.bucket_start.isoformat(), "samples": r.samples,
+             "data": base64.b64encode(r.data).decode()} for r in rows
+        ]}).encode())
+        if self.client is None:
+            self.client = httpx.Client(timeout=30.0)
+        r = self.client.post(self.url, content=body, headers=self.headers)
+        r.raise_for_status()
+        self.stats["bytes"] += len(body)
+
+    def sync_once(self) -> int:
+        """Upload everything after the cursor; returns rows sent. Raises if the link or central fails."""
+        sent = 0
+        after = self.cursor()
+        while True:
+            rows = self._page(after)
+            if not rows:
+                break
+            self._post(rows)
+            after = (rows[-1].updated_at, rows[-1].id)
+            self._save_cursor(*after)
+            sent += len(rows)
+            self.stats["uploads"] += 1
+            if len(rows) < self.batch:
+                break
+        self.stats["rows"] += sent
+        self.stats["last_ok_at"] = self.clock()
+        return sent
+
+    def _loop(self):
+        delay = self.interval_s
+        while not self._stop.wait(delay):
+            try:
+                self.sync_once()
+                delay = self.interval_s
+            except Exception as e:
+                self.stats["failures"] += 1
+                self.stats["last_error"] = f"{type(e).__name__}: {e}"
+                delay = min(self.max_backoff_s, max(delay, 1.0) * 2)  # link down: back off, keep the cursor
+                print(f"[EdgeSync] upload failed, retrying in {delay:.0f}s: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="edge-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self) -> dict:
+        ts, last_id = self.cursor()
+        return {"url": self.url, "site": self.site, "cursor": {"updated_at": ts.isoformat(), "id": last_id},
+                **self.stats}
+
+
+# -------- Central side --------
+def store_rollups(session: Session, sketches: list) -> int:
+    """Upsert uploaded power sketch rows (the edge is authoritative for its devices' buckets)."""
+    n = 0
+    for item in sketches:
+        data = base64.b64decode(item["data"])
+        QuantileSketch.from_bytes(data)  # rejects garbage / another accuracy with ValueError
+        start = datetime.fromisoformat(item["bucket_start"])
+        row = session.exec(select(PowerSketch).where(PowerSketch.device_id == item["device_id"],
+                                                     PowerSketch.bucket_start == start)).first()
+        if row is None:
+            row = PowerSketch(device_id=item["device_id"], bucket_start=start, data=b"")
+        row.samples, row.data, row.updated_at = int(item["samples"]), data, datetime.utcnow()
+        session.add(row)
+        n += 1
+    return n
+
+
+def _dt(value) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def store_alert_events(session: Session, site: str, events: list) -> int:
+    """Mirror alert.created / alert.closed outbox events of an edge site as Alert rows (idempotent)."""
+    n = 0
+    for ev in events:
+        data = ev.get("data") or {}
+        if ev.get("type") not in ("alert.created", "alert.closed") or data.get("alert_id") is None:
+            continue
+        a = session.exec(select(Alert).where(Alert.site == site, Alert.site_alert_id == data["alert_id"])).first()
+        if a is None:
+            a = Alert(site=site, site_alert_id=data["alert_id"], device_id=data.get("device_id", ""),
+                      reason=data.get("reason", "idle_detected"), threshold_w=data.get("threshold_w") or 0.0,
+                      duration_s=data.get("duration_s") or 0, status="open",
+                      ts_open=_dt(data.get("ts_open")) or _dt(ev.get("ts")) or datetime.utcnow())
+        if ev["type"] == "alert.closed" and a.status != "closed":  # may arrive before its alert.created
+            a.status = "closed"
+            a.ts_close = _dt(data.get("ts_close")) or _dt(ev.get("ts")) or datetime.utcnow()
+        session.add(a)
+        n += 1
+    return n
@@ -0,0 +1,218 @@
+import heapq
+import threading
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class IndexedHeap:
+    """
+    Binary min-heap of (value, key) with a key -> position index.
+
+    `set` (insert or change a key's value) and `remove` are O(log n); `smallest(k)`
+    walks the heap with a k-sized frontier, so it costs O(k log k) regardless of n.
+    For a max-heap, store negated values.
+    """
+
+    def __init__(self):
+        self._vals: List[float] = []
+        self._keys: List[Hashable] = []
+        self._pos: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self._pos
+
+    def _swap(self, i: int, j: int):
+        vals, keys, pos = self._vals, self._keys, self._pos
+        vals[i], vals[j] = vals[j], vals[i]
+        keys[i], keys[j] = keys[j], keys[i]
+        pos[keys[i]] = i
+        pos[keys[j]] = j
+
+    def _up(self, i: int):
+        vals = self._vals
+        while i:
+            parent = (i - 1) >> 1
+            if vals[i] >= vals[parent]:
+                return
+            self._swap(i, parent)
+            i = parent
+
+    def _down(self, i: int):
+        vals, n = self._vals, len(self._vals)
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                return
+            if child + 1 < n and vals[child + 1] < vals[child]:
+                child += 1
+            if vals[i] <= vals[child]:
+                return
+            self._swap(i, child)
+            i = child
+
+    def set(self, key, value: float):
+        i = self._pos.get(key)
+        if i is None:
+            self._pos[key] = len(self._keys)
+            self._vals.append(value)
+            self._keys.append(key)
+            self._up(len(self._keys) - 1)
+            return
+        old = self._vals[i]
+        self._vals[i] = value
+        if value < old:
+            self._up(i)
+        elif value > old:
+            self._down(i)
+
+    def remove(self, key) -> bool:
+        i = self._pos.pop(key, None)
+        if i is None:
+            return False
+        last_val, last_key = self._vals.pop(), self._keys.pop()
+        if i < len(self._keys):
+            self._vals[i], self._keys[i] = last_val, last_key
+            self._pos[last_key] = i
+            self._up(i)
+            self._down(self._pos[last_key])
+        return True
+
+    def smallest(self, k: int) -> List[Tuple[Hashable, float]]:
+        out = []
+        vals, keys, n = self._vals, self._keys, len(self._vals)
+        frontier = [(vals[0], 0)] if n else []
+        while frontier and len(out) < k:
+            v, i = heapq.heappop(frontier)
+            out.append((keys[i], v))
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < n:
+                    heapq.heappush(frontier, (vals[c], c))
+        return out
+
+
+_METRICS = ("current", "avg_5m")
+
+
+class FleetSummary:
+    """
+    Fleet-wide power aggregates kept up to date from the ingest callbacks.
+
+    Every reading moves its device's contribution in the running totals (overall, per
+    telemetry kind, per location) by the delta from its previous reading and re-keys
+    it in a max- and a min-IndexedHeap for both current and 5-minute power, so the
+    summary for the ops wall costs O(k log k + locations) no matter the fleet size.
+    Offline devices leave the totals and rankings until they report again; evicted
+    devices are forgotten. The 5-minute figure is as of each device's last sample.
+    """
+
+    _RESYNC_EVERY = 100_000  # recompute totals from the per-device values to shed float drift
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices: Dict[str, list] = {}  # device_id -> [kind, current_w, avg_5m_w, idle]; reporting only
+        self._location: Dict[str, Optional[str]] = {}  # from the Device table
+        self._top = {m: IndexedHeap() for m in _METRICS}  # negated values
+        self._bottom = {m: IndexedHeap() for m in _METRICS}
+        self._total = 0.0
+        self._by_kind: Dict[str, float] = {}
+        self._by_location: Dict[Optional[str], float] = {}
+        self._count_by_kind: Dict[str, int] = {}
+        self._idle = 0
+        self._offline = set()
+        self._updates = 0
+
+    # -------- Totals --------
+    def _add(self, device_id: str, kind: str, watts: float, sign: int):
+        loc = self._location.get(device_id)
+        w = sign * watts
+        self._total += w
+        self._by_kind[kind] = self._by_kind.get(kind, 0.0) + w
+        self._by_location[loc] = self._by_location.get(loc, 0.0) + w
+        self._count_by_kind[kind] = self._count_by_kind.get(kind, 0) + sign
+
+    def _resync(self):
+        self._total, self._by_kind, self._by_location, self._count_by_kind = 0.0, {}, {}, {}
+        for device_id, (kind, current, _, _) in self._devices.items():
+            self._add(device_id, kind, current, 1)
+
+    def _drop(self, device_id: str) -> Optional[list]:
+        rec = self._devices.pop(device_id, None)
+        if rec is None:
+            return None
+        self._add(device_id, rec[0], rec[1], -1)
+        self._idle -= rec[3]
+        for m in _METRICS:
+            self._top[m].remove(device_id)
+            self._bottom[m].remove(device_id)
+        return rec
+
+    # -------- Updates (ingest side) --------
+    def update(self, device_id: str, kind: str, current_w: float, avg_5m_w: Optional[float], idle: bool):
+        avg = current_w if avg_5m_w is None else avg_5m_w
+        with self._lock:
+            rec = self._devices.get(device_id)
+            if rec is None:
+                rec = self._devices[device_id] = [kind, 0.0, 0.0, False]
+                self._count_by_kind[kind] = self._count_by_kind.get(kind, 0) + 1
+                self._offline.discard(device_id)
+            elif rec[0] != kind:
+                self._add(device_id, rec[0], rec[1], -1)
+                self._add(device_id, kind, 0.0, 1)
+                rec[0], rec[1] = kind, 0.0
+            delta = current_w - rec[1]
+            self._total += delta
+            self._by_kind[kind] = self._by_kind.get(kind, 0.0) + delta
+            loc = self._location.get(device_id)
+            self._by_location[loc] = self._by_location.get(loc, 0.0) + delta
+            self._idle += idle - rec[3]
+            rec[1], rec[2], rec[3] = current_w, avg, idle
+            self._top["current"].set(device_id, -current_w)
+            self._bottom["current"].set(device_id, current_w)
+            self._top["avg_5m"].set(device_id, -avg)
+            self._bottom["avg_5m"].set(device_id, avg)
+            self._updates += 1
+            if self._updates % self._RESYNC_EVERY == 0:
+                self._resync()
+
+    def set_offline(self, device_id: str):
+        with self._lock:
+            self._drop(device_id)
+            self._offline.add(device_id)
+
+    def remove(self, device_id: str):
+        """Forget an evicted device."""
+        with self._lock:
+            self._drop(device_id)
+            self._offline.discard(device_id)
+
+    def set_location(self, device_id: str, location: Optional[str]):
+        with self._lock:
+            rec = self._devices.get(device_id)
+            old = self._location.get(device_id)
+            if rec is not None and old != location:
+                self._by_location[old] = self._by_location.get(old, 0.0) - rec[1]
+                self._by_location[location] = self._by_location.get(location, 0.0) + rec[1]
+            self._location[device_id] = location
+
+    # -------- Read side --------
+    def summary(self, n: int = 20, by: str = "current") -> dict:
+        if by not in _METRICS:
+            raise ValueError(f"by must be one of {_METRICS}")
+        with self._lock:
+            loc = self._location
+            top = [(d, -v) for d, v in self._top[by].smallest(n)]
+            bottom = self._bottom[by].smallest(n)
+            return {
+                "total_w": round(self._total, 3),
+                "by_kind": {k: {"power_w": round(w, 3), "devices": self._count_by_kind.get(k, 0)}
+                            for k, w in self._by_kind.items()},
+                "by_location": {("" if k is None else k): round(w, 3) for k, w in self._by_location.items()},
+                "reporting": len(self._devices),
+                "idle": self._idle,
+                "offline": len(self._offline),
+                "by": by,
+                "top": [{"device_id": d, "power_w": round(v, 3), "location": loc.get(d)} for d, v in top],
+                "bottom": [{"device_id": d, "power_w": round(v, 3), "location": loc.get(d)} for d, v in bottom],
+            }
@@ -1,52 +1,250 @@
 from collections import deque
 from time import time
-from typing import Dict, Deque, Tuple, Optional
+from typing import Callable, Dict, Tuple, Optional, Sequence
+
+import numpy as np
+
+from .device_state import DeviceStateStore
 
 
 class IdleDetector:
     """
-    Simple moving-average idle detector with per-device overrides.
+    Time-window idle detector with per-device overrides.
 
-    We append (timestamp, watts) and compute a fixed-size moving average (last N samples).
-    For MVP we keep a small window (e.g., 5 samples). Duration logic is time-based.
+    Each device keeps its (ts, watts) samples from the last `window_s` seconds plus a
+    running sum, so the moving average costs O(1) amortized per sample. Timestamps come
+    from the device when given (the injected clock otherwise). Per-device scalars (effective
+    overrides, below-threshold start, last timestamp, window sum) live in struct-of-arrays
+    numpy buffers indexed by the shared DeviceStateStore slot, so `add_batch` can evaluate
+    a whole array of samples at once for bulk ingest and replay.
     """
 
-    def __init__(self, default_threshold_w: float, default_duration_s: int, window: int = 5):
-        self.default_threshold = default_threshold_w
-        self.default_duration = default_duration_s
-        self.window = window
-        self.buffers: Dict[str, Deque[float]] = {}  # device_id -> last W samples
-        self.below_since: Dict[str, Optional[float]] = {}  # device_id -> ts when avg dropped below or None
+    def __init__(self, default_threshold_w: float, default_duration_s: int, window_s: float = 60.0,
+                 store: Optional[DeviceStateStore] = None, clock: Callable[[], float] = time):
+        self.default_threshold = float(default_threshold_w)
+        self.default_duration = int(default_duration_s)
+        self.window_s = float(window_s)
+        self.clock = clock  # only for samples without a device timestamp
+        # Configured overrides (bounded by the Device table); copied into the slot arrays on admission
         self.overrides: Dict[str, Tuple[float, int]] = {}  # device_id -> (threshold_w, duration_s)
+        self.store = store if store is not None else DeviceStateStore()
+        self._lock = self.store.lock
+        self._threshold = np.empty(0)    # effective threshold per slot
+        self._duration = np.empty(0)     # effective duration per slot
+        self._below_since = np.empty(0)  # ts when avg dropped below threshold, NaN -> not below
+        self._last_ts = np.empty(0)      # newest sample ts seen
+        self._win_sum = np.empty(0)      # sum of watts currently in the window
+        self._buf = np.empty(0, dtype=object)  # deque of (ts, watts) inside the window
+        self.store.attach(self)
+
+    # -------- Slots (DeviceStateStore component) --------
+    _FIELDS = (("_threshold", np.float64, np.nan), ("_duration", np.float64, np.nan),
+               ("_below_since", np.float64, np.nan), ("_last_ts", np.float64, np.nan),
+               ("_win_sum", np.float64, 0.0), ("_buf", object, None))
+
+    def _resize(self, capacity: int):
+        for name, dtype, fill in self._FIELDS:
+            old = getattr(self, name)
+            arr = np.full(capacity, fill, dtype=dtype)
+            arr[:len(old)] = old
+            setattr(self, name, arr)
+
+    def _clear_slot(self, k: int, device_id: str):
+        for name, _, fill in self._FIELDS:
+            getattr(self, name)[k] = fill
+
+    def _memory(self) -> dict:
+        samples = sum(len(b) for b in self._buf if b is not None)
+        arrays = sum(getattr(self, name).nbytes for name, _, _ in self._FIELDS)
+        # deque of 2-tuples of floats: ~8 B slot + 56 B tuple + 2 x 24 B float
+        return {"bytes": arrays + samples * 112, "window_samples": samples, "overrides": len(self.overrides)}
 
+    def _export(self, n: int) -> dict:
+        lens = [len(b) if b is not None else 0 for b in self._buf[:n]]
+        flat = [x for b in self._buf[:n] if b is not None for x in b]
+        out = {name: getattr(self, name)[:n].copy() for name, dtype, _ in self._FIELDS if dtype is not object}
+        out["buf_len"] = np.array(lens, dtype=np.int64)
+        out["buf"] = np.array(flat, dtype=np.float64).reshape(-1, 2)  # (ts, watts)
+        out["has_buf"] = np.array([b is not None for b in self._buf[:n]])
+        return out
+
+    def _import(self, arrays: dict):
+        n = len(arrays["buf_len"])
+        for name, dtype, _ in self._FIELDS:
+            if dtype is not object:
+                getattr(self, name)[:n] = arrays[name]
+        offsets = np.concatenate([[0], np.cumsum(arrays["buf_len"])])
+        buf = arrays["buf"].tolist()
+        for k in np.flatnonzero(arrays["has_buf"]):
+            self._buf[k] = deque(tuple(x) for x in buf[offsets[k]:offsets[k + 1]])
+
+    def _slot_for(self, device_id: str) -> int:
+        k = self.store.slot(device_id)
+        if self._buf[k] is None:
+            th, du = self.overrides.get(device_id, (self.default_threshold, self.default_duration))
+            self._threshold[k], self._duration[k] = th, du
+            self._buf[k] = deque()
+        return k
+
+    # -------- Config --------
     def set_overrides(self, device_id: str, threshold_w: Optional[float], duration_s: Optional[int]):
-        if threshold_w is None and duration_s is None:
-            self.overrides.pop(device_id, None)
-        else:
-            th = threshold_w if threshold_w is not None else self.default_threshold
-            du = duration_s if duration_s is not None else self.default_duration
-            self.overrides[device_id] = (float(th), int(du))
+        with self._lock:
+            if threshold_w is None and duration_s is None:
+                self.overrides.pop(device_id, None)
+            else:
+                th = threshold_w if threshold_w is not None else self.default_threshold
+                du = duration_s if duration_s is not None else self.default_duration
+                self.overrides[device_id] = (float(th), int(du))
+            k = self.store.get(device_id)
+            if k is not None and self._buf[k] is not None:
+                self._threshold[k], self._duration[k] = self._cfg(device_id)
 
     def _cfg(self, device_id: str) -> Tuple[float, int]:
         return self.overrides.get(device_id, (self.default_threshold, self.default_duration))
 
-    def add(self, device_id: str, watts: float) -> bool:
-        buf = self.buffers.setdefault(device_id, deque(maxlen=self.window))
-        buf.append(float(watts))
-        avg = sum(buf) / len(buf)
-        th, du = self._cfg(device_id)
-        now = time()
-        if avg < th:
-            if self.below_since.get(device_id) is None:
-                self.below_since[device_id] = now
-            elapsed = now - self.below_since[device_id]
-            ready = elapsed >= du
-            # DEBUG ↓↓↓
-            print(f"[IdleDetector] {device_id}: avg={avg:.2f}W<th={th:.2f}W, "
-                  f"elapsed={elapsed:.1f}s/{du}s, window={len(buf)}, trigger={ready}")
-            return ready
-        else:
-            # DEBUG ↓↓↓
-            print(f"[IdleDetector] {device_id}: avg={avg:.2f}W>=th={th:.2f}W, reset timer")
-            self.below_since[device_id] = None
+    # -------- Single sample (live ingest) --------
+    def add(self, device_id: str, watts: float, ts: Optional[float] = None) -> bool:
+        """Feed one sample; returns True once the window average has stayed below threshold for the duration."""
+        w = float(watts)
+        with self._lock:
+            k = self._slot_for(device_id)
+            now = self.clock() if ts is None else float(ts)
+            last = self._last_ts[k]
+            if now < last:  # late/out-of-order sample: keep the window monotonic
+                now = last
+            self._last_ts[k] = now
+
+            buf = self._buf[k]
+            buf.append((now, w))
+            cutoff = now - self.window_s
+            total = self._win_sum[k] + w
+            while len(buf) > 1 and buf[0][0] <= cutoff:
+                total -= buf.popleft()[1]
+            if len(buf) == 1:
+                total = w  # resync the running sum, avoids float drift
+            self._win_sum[k] = total
+            avg = total / len(buf)
+
+            if avg < self._threshold[k]:
+                since = self._below_since[k]
+                if since != since:
+                    since = self._below_since[k] = now
+                return now - since >= self._duration[k]
+            self._below_since[k] = np.nan
             return False
+
+    # -------- Batch (bulk ingest / replay) --------
+    def add_batch(self, device_ids: Sequence[str], ts, watts) -> np.ndarray:
+        """
+        Evaluate many samples at once. Returns a bool array aligned with the input that is True
+        where `add` would have returned True. Samples of one device are evaluated in timestamp order;
+        NaN timestamps take the clock.
+        """
+        ids = np.asarray(device_ids)
+        ts = np.asarray(ts, dtype=np.float64).copy()
+        w = np.asarray(watts, dtype=np.float64)
+        n = len(ids)
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        if not (len(ts) == len(w) == n):
+            raise ValueError("device_ids, ts and watts must have the same length")
+        ts[np.isnan(ts)] = self.clock()
+
+        with self._lock:
+            uniq, inv = np.unique(ids, return_inverse=True)
+            uslots = np.fromiter((self._slot_for(str(d)) for d in uniq), dtype=np.int64, count=len(uniq))
+            slots = uslots[inv]
+            ts = np.fmax(ts, self._last_ts[slots])  # same monotonic clamp as `add`
+
+            # Prepend each device's carried-over window so averages span the batch boundary
+            carried = [self._buf[k] for k in uslots]
+            c_len = np.fromiter((len(b) for b in carried), dtype=np.int64, count=len(uniq))
+            c_total = int(c_len.sum())
+            c_rank = np.repeat(np.arange(len(uniq)), c_len)
+            c_ts = np.fromiter((t for b in carried for t, _ in b), dtype=np.float64, count=c_total)
+            c_w = np.fromiter((x for b in carried for _, x in b), dtype=np.float64, count=c_total)
+
+            rank = np.concatenate([c_rank, inv])
+            all_ts = np.concatenate([c_ts, ts])
+            all_w = np.concatenate([c_w, w])
+            seq = np.arange(c_total + n)  # carried first, then input order
+            order = np.lexsort((seq, all_ts, rank))
+            rank, all_ts, all_w, seq = rank[order], all_ts[order], all_w[order], seq[order]
+
+            # Windowed means via cumulative sums over a (device, ts) monotone key
+            t0 = all_ts.min()
+            span = (all_ts.max() - t0) + self.window_s + 1.0
+            key = rank * span + (all_ts - t0)
+            idx = np.arange(len(key))
+            start = np.minimum(np.searchsorted(key, key - self.window_s, side="right"), idx)
+            cs = np.concatenate([[0.0], np.cumsum(all_w)])
+            mean = (cs[idx + 1] - cs[start]) / (idx + 1 - start)
+
+            # Threshold/duration state machine over the new samples only
+            new = seq >= c_total
+            r, t, m = rank[new], all_ts[new], mean[new]
+            s = uslots[r]
+            th = self._threshold[s]
+            du = self._duration[s]
+            below = m < th
+            first = np.ones(len(r), dtype=bool)
+            first[1:] = r[1:] != r[:-1]
+            prev_below = np.zeros(len(r), dtype=bool)
+            prev_below[1:] = below[:-1]
+            run_start = below & (first | ~prev_below)
+            prior = self._below_since[s]
+            start_val = np.where(first & ~np.isnan(prior), prior, t)
+            run_idx = np.maximum.accumulate(np.where(run_start, np.arange(len(r)), 0))
+            since = start_val[run_idx]
+            fired = below & (t - since >= du)
+
+            # Persist per-device state from the last sample of each device
+            last = np.ones(len(r), dtype=bool)
+            last[:-1] = r[1:] != r[:-1]
+            ls = uslots[r[last]]
+            self._last_ts[ls] = t[last]
+            self._below_since[ls] = np.where(below[last], since[last], np.nan)
+            new_pos = np.flatnonzero(new)[last]
+            for j, pos in zip(r[last], new_pos):
+                a = start[pos]
+                self._buf[uslots[j]] = deque(zip(all_ts[a:pos + 1].tolist(), all_w[a:pos + 1].tolist()))
+                self._win_sum[uslots[j]] = cs[pos + 1] - cs[a]
+
+            out = np.zeros(n, dtype=bool)
+            out[seq[new] - c_total] = fired
+            return out
+
+    # -------- Introspection --------
+    def idle_remaining(self, device_id: str) -> Optional[float]:
+        """Seconds (device time) until the idle duration is reached; None when not below threshold."""
+        k = self.store.get(device_id)
+        if k is None or np.isnan(self._below_since[k]):
+            return None
+        return float(self._below_since[k] + self._duration[k] - self._last_ts[k])
+
+    def window_state(self, device_id: str) -> Optional[Tuple[float, int, float, float, float, int]]:
+        """(window avg, samples in window, below_since, last sample ts, threshold, duration); None if not tracked."""
+        k = self.store.get(device_id)
+        if k is None:
+            return None
+        n = len(self._buf[k] or ())
+        avg = float(self._win_sum[k]) / n if n else float("nan")
+        return (avg, n, float(self._below_since[k]), float(self._last_ts[k]),
+                float(self._threshold[k]), int(self._duration[k]))
+
+    def debug_state(self, device_id: str, now: Optional[float] = None) -> dict:
+        th, du = self._cfg(device_id)
+        k = self.store.get(device_id)
+        buf = list(self._buf[k] or ()) if k is not None else []
+        since = None if k is None or np.isnan(self._below_since[k]) else float(self._below_since[k])
+        now = self.clock() if now is None else now
+        return {
+            "device": device_id,
+            "threshold_w": th,
+            "duration_s": du,
+            "window_s": self.window_s,
+            "samples": [w for _, w in buf],
+            "avg_w": (sum(w for _, w in buf) / len(buf) if buf else None),
+            "below_since": since,
+            "elapsed_s": (now - since) if since else 0,
+        }
@@ -0,0 +1,104 @@
+import json
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterable, Optional
+
+
+class Readiness:
+    """
+    Liveness/readiness of the process plus a timed record of how it got there.
+
+    `t0` is a perf_counter() taken at the top of app.main, so marks ("app_built",
+    "live", "ready") are milliseconds since the import started. Phases are the
+    individual warm-up steps (init_db, restore, ...). The process is live as soon
+    as the HTTP server runs the lifespan; it is ready once warm-up finished and
+    ingest is attached.
+    """
+
+    def __init__(self, t0: float, budget_ms: float = 0):
+        self.t0 = t0
+        self.budget_ms = budget_ms  # import-to-ready budget; 0 = not enforced
+        self.state = "starting"  # starting -> warming -> ready | failed; stopping
+        self.marks: Dict[str, float] = {}
+        self.phases: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self._ready = threading.Event()
+
+    def mark(self, name: str) -> float:
+        ms = self.marks[name] = round((perf_counter() - self.t0) * 1000, 1)
+        return ms
+
+    @contextmanager
+    def phase(self, name: str):
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((perf_counter() - t) * 1000, 1)
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def over_budget(self) -> bool:
+        ms = self.marks.get("ready")
+        if ms is None:
+            ms = (perf_counter() - self.t0) * 1000
+        return bool(self.budget_ms) and ms > self.budget_ms
+
+    def set_ready(self):
+        self.mark("ready")
+        self.state = "ready"
+        self._ready.set()
+
+    def fail(self, exc: BaseException):
+        self.state = "failed"
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until ready (or timeout); True if ready."""
+        return self._ready.wait(timeout)
+
+    def report(self) -> dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "marks_ms": dict(self.marks),
+            "phases_ms": dict(self.phases),
+            "budget_ms": self.budget_ms,
+            "over_budget": self.over_budget,
+            "error": self.error,
+        }
+
+
+class ReadinessGate:
+    """
+    Pure ASGI middleware answering 503 + Retry-After until the app is ready.
+
+    Probe, metrics and docs paths always pass, so the port can be bound and
+    health-checked while warm-up (DB schema, snapshot restore, MQTT) runs behind it.
+    """
+
+    def __init__(self, app, readiness: Readiness,
+                 allow: Iterable[str] = ("/", "/livez", "/readyz", "/metrics", "/docs", "/openapi.json")):
+        self.app = app
+        self.readiness = readiness
+        self.allow = frozenset(allow)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.readiness.ready or scope["path"] in self.allow:
+            await self.app(scope, receive, send)
+            return
+        body = json.dumps({"detail": "starting up", "state": self.readiness.state}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
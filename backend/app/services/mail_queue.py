@@ -0,0 +1,226 @@
+# backend/app/services/mail_queue.py
+import queue
+import random
+import smtplib
+import threading
+from collections import defaultdict
+from email.message import EmailMessage
+from time import monotonic, perf_counter, sleep
+from typing import Callable, Dict, List, Optional
+
+from .mailer import Mailer
+from .metrics import MAIL, STAGE_MAIL
+
+_STOP = object()
+
+
+class _RateLimiter:
+    """Token bucket shared by all workers (`per_min` sends per minute, small burst)."""
+
+    def __init__(self, per_min: float, burst: int = 5):
+        self.rate = per_min / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.at = monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.at) * self.rate)
+                self.at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class MailQueue:
+    """
+    Queued SMTP delivery: one bounded queue, a small pool of worker threads.
+
+    Each worker keeps its own authenticated connection open between messages (NOOP probe
+    after `keepalive_s` idle, reconnect on failure), so a burst of alerts costs one TLS
+    handshake + login per worker instead of one per mail. Sends are rate limited across
+    the pool and retried with exponential backoff + jitter. With `digest_s` > 0, alert
+    mails are grouped per recipient and flushed as one email per interval.
+
+    `connect` defaults to Mailer._connect; pass any factory returning an smtplib.SMTP-like
+    object (send_message / noop / quit) to run against a local SMTP stand-in.
+    """
+
+    def __init__(
+            self,
+            mailer: Mailer,
+            *,
+            workers: int = 2,
+            maxsize: int = 1000,
+            rate_per_min: float = 60.0,
+            max_retries: int = 5,
+            backoff_s: float = 2.0,
+            keepalive_s: float = 30.0,
+            digest_s: float = 0.0,
+            connect: Optional[Callable[[], smtplib.SMTP]] = None,
+    ):
+        self.mailer = mailer
+        self.n_workers = workers
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.keepalive_s = keepalive_s
+        self.digest_s = digest_s
+        self.connect = connect or mailer._connect
+        self._q: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._limiter = _RateLimiter(rate_per_min)
+        self._digest: Dict[str, List[EmailMessage]] = defaultdict(list)
+        self._digest_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self.stats = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "dropped": 0,
+                      "connects": 0, "reconnects": 0, "digests": 0}
+        self._stats_lock = threading.Lock()
+
+    def _bump(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+        MAIL.labels(key).inc()
+
+    # -------- Producer side --------
+    def submit(self, msg: EmailMessage, digest: bool = False) -> bool:
+        """Queue a message without blocking; False (and counted as dropped) when the queue is full."""
+        if digest and self.digest_s > 0:
+            with self._digest_lock:
+                self._digest[msg["To"]].append(msg)
+            return True
+        try:
+            self._q.put_nowait(msg)
+        except queue.Full:
+            self._bump("dropped")
+            print("[MAIL] queue full, dropped:", msg["Subject"])
+            return False
+        self._bump("queued")
+        return True
+
+    def flush_digests(self):
+        with self._digest_lock:
+            pending, self._digest = self._digest, defaultdict(list)
+        for to_addr, msgs in pending.items():
+            if len(msgs) == 1:
+                self.submit(msgs[0])
+                continue
+            parts = [f"{len(msgs)} alerts since the last digest.\n"]
+            for m in msgs:
+                parts.append(f"--- {m['Subject']}\n{m.get_content().strip()}\n")
+            digest = EmailMessage()
+            digest["From"] = msgs[0]["From"]
+            digest["To"] = to_addr
+            digest["Subject"] = f"[SPO] Alert digest: {len(msgs)} alerts"
+            digest.set_content("\n".join(parts))
+            self._bump("digests")
+            self.submit(digest)
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    # -------- Workers --------
+    def _open(self):
+        conn = self.connect()
+        self._bump("connects")
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _worker(self):
+        conn, last_used = None, 0.0
+        while True:
+            try:
+                msg = self._q.get(timeout=self.keepalive_s)
+            except queue.Empty:
+                if conn is not None:  # idle: let the server go rather than hold a dead socket
+                    self._close(conn)
+                    conn = None
+                continue
+            if msg is _STOP:
+                break
+            attempt, can_reconnect = 0, True
+            while True:
+                reused = conn is not None
+                try:
+                    if conn is not None and monotonic() - last_used > self.keepalive_s:
+                        if conn.noop()[0] != 250:
+                            raise smtplib.SMTPServerDisconnected("NOOP failed")
+                    if conn is None:
+                        conn = self._open()
+                    self._limiter.take()
+                    t0 = perf_counter()
+                    conn.send_message(msg)
+                    STAGE_MAIL.since(t0)
+                    last_used = monotonic()
+                    self._bump("sent")
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    if conn is not None:
+                        self._close(conn)
+                        conn = None
+                    if reused and can_reconnect and isinstance(e, (smtplib.SMTPServerDisconnected, ConnectionError)):
+                        can_reconnect = False  # the pooled connection had gone stale: reconnect now, no backoff
+                        self._bump("reconnects")
+                        continue
+                    if isinstance(e, smtplib.SMTPRecipientsRefused) or attempt == self.max_retries:
+                        self._bump("failed")
+                        print("[MAIL] Error:", e)
+                        break
+                    self._bump("retried")
+                    # Returns at once when stopping, so shutdown isn't held up by backoff
+                    self._stop.wait(self.backoff_s * (2 ** attempt) * random.uniform(0.5, 1.5))
+                    attempt += 1
+            self._q.task_done()
+        if conn is not None:
+            self._close(conn)
+
+    def _digest_loop(self):
+        while not self._stop.wait(self.digest_s):
+            self.flush_digests()
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for n in range(self.n_workers):
+            t = threading.Thread(target=self._worker, name=f"mail-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        if self.digest_s > 0:
+            t = threading.Thread(target=self._digest_loop, name="mail-digest", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0):
+        """Flush pending digests, let workers drain the queue, then close their connections."""
+        self.flush_digests()
+        self._stop.set()
+        for _ in range(self.n_workers):
+            try:
+                self._q.put(_STOP, timeout=timeout)
+            except queue.Full:
+                break
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def snapshot(self) -> dict:
+        with self._digest_lock:
+            pending_digest = sum(len(v) for v in self._digest.values())
+        return {**self.stats, "depth": self.depth(), "pending_digest": pending_digest,
+                "workers": self.n_workers, "digest_s": self.digest_s}
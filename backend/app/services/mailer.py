@@ -2,8 +2,13 @@
 import smtplib
 import ssl
 from email.message import EmailMessage
-from typing import Optional
+from time import perf_counter
+from typing import Optional, TYPE_CHECKING
 from ..config import get_settings
+from .metrics import MAIL, STAGE_MAIL
+
+if TYPE_CHECKING:
+    from .mail_queue import MailQueue
 
 
 class Mailer:
@@ -19,23 +24,35 @@ class Mailer:
         self.use_ssl = bool(s.smtp_use_ssl)   # e.g. port 465
         self.use_tls = bool(s.smtp_use_tls)   # e.g. port 587
 
-    def _send(self, msg: EmailMessage):
+        # Set by app.main when queued delivery is on; alert mails then go through it
+        self.queue: Optional["MailQueue"] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.smtp_host)
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open an authenticated SMTP(S) session (caller owns it and must quit/close it)."""
         if self.use_ssl:
             ctx = ssl.create_default_context()
-            with smtplib.SMTP_SSL(self.smtp_host, self.smtp_port, context=ctx) as s:
-                if self.smtp_user:
-                    s.login(self.smtp_user, self.smtp_pass)
-                s.send_message(msg)
+            s = smtplib.SMTP_SSL(self.smtp_host, self.smtp_port, context=ctx, timeout=30)
         else:
-            with smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=30) as s:
-                if self.use_tls:
-                    s.starttls(context=ssl.create_default_context())
-                if self.smtp_user:
-                    s.login(self.smtp_user, self.smtp_pass)
-                s.send_message(msg)
+            s = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=30)
+        try:
+            if not self.use_ssl and self.use_tls:
+                s.starttls(context=ssl.create_default_context())
+            if self.smtp_user:
+                s.login(self.smtp_user, self.smtp_pass)
+        except Exception:
+            s.close()
+            raise
+        return s
 
-    def send_plain(self, to_addr: Optional[str], subject: str, text: str):
-        """Generic plain-text email (used by /debug/email)."""
+    def _send(self, msg: EmailMessage):
+        with self._connect() as s:
+            s.send_message(msg)
+
+    def _compose(self, to_addr: Optional[str], subject: str, text: str) -> EmailMessage:
         to_addr = to_addr or self.default_to
         if not to_addr:
             raise ValueError("No recipient: set SMTP_TO in env or pass 'to'")
@@ -45,8 +62,26 @@ class Mailer:
         msg["To"] = to_addr
         msg["Subject"] = subject
         msg.set_content(text)
+        return msg
 
-        self._send(msg)
+    def _deliver(self, to_addr: Optional[str], subject: str, text: str):
+        """Alert mail: hand off to the queue (non-blocking, digest-able) or send inline."""
+        msg = self._compose(to_addr, subject, text)
+        if self.queue is not None:
+            self.queue.submit(msg, digest=True)
+            return
+        t0 = perf_counter()
+        try:
+            self._send(msg)
+        except Exception:
+            MAIL.labels("failed").inc()
+            raise
+        STAGE_MAIL.since(t0)
+        MAIL.labels("sent").inc()
+
+    def send_plain(self, to_addr: Optional[str], subject: str, text: str):
+        """Generic plain-text email, sent synchronously (used by /debug/email)."""
+        self._send(self._compose(to_addr, subject, text))
 
     def send_alert_created(
             self,
@@ -69,4 +104,46 @@ class Mailer:
             f"Duration: {duration_s} s\n"
             f"Alert ID: {alert_id}\n"
         )
-        self.send_plain(to_addr, subject, body)
+        self._deliver(to_addr, subject, body)
+
+    def send_device_offline(
+            self,
+            device_id: str,
+            device_name: str,
+            offline_after_s: int,
+            alert_id: int,
+            to_addr: Optional[str] = None,
+    ):
+        """Device stopped reporting for longer than the last-seen timeout."""
+        subject = f"[SPO] Offline alert #{alert_id} on {device_name or device_id}"
+        body = (
+            f"A device stopped reporting.\n\n"
+            f"Device: {device_name or device_id}\n"
+            f"Device ID: {device_id}\n"
+            f"No data for: {offline_after_s} s\n"
+            f"Alert ID: {alert_id}\n"
+        )
+        self._deliver(to_addr, subject, body)
+
+    def send_anomaly(
+            self,
+            device_id: str,
+            device_name: str,
+            reason: str,
+            value: float,
+            expected: float,
+            alert_id: int,
+            to_addr: Optional[str] = None,
+    ):
+        """Spike / drift / stuck-on alerts from the anomaly detector."""
+        label = reason.replace("_", " ")
+        subject = f"[SPO] {label.capitalize()} alert #{alert_id} on {device_name or device_id}"
+        body = (
+            f"An anomaly was detected: {label}.\n\n"
+            f"Device: {device_name or device_id}\n"
+            f"Device ID: {device_id}\n"
+            f"Reading: {value:.2f}\n"
+            f"Expected: {expected:.2f}\n"
+            f"Alert ID: {alert_id}\n"
+        )
+        self._deliver(to_addr, subject, body)
@@ -0,0 +1,277 @@
+import bisect
+import threading
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds; covers a sub-ms in-memory stage up to a slow SMTP handshake
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt(v: float) -> str:
+    v = float(v)
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values):
+        """Child for one label combination; callers on hot paths should keep the child around."""
+        child = self._children.get(values)
+        if child is None:
+            values = tuple(str(v) for v in values)
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount  # GIL-atomic enough for monitoring; no lock on the hot path
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [f"{self.name}_total{_labels(self.labelnames, k)} {_fmt(c.value)}"
+                for k, c in list(self._children.items())]
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time via `set_function` (zero cost between scrapes)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 fn: Optional[Callable[[], object]] = None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set_function(self, fn: Callable[[], object]):
+        """fn() -> number, or {label values tuple: number} for a labelled gauge."""
+        self.fn = fn
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self):
+        items = [(k, c.value) for k, c in list(self._children.items())]
+        if self.fn is not None:
+            try:
+                got = self.fn()
+            except Exception as e:
+                print(f"[Metrics] {self.name} collector error:", e)
+                got = None
+            if isinstance(got, dict):
+                items += [(k if isinstance(k, tuple) else (k,), v) for k, v in got.items()]
+            elif got is not None:
+                items.append(((), got))
+        return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def since(self, t0: float):
+        """observe(perf_counter() - t0): the usual stage-timing idiom."""
+        v = perf_counter() - t0
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        out = []
+        for k, c in list(self._children.items()):
+            counts = list(c.counts)
+            acc = 0
+            for b, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                le = 'le="' + _fmt(b) + '"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {repr(float(c.sum))}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {acc}")
+        return out
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus-style registry (text exposition format 0.0.4).
+
+    Hot-path updates are an attribute increment on a pre-resolved child
+    (`STAGE_DB_COMMIT.since(t0)`), well under a microsecond; anything that can be read
+    from existing state (queue depths, device counts) is a scrape-time gauge function.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # re-import / reload safe
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = (),
+              fn: Optional[Callable[[], object]] = None) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def expose(self) -> str:
+        return "\n".join(m.expose() for m in list(self._metrics.values())) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# -------- Shared metric families --------
+STAGE_SECONDS = REGISTRY.histogram(
+    "spo_stage_seconds", "Time spent per pipeline stage", ("stage",))
+MQTT_MESSAGES = REGISTRY.counter(
+    "spo_mqtt_messages", "MQTT messages received by outcome", ("kind", "result"))
+INGEST_SAMPLES = REGISTRY.counter(
+    "spo_ingest_samples", "Telemetry samples ingested", ("kind",))
+INGEST_STORED = REGISTRY.counter(
+    "spo_ingest_stored", "Telemetry rows written after ingest compression", ("kind",))
+INGEST_DUPLICATES = REGISTRY.counter(
+    "spo_ingest_duplicates", "Repeat deliveries dropped before persisting", ("kind",))
+POWER_SKETCH_REJECTED = REGISTRY.counter(
+    "spo_power_sketch_rejected", "NaN/inf power readings left out of the power sketches")
+BACKFILL_SAMPLES = REGISTRY.counter(
+    "spo_backfill_samples", "Backfilled samples by outcome", ("kind", "result"))
+ADMISSION_SHED = REGISTRY.counter(
+    "spo_admission_shed", "Telemetry coalesced, dropped or turned away under overload", ("reason",))
+INGEST_LAG = REGISTRY.histogram(
+    "spo_ingest_lag_seconds", "Device timestamp to persisted, fleet-wide",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0))
+DEVICE_INGEST_LAG = REGISTRY.gauge(
+    "spo_device_ingest_lag_seconds", "Device timestamp to persisted, last sample per device", ("device_id",))
+ALERTS = REGISTRY.counter("spo_alerts", "Alerts created", ("reason",))
+MAIL = REGISTRY.counter("spo_mail", "Alert mails by outcome", ("result",))
+STAGE_MQTT_DECODE = STAGE_SECONDS.labels("mqtt_decode")
+STAGE_DB_INSERT = STAGE_SECONDS.labels("db_insert")
+STAGE_DB_COMMIT = STAGE_SECONDS.labels("db_commit")
+STAGE_ROLLING = STAGE_SECONDS.labels("rolling_stats")
+STAGE_IDLE = STAGE_SECONDS.labels("idle_eval")
+STAGE_ANOMALY = STAGE_SECONDS.labels("anomaly_eval")
+STAGE_ALERT = STAGE_SECONDS.labels("alert_create")
+STAGE_MAIL = STAGE_SECONDS.labels("mail_send")
+STAGE_LIVE_STATE = STAGE_SECONDS.labels("live_state")
+STAGE_BACKFILL_DB = STAGE_SECONDS.labels("backfill_db")
+STAGE_DB_BATCH = STAGE_SECONDS.labels("db_batch")
+HTTP_SECONDS = REGISTRY.histogram(
+    "spo_http_request_seconds", "HTTP request latency per route", ("method", "route", "status"))
+
+
+class MetricsMiddleware:
+    """Pure-ASGI per-route latency (route template, not raw path, to keep cardinality bounded)."""
+
+    def __init__(self, app, histogram: Histogram = HTTP_SECONDS, skip: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.histogram = histogram
+        self.skip = skip
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip:
+            return await self.app(scope, receive, send)
+        t0 = perf_counter()
+        status = [500]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            self.histogram.labels(scope.get("method", ""), path, f"{status[0] // 100}xx").since(t0)
@@ -1,8 +1,11 @@
 import json
 import ssl
 import threading
+from time import perf_counter
 import paho.mqtt.client as mqtt
 
+from .metrics import MQTT_MESSAGES, STAGE_MQTT_DECODE
+
 try:
     import certifi  # for a reliable CA bundle on Windows
     CA_CERTS = certifi.where()
@@ -23,6 +26,11 @@ class MQTTBridge:
             on_dc_measure=None,
             on_ac_measure=None,
             *,
+            on_switch_report=None,
+            on_puback=None,
+            on_backfill=None,
+            qos: int = 1,
+            command_json: bool = False,
             username: str | None = None,
             password: str | None = None,
             use_tls: bool = False,
@@ -35,7 +43,15 @@ class MQTTBridge:
         self.base = base.rstrip("/")
         self.on_dc_measure = on_dc_measure
         self.on_ac_measure = on_ac_measure
+        self.on_switch_report = on_switch_report  # (switch_id, channel, "ack"|"state", payload)
+        self.on_puback = on_puback  # (mid) once the broker confirmed a QoS 1 publish
+        self.on_backfill = on_backfill  # (device_id, "dc"|"ac", [payload, ...]) buffered samples
+        self.submit = None  # AdmissionController.submit: run the handlers off the network thread
+        self.qos = qos
+        self.command_json = command_json  # publish {"state", "cid"} instead of plain ON/OFF
+        self.recorder = None  # TrafficRecorder: raw topic/payload capture for replay
         self.keepalive = keepalive
+        self._thread: threading.Thread | None = None
 
         transport = "websockets" if use_ws else "tcp"
         self.client = mqtt.Client(client_id=client_id or "", protocol=mqtt.MQTTv311, transport=transport)
@@ -60,6 +76,7 @@ class MQTTBridge:
 
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
 
     # Topics
     @property
@@ -70,6 +87,14 @@ class MQTTBridge:
     def topic_ac(self) -> str:
         return f"{self.base}/telemetry/ac/+/measure"
 
+    @property
+    def topic_backfill(self) -> str:
+        return f"{self.base}/telemetry/+/+/backfill"
+
+    @property
+    def topic_switch_reports(self) -> list:
+        return [f"{self.base}/control/switch/+/+/ack", f"{self.base}/control/switch/+/+/state"]
+
     # Callbacks
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         print(self.base)
@@ -78,32 +103,81 @@ class MQTTBridge:
         client.subscribe(self.topic_dc)
         print("Subscribing to:", self.topic_ac)
         client.subscribe(self.topic_ac)
+        if self.on_backfill:
+            print("Subscribing to:", self.topic_backfill)
+            client.subscribe(self.topic_backfill, qos=1)
+        if self.on_switch_report:
+            for t in self.topic_switch_reports:
+                print("Subscribing to:", t)
+                client.subscribe(t, qos=1)
         client.publish(f"{self.base}", payload="kingmaker", retain=True)
         print(f"{self.base}")
 
     def _on_message(self, client, userdata, msg):
-        print("message received")
+        rec = self.recorder
+        if rec is not None:
+            rec.record(msg.topic, msg.payload)
         try:
             parts = msg.topic.split("/")
+            # .../control/switch/{switchId}/{channel}/{ack|state}
+            if len(parts) >= 5 and parts[-5] == "control" and parts[-4] == "switch":
+                if self.on_switch_report:
+                    self._run("control", self.on_switch_report, parts[-3], parts[-2], parts[-1], msg.payload)
+                return
+            # .../telemetry/{dc|ac}/{deviceId}/backfill: a JSON list of samples, or {"samples": [...]}
+            if parts[-1] == "backfill":
+                if self.on_backfill:
+                    body = json.loads(msg.payload.decode("utf-8"))
+                    samples = body.get("samples", []) if isinstance(body, dict) else body
+                    self._run("bulk", self.on_backfill, parts[-2], parts[-3], samples)
+                    MQTT_MESSAGES.labels(parts[-3], "backfill").inc()
+                return
             # .../telemetry/{dc|ac}/{deviceId}/measure
             kind = parts[-3]
             device_id = parts[-2]
+            t0 = perf_counter()
             payload = json.loads(msg.payload.decode("utf-8"))
-            if kind == "dc" and self.on_dc_measure:
-                self.on_dc_measure(device_id, payload)
-            elif kind == "ac" and self.on_ac_measure:
-                self.on_ac_measure(device_id, payload)
+            STAGE_MQTT_DECODE.since(t0)
+            handler = {"dc": self.on_dc_measure, "ac": self.on_ac_measure}.get(kind)
+            admitted = True
+            if handler:
+                admitted = self._run("telemetry", handler, device_id, payload, key=(kind, device_id))
+            MQTT_MESSAGES.labels(kind, "ok" if admitted else "shed").inc()
         except Exception as e:
+            MQTT_MESSAGES.labels(parts[-3] if len(parts) >= 3 else "", "error").inc()
             print("MQTT parse error:", e)
 
+    def _run(self, lane: str, fn, *args, key=None) -> bool:
+        if self.submit is None:
+            fn(*args)
+            return True
+        return self.submit(lane, fn, *args, key=key)
+
+    def _on_publish(self, client, userdata, mid):
+        if self.on_puback:
+            self.on_puback(mid)
+
     # Control publish
-    def publish_switch(self, switch_id: str, state: str, channel: str | None = None):
+    def publish_switch(self, switch_id: str, state: str, channel: str | None = None,
+                       correlation_id: str | None = None) -> int:
+        """Publish a switch command at the configured QoS; returns the MQTT message id."""
         ch = channel or "ch1"
         topic = f"{self.base}/control/switch/{switch_id}/{ch}/set"
-        self.client.publish(topic, state.upper(), retain=False)
+        payload = state.upper()
+        if self.command_json and correlation_id:
+            payload = json.dumps({"state": payload, "cid": correlation_id})
+        return self.client.publish(topic, payload, qos=self.qos, retain=False).mid
 
     def start(self):
         def _loop():
             self.client.connect(self.host, self.port, keepalive=self.keepalive)
             self.client.loop_forever()
-        threading.Thread(target=_loop, daemon=True).start()
+        self._thread = threading.Thread(target=_loop, name="mqtt", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop intake: disconnect and wait for the network loop, so no handler runs after this returns."""
+        self.client.disconnect()  # loop_forever returns once the DISCONNECT is sent
+        self.client.loop_stop()  # no-op unless a loop_start() thread is running
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
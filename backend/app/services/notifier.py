@@ -0,0 +1,244 @@
+# backend/app/services/notifier.py
+import asyncio
+import json
+import random
+import threading
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+from sqlalchemy import func, update
+from sqlmodel import Session, select
+
+from ..models import NotificationOutbox
+from .metrics import REGISTRY
+
+WEBHOOK_EVENTS = REGISTRY.counter("spo_notify_events", "Outbox events by delivery outcome", ("result",))
+
+
+class Sink:
+    """An async notification destination. `send` delivers a batch or raises."""
+
+    name: str = "sink"
+    max_batch: int = 50
+    concurrency: int = 4
+
+    async def send(self, events: List[dict]) -> None:
+        raise NotImplementedError
+
+
+class PermanentError(Exception):
+    """Delivery failed in a way retrying won't fix (e.g. HTTP 4xx); the rows go straight to dead."""
+
+
+class WebhookSink(Sink):
+    """POST {"events": [...]} as JSON to one URL over the dispatcher's pooled keep-alive client."""
+
+    def __init__(self, url: str, client: httpx.AsyncClient, *, headers: Optional[Dict[str, str]] = None,
+                 max_batch: int = 50, concurrency: int = 4):
+        self.url = url
+        self.name = f"webhook:{url}"
+        self.client = client
+        self.headers = headers or {}
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+
+    async def send(self, events: List[dict]) -> None:
+        r = await self.client.post(self.url, json={"events": events}, headers=self.headers)
+        if r.status_code in (408, 429) or r.status_code >= 500:
+            raise httpx.HTTPStatusError(f"{r.status_code} from {self.url}", request=r.request, response=r)
+        if r.status_code >= 400:
+            raise PermanentError(f"{r.status_code} from {self.url}: {r.text[:200]}")
+
+
+class NotificationDispatcher:
+    """
+    Outbox-backed, at-least-once fan-out of events to async sinks.
+
+    `enqueue` adds one NotificationOutbox row per sink to the caller's session, so the event
+    commits atomically with whatever produced it (e.g. the Alert row); `wake` then nudges the
+    dispatcher. Delivery runs on a private asyncio loop in one background thread, so the
+    ingest path never waits on HTTP: due rows are batched per sink (`max_batch` events per
+    request) and sent with at most `concurrency` requests in flight per sink, and retried
+    with full-jitter exponential backoff until `max_attempts`, then marked dead. A sink is
+    only leased as many rows as its free request slots can start now, so a backlog behind
+    a slow endpoint stays in the table instead of sitting in memory past its lease (and
+    being sent twice); each finished request leases the next batch. Pending rows are
+    picked up again after a restart.
+    """
+
+    def __init__(self, engine, sinks: Sequence[Sink], *, client: Optional[httpx.AsyncClient] = None,
+                 poll_s: float = 5.0, max_attempts: int = 8, backoff_s: float = 2.0,
+                 max_backoff_s: float = 900.0, lease_s: float = 120.0, fetch_limit: int = 500):
+        self.engine = engine
+        self.sinks = {s.name: s for s in sinks}
+        self.client = client
+        self.poll_s = poll_s
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.lease_s = lease_s
+        self.fetch_limit = fetch_limit
+        self.stats = {"sent": 0, "retried": 0, "dead": 0, "batches": 0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, int] = {}  # leased batches per sink not finished yet
+        self._backlog: Dict[str, bool] = {}  # last lease hit the sink's limit
+
+    # -------- Producer side (any thread) --------
+    def enqueue(self, session: Session, event_type: str, payload: dict):
+        body = json.dumps({"type": event_type, "ts": datetime.utcnow().isoformat(), "data": payload},
+                          default=str)
+        for name in self.sinks:
+            session.add(NotificationOutbox(sink=name, event_type=event_type, payload=body))
+
+    def publish(self, event_type: str, payload: dict):
+        """Enqueue in its own transaction and wake the dispatcher."""
+        if not self.sinks:
+            return
+        with Session(self.engine) as s:
+            self.enqueue(s, event_type, payload)
+            s.commit()
+        self.wake()
+
+    def wake(self):
+        loop, ev = self._loop, self._wake
+        if loop is not None and ev is not None:
+            loop.call_soon_threadsafe(ev.set)
+
+    # -------- Outbox I/O (runs in a worker thread via asyncio.to_thread) --------
+    def _lease_due(self, limits: Dict[str, int]) -> List[Tuple[int, str, str, int]]:
+        """Due (id, sink, payload, attempts) rows, at most limits[sink] per sink, leased for `lease_s`."""
+        now = datetime.utcnow()
+        with Session(self.engine) as s:
+            rows = []
+            for name, limit in limits.items():
+                rows += s.exec(
+                    select(NotificationOutbox.id, NotificationOutbox.sink,
+                           NotificationOutbox.payload, NotificationOutbox.attempts)
+                    .where(NotificationOutbox.sink == name, NotificationOutbox.status == "pending",
+                           NotificationOutbox.next_attempt_at <= now)
+                    .order_by(NotificationOutbox.id)
+                    .limit(limit)
+                ).all()
+            if rows:
+                # Lease: push next_attempt_at out so the next poll (or another worker) skips them
+                s.exec(update(NotificationOutbox)
+                       .where(NotificationOutbox.id.in_([r[0] for r in rows]))
+                       .values(next_attempt_at=now + timedelta(seconds=self.lease_s)))
+                s.commit()
+        return [tuple(r) for r in rows]
+
+    def _mark_sent(self, ids: List[int]):
+        with Session(self.engine) as s:
+            s.exec(update(NotificationOutbox).where(NotificationOutbox.id.in_(ids))
+                   .values(status="sent", sent_at=datetime.utcnow(), last_error=None))
+            s.commit()
+
+    def _mark_failed(self, rows: List[Tuple[int, str, str, int]], error: str, permanent: bool):
+        now = datetime.utcnow()
+        with Session(self.engine) as s:
+            for row_id, _, _, prev in rows:
+                attempts = prev + 1
+                dead = permanent or attempts >= self.max_attempts
+                delay = random.uniform(0, min(self.max_backoff_s, self.backoff_s * 2 ** attempts))
+                s.exec(update(NotificationOutbox).where(NotificationOutbox.id == row_id).values(
+                    attempts=attempts,
+                    status="dead" if dead else "pending",
+                    next_attempt_at=now + timedelta(seconds=delay),
+                    last_error=error[:500],
+                ))
+                self.stats["dead" if dead else "retried"] += 1
+                WEBHOOK_EVENTS.labels("dead" if dead else "retried").inc()
+            s.commit()
+
+    # -------- Delivery loop --------
+    def _finished(self, name: str, _task):
+        self._inflight[name] -= 1
+        if self._backlog.get(name):
+            self._wake.set()  # a request slot freed up and more rows are due: lease the next batch
+
+    async def _deliver(self, sink: Sink, rows: List[Tuple[int, str, str, int]]):
+        async with self._sems[sink.name]:
+            try:
+                await sink.send([json.loads(r[2]) for r in rows])
+            except Exception as e:
+                await asyncio.to_thread(self._mark_failed, rows, f"{type(e).__name__}: {e}",
+                                        isinstance(e, PermanentError))
+                return
+            self.stats["batches"] += 1
+            self.stats["sent"] += len(rows)
+            WEBHOOK_EVENTS.labels("sent").inc(len(rows))
+            await asyncio.to_thread(self._mark_sent, [r[0] for r in rows])
+
+    async def _run(self):
+        self._wake = asyncio.Event()
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+            )
+        for name, sink in self.sinks.items():
+            if isinstance(sink, WebhookSink):
+                sink.client = self.client
+            self._sems[name] = asyncio.Semaphore(sink.concurrency)
+            self._inflight[name] = 0
+        pending: set = set()
+        while not self._stopping:
+            self._wake.clear()
+            limits = {name: min(self.fetch_limit, (sink.concurrency - self._inflight[name]) * sink.max_batch)
+                      for name, sink in self.sinks.items() if self._inflight[name] < sink.concurrency}
+            try:
+                rows = await asyncio.to_thread(self._lease_due, limits) if limits else []
+            except Exception as e:
+                print("[Notify] outbox read failed:", e)
+                rows = []
+            by_sink: Dict[str, list] = {name: [] for name in limits}
+            for r in rows:
+                by_sink[r[1]].append(r)
+            for name, items in by_sink.items():
+                sink = self.sinks[name]
+                self._backlog[name] = len(items) >= limits[name]
+                for i in range(0, len(items), sink.max_batch):
+                    t = asyncio.create_task(self._deliver(sink, items[i:i + sink.max_batch]))
+                    self._inflight[name] += 1
+                    pending.add(t)
+                    t.add_done_callback(pending.discard)
+                    t.add_done_callback(partial(self._finished, name))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_s)
+            except asyncio.TimeoutError:
+                pass
+        if pending:
+            await asyncio.wait(pending, timeout=10)
+        await self.client.aclose()
+
+    def start(self):
+        if not self.sinks or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping = False
+        self._loop = asyncio.new_event_loop()
+
+        def _main():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._run())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_main, name="notify-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 15.0):
+        self._stopping = True
+        self.wake()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def snapshot(self) -> dict:
+        with Session(self.engine) as s:
+            counts = dict(s.exec(select(NotificationOutbox.status, func.count())
+                                 .group_by(NotificationOutbox.status)).all())
+        return {"sinks": list(self.sinks), "outbox": counts, **self.stats}
@@ -0,0 +1,282 @@
+import math
+import struct
+import threading
+from datetime import datetime
+from time import perf_counter, time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlmodel import Session, select
+
+from ..models import PowerSketch
+from .metrics import POWER_SKETCH_REJECTED
+
+RELATIVE_ACCURACY = 0.01  # every estimate is within 1% of a real sample value
+MIN_POWER_W = 0.01  # readings at or below this (incl. 0 W and export) share the zero bin
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LN_GAMMA = math.log(_GAMMA)
+_HEADER = struct.Struct("<fIQddd")  # accuracy, bins, zero count, sum, min, max
+
+
+# -------- Sketch --------
+class QuantileSketch:
+    """
+    Mergeable power distribution (DDSketch-style log bins).
+
+    A reading w lands in bin ceil(log_gamma(w)), so any quantile read back is within
+    RELATIVE_ACCURACY of a real reading, whatever the load range. Two sketches merge by
+    adding bin counts, which is what makes per-bucket sketches combinable into any range,
+    device group or location without going back to raw telemetry. A device drawing
+    between 0.5 W and 2 kW touches at most ~420 bins; typically a few dozen.
+    """
+
+    __slots__ = ("bins", "zero", "sum", "min", "max")
+
+    def __init__(self):
+        self.bins: Dict[int, int] = {}
+        self.zero = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self) -> int:
+        return self.zero + sum(self.bins.values())
+
+    def add(self, w: float) -> bool:
+        """Count one reading; False (and not counted) for NaN/inf."""
+        if not math.isfinite(w):
+            return False
+        if w <= MIN_POWER_W:
+            self.zero += 1
+        else:
+            i = math.ceil(math.log(w) / _LN_GAMMA)
+            self.bins[i] = self.bins.get(i, 0) + 1
+        self.sum += w
+        if w < self.min:
+            self.min = w
+        if w > self.max:
+            self.max = w
+        return True
+
+    def add_many(self, w: np.ndarray) -> int:
+        """Vectorized `add` for a block of readings (bulk loads); returns how many NaN/inf were skipped."""
+        finite = np.isfinite(w)
+        skipped = len(w) - int(finite.sum())
+        if skipped:
+            w = w[finite]
+        if not len(w):
+            return skipped
+        pos = w[w > MIN_POWER_W]
+        self.zero += len(w) - len(pos)
+        idx, counts = np.unique(np.ceil(np.log(pos) / _LN_GAMMA).astype(np.int64), return_counts=True)
+        for i, n in zip(idx.tolist(), counts.tolist()):
+            self.bins[i] = self.bins.get(i, 0) + n
+        self.sum += float(w.sum())
+        self.min = min(self.min, float(w.min()))
+        self.max = max(self.max, float(w.max()))
+        return skipped
+
+    def merge(self, other: "QuantileSketch"):
+        for i, n in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + n
+        self.zero += other.zero
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantiles(self, qs: Sequence[float]) -> List[Optional[float]]:
+        total = self.count
+        if total == 0:
+            return [None] * len(qs)
+        keys = sorted(self.bins)
+        cum = np.cumsum([self.zero] + [self.bins[i] for i in keys])
+        out = []
+        for q in qs:
+            pos = int(np.searchsorted(cum, q * (total - 1), side="right"))
+            if pos == 0:
+                v = 0.0
+            else:
+                v = 2 * _GAMMA ** keys[pos - 1] / (_GAMMA + 1)  # bin midpoint (relative)
+            out.append(min(max(v, self.min), self.max))
+        return out
+
+    # -------- Persistence --------
+    def to_bytes(self) -> bytes:
+        keys = np.fromiter(self.bins, np.int16, len(self.bins))
+        counts = np.fromiter(self.bins.values(), np.uint32, len(self.bins))
+        head = _HEADER.pack(RELATIVE_ACCURACY, len(keys), self.zero, self.sum, self.min, self.max)
+        return head + keys.tobytes() + counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "QuantileSketch":
+        acc, n, zero, total, lo, hi = _HEADER.unpack_from(data)
+        if not math.isclose(acc, RELATIVE_ACCURACY, rel_tol=1e-6):
+            raise ValueError(f"sketch written with accuracy {acc}, this build uses {RELATIVE_ACCURACY}")
+        off = _HEADER.size
+        keys = np.frombuffer(data, np.int16, n, off)
+        counts = np.frombuffer(data, np.uint32, n, off + 2 * n)
+        s = cls()
+        s.bins = dict(zip(keys.tolist(), counts.tolist()))
+        s.zero, s.sum, s.min, s.max = zero, total, lo, hi
+        return s
+
+
+# -------- Per-device buckets --------
+class PowerSketches:
+    """
+    Per-device power sketches by time bucket (hourly by default), kept in the power_sketch table.
+
+    Ingest only adds to an in-memory sketch of what arrived since the last flush, keyed
+    (device_id, bucket start); the flush thread merges those into the stored rows
+    (read-merge-write per bucket, with row locks on Postgres), so late and backfilled
+    samples land in the bucket their timestamp belongs to and several workers can share
+    the table. Queries merge the stored rows of the range with the not-yet-flushed part.
+    Samples that arrived after the last flush are lost on a crash (not on a clean stop).
+    """
+
+    def __init__(self, engine, bucket_s: int = 3600, flush_s: float = 60.0, chunk: int = 500,
+                 clock: Callable[[], float] = time):
+        self.engine = engine
+        self.bucket_s = bucket_s
+        self.flush_s = flush_s
+        self.chunk = chunk
+        self.clock = clock
+        self.last_flush_ms: Optional[float] = None
+        self._pending: Dict[Tuple[str, int], QuantileSketch] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def bucket(self, ts: float) -> int:
+        return int(ts // self.bucket_s) * self.bucket_s
+
+    def add(self, device_id: str, w: float, ts: Optional[float] = None):
+        if not math.isfinite(w):
+            POWER_SKETCH_REJECTED.inc()
+            return
+        key = (device_id, self.bucket(self.clock() if ts is None else ts))
+        with self._lock:
+            s = self._pending.get(key)
+            if s is None:
+                s = self._pending[key] = QuantileSketch()
+            s.add(w)
+
+    def add_many(self, device_id: str, w: np.ndarray, ts: np.ndarray):
+        """One device's readings (epoch seconds in `ts`), grouped into buckets in one pass."""
+        finite = np.isfinite(w)
+        if not finite.all():
+            POWER_SKETCH_REJECTED.inc(len(w) - int(finite.sum()))
+            w, ts = w[finite], ts[finite]
+        buckets = (ts // self.bucket_s).astype(np.int64) * self.bucket_s
+        for b in np.unique(buckets).tolist():
+            part = w[buckets == b]
+            with self._lock:
+                s = self._pending.get((device_id, b))
+                if s is None:
+                    s = self._pending[(device_id, b)] = QuantileSketch()
+                s.add_many(part)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # -------- Flush --------
+    def flush(self) -> int:
+        """Merge pending sketches into the table; returns the number of (device, bucket) rows written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            t0 = perf_counter()
+            by_bucket: Dict[int, List[str]] = {}
+            for device_id, b in batch:
+                by_bucket.setdefault(b, []).append(device_id)
+            try:
+                with Session(self.engine) as s:
+                    now = datetime.utcnow()
+                    for b, ids in by_bucket.items():
+                        start = datetime.utcfromtimestamp(b)
+                        for i in range(0, len(ids), self.chunk):
+                            part = ids[i:i + self.chunk]
+                            rows = {r.device_id: r for r in s.exec(
+                                select(PowerSketch)
+                                .where(PowerSketch.bucket_start == start, PowerSketch.device_id.in_(part))
+                                .with_for_update()
+                            ).all()}
+                            for device_id in part:
+                                sketch = batch[(device_id, b)]
+                                row = rows.get(device_id)
+                                if row is None:
+                                    row = PowerSketch(device_id=device_id, bucket_start=start, data=b"")
+                                else:
+                                    try:
+                                        merged = QuantileSketch.from_bytes(row.data)
+                                        merged.merge(sketch)
+                                        sketch = merged
+                                    except ValueError as e:  # other accuracy: restart the bucket
+                                        print(f"[PowerSketch] replacing {device_id}@{start}: {e}")
+                                row.samples, row.data, row.updated_at = sketch.count, sketch.to_bytes(), now
+                                s.add(row)
+                    s.commit()
+            except Exception:
+                with self._lock:  # keep them for the next flush
+                    for key, sketch in batch.items():
+                        cur = self._pending.get(key)
+                        if cur is not None:
+                            sketch.merge(cur)
+                        self._pending[key] = sketch
+                raise
+            self.last_flush_ms = (perf_counter() - t0) * 1000
+            return len(batch)
+
+    def _loop(self):
+        while not self._stop.wait(self.flush_s):
+            try:
+                self.flush()
+            except Exception as e:
+                print("[PowerSketch] flush failed:", e)
+
+    def start(self):
+        if self.flush_s <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="power-sketch-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    # -------- Query --------
+    def load(self, start: float, end: float, device_ids: Optional[Iterable[str]] = None
+             ) -> List[Tuple[str, int, QuantileSketch]]:
+        """(device_id, bucket start, sketch) for buckets overlapping [start, end), stored + pending."""
+        first, ids = self.bucket(start), None if device_ids is None else set(device_ids)
+        merged: Dict[Tuple[str, int], QuantileSketch] = {}
+        q = select(PowerSketch.device_id, PowerSketch.bucket_start, PowerSketch.data).where(
+            PowerSketch.bucket_start >= datetime.utcfromtimestamp(first),
+            PowerSketch.bucket_start < datetime.utcfromtimestamp(end))
+        if ids is not None:
+            if not ids:
+                return []
+            q = q.where(PowerSketch.device_id.in_(ids))
+        with Session(self.engine) as s:
+            for device_id, bucket_start, data in s.exec(q):
+                b = self.bucket((bucket_start - datetime(1970, 1, 1)).total_seconds())
+                try:
+                    merged[(device_id, b)] = QuantileSketch.from_bytes(data)
+                except ValueError as e:
+                    print(f"[PowerSketch] skipping {device_id}@{bucket_start}: {e}")
+        with self._lock:
+            pending = [(k, v) for k, v in self._pending.items()
+                       if first <= k[1] < end and (ids is None or k[0] in ids)]
+            for key, sketch in pending:
+                cur = merged.get(key)
+                if cur is None:
+                    cur = merged[key] = QuantileSketch()
+                cur.merge(sketch)
+        return [(d, b, s) for (d, b), s in merged.items()]
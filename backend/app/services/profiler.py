@@ -0,0 +1,153 @@
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from time import perf_counter, sleep
+from typing import Dict, List, Optional, Tuple
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # .../backend/app
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    if path.startswith(_HERE):
+        path = "app" + path[len(_HERE):]
+    else:
+        path = os.path.basename(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Time-boxed wall-clock sampling profiler for every thread in the process.
+
+    The calling thread reads `sys._current_frames()` every `interval_s` and counts
+    each thread's stack, so it sees the MQTT loop, scheduler and worker threads without
+    instrumenting them; nothing runs unless a profile is in progress. Results come out
+    as collapsed stacks ("thread;outer;...;inner count", the input format of
+    flamegraph.pl, speedscope and inferno) or as a per-function self/total table.
+    """
+
+    def __init__(self, interval_s: float = 0.005, max_depth: int = 64):
+        self.interval_s = interval_s
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.elapsed_s = 0.0
+        self._labels: Dict[object, str] = {}
+
+    def _label(self, code) -> str:
+        s = self._labels.get(code)
+        if s is None:
+            s = self._labels[code] = _frame_label(code)
+        return s
+
+    def run(self, duration_s: float, include_idle: bool = False) -> "StackSampler":
+        me = threading.get_ident()
+        names = {}
+        t_end = perf_counter() + duration_s
+        t0 = perf_counter()
+        while perf_counter() < t_end:
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (not include_idle and _is_idle(frame)):
+                    continue
+                stack: List[str] = []
+                f = frame
+                while f is not None and len(stack) < self.max_depth:
+                    stack.append(self._label(f.f_code))
+                    f = f.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+            sleep(self.interval_s)
+        self.elapsed_s = perf_counter() - t0
+        return self
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{';'.join(s)} {n}" for s, n in self.stacks.most_common()) + "\n"
+
+    def top(self, limit: int = 40) -> dict:
+        own: Counter = Counter()
+        total: Counter = Counter()
+        threads: Counter = Counter()
+        for stack, n in self.stacks.items():
+            threads[stack[0]] += n
+            own[stack[-1]] += n
+            for fn in set(stack[1:]):
+                total[fn] += n
+        hits = sum(self.stacks.values()) or 1
+        return {
+            "samples": self.samples,
+            "elapsed_s": round(self.elapsed_s, 3),
+            "interval_ms": self.interval_s * 1000,
+            "threads": dict(threads.most_common()),
+            "functions": [
+                {"function": fn, "self_pct": round(own[fn] / hits * 100, 2),
+                 "total_pct": round(total[fn] / hits * 100, 2)}
+                for fn, _ in total.most_common(limit)
+            ],
+        }
+
+
+# Leaf frames of threads that are just waiting; dropped by default so busy code stands out
+_IDLE_LEAVES = {("wait", "threading.py"), ("select", "selectors.py"), ("_worker", "thread.py"),
+                ("get", "queue.py"), ("sleep", None), ("accept", "socket.py"), ("loop_forever", "client.py"),
+                ("_loop_rc_handle", "client.py"), ("select", "client.py"), ("_sleep", "selector_events.py"),
+                ("run_forever", "base_events.py"), ("_run_once", "base_events.py")}
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    base = os.path.basename(code.co_filename)
+    return (code.co_name, base) in _IDLE_LEAVES or (code.co_name, None) in _IDLE_LEAVES
+
+
+class MemoryTracer:
+    """tracemalloc baseline + diff. Tracing (and its overhead) only exists between start() and stop()."""
+
+    def __init__(self):
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 10):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.baseline = tracemalloc.take_snapshot()
+
+    def diff(self, key: str = "lineno", limit: int = 30) -> dict:
+        with self._lock:
+            if not tracemalloc.is_tracing() or self.baseline is None:
+                raise RuntimeError("tracemalloc not started")
+            snap = tracemalloc.take_snapshot()
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>")]
+            stats = snap.filter_traces(filters).compare_to(self.baseline.filter_traces(filters), key)
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "growth_bytes": sum(s.size_diff for s in stats),
+            "top": [
+                {
+                    "where": [f"{f.filename}:{f.lineno}" for f in s.traceback][:10],
+                    "size_diff": s.size_diff,
+                    "size": s.size,
+                    "count_diff": s.count_diff,
+                }
+                for s in stats[:limit]
+            ],
+        }
+
+    def stop(self) -> Tuple[int, int]:
+        with self._lock:
+            self.baseline = None
+            current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+            tracemalloc.stop()
+            return current, peak
@@ -0,0 +1,81 @@
+import threading
+from datetime import datetime
+from time import perf_counter, time
+from typing import Callable, Optional
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from ..models import TelemetryAC, TelemetryDC
+
+
+class RawRetention:
+    """
+    Keeps raw telemetry a bounded ring: rows older than `max_age_s` and, per table, all but
+    the newest `max_rows` (by insertion id) are deleted every `interval_s`.
+
+    Deletes go in chunks of `chunk` rows so a large prune never holds the write lock for
+    long. SQLite keeps the freed pages and reuses them for new rows, so the file stops
+    growing instead of shrinking and refilling. Rollups (power sketches) and alerts are
+    not touched; they are what outlives the raw data and what is forwarded upstream.
+    """
+
+    def __init__(self, engine, max_age_s: float = 0, max_rows: int = 0, interval_s: float = 600.0,
+                 chunk: int = 20000, clock: Callable[[], float] = time):
+        self.engine = engine
+        self.max_age_s = max_age_s
+        self.max_rows = max_rows
+        self.interval_s = interval_s
+        self.chunk = chunk
+        self.clock = clock
+        self.deleted = 0
+        self.last_prune_ms: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _delete_upto(self, s: Session, table, cond) -> int:
+        n = 0
+        while True:
+            ids = s.exec(select(table.id).where(cond).order_by(table.id).limit(self.chunk)).all()
+            if not ids:
+                return n
+            s.exec(delete(table).where(table.id.in_(ids)))
+            s.commit()
+            n += len(ids)
+            if len(ids) < self.chunk:
+                return n
+
+    def prune(self) -> int:
+        t0 = perf_counter()
+        n = 0
+        with Session(self.engine) as s:
+            for table in (TelemetryDC, TelemetryAC):
+                if self.max_age_s > 0:
+                    cutoff = datetime.utcfromtimestamp(self.clock() - self.max_age_s)
+                    n += self._delete_upto(s, table, table.ts < cutoff)
+                if self.max_rows > 0:
+                    cut = s.exec(select(table.id).order_by(table.id.desc()).offset(self.max_rows).limit(1)).first()
+                    if cut is not None:
+                        n += self._delete_upto(s, table, table.id <= cut)
+        self.deleted += n
+        self.last_prune_ms = (perf_counter() - t0) * 1000
+        if n:
+            print(f"[Retention] pruned {n} raw telemetry rows in {self.last_prune_ms:.0f} ms")
+        return n
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.prune()
+            except Exception as e:
+                print("[Retention] prune failed:", e)
+
+    def start(self):
+        if (self.max_age_s <= 0 and self.max_rows <= 0) or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="raw-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -1,42 +1,102 @@
-from collections import deque
 from time import time
-from typing import Dict, Deque, Tuple
+from typing import Callable, Optional
+
+import numpy as np
+
+from .device_state import DeviceStateStore
 
 
 class RollingStats:
     """
-    Keeps timestamped watts and computes averages over 1m, 5m, 10m windows.
-    We keep a deque per device with (ts, watts) and drop old samples on read.
+    Averages over 1m, 5m, 10m windows from fixed time buckets.
+
+    Each device slot owns a ring of `horizon_s / bucket_s` (sum, count) buckets in 2-D
+    arrays, so memory per device is constant no matter how fast it reports, and window
+    edges are accurate to one bucket (10 s by default).
     """
 
-    def __init__(self):
-        self.samples: Dict[str, Deque[Tuple[float, float]]] = {}
+    def __init__(self, store: Optional[DeviceStateStore] = None, bucket_s: int = 10, horizon_s: int = 600,
+                 clock: Callable[[], float] = time):
+        self.clock = clock
+        self.bucket_s = bucket_s
+        self.n_buckets = horizon_s // bucket_s + 1  # +1 for the bucket still filling
+        self.store = store if store is not None else DeviceStateStore()
+        self._lock = self.store.lock
+        self._sum = np.empty((0, self.n_buckets))
+        self._count = np.empty((0, self.n_buckets), dtype=np.int32)
+        self._bucket = np.empty((0, self.n_buckets), dtype=np.int64)  # absolute bucket number held
+        self.store.attach(self)
+
+    # -------- Slots (DeviceStateStore component) --------
+    def _resize(self, capacity: int):
+        for name, fill in (("_sum", 0.0), ("_count", 0), ("_bucket", -1)):
+            old = getattr(self, name)
+            arr = np.full((capacity, self.n_buckets), fill, dtype=old.dtype)
+            arr[:len(old)] = old
+            setattr(self, name, arr)
+
+    def _clear_slot(self, k: int, device_id: str):
+        self._sum[k] = 0.0
+        self._count[k] = 0
+        self._bucket[k] = -1
+
+    def _memory(self) -> dict:
+        return {"bytes": self._sum.nbytes + self._count.nbytes + self._bucket.nbytes}
+
+    def _export(self, n: int) -> dict:
+        return {"bucket_s": np.array(self.bucket_s), "sum": self._sum[:n].copy(),
+                "count": self._count[:n].copy(), "bucket": self._bucket[:n].copy()}
+
+    def _import(self, arrays: dict):
+        if int(arrays["bucket_s"]) != self.bucket_s or arrays["sum"].shape[1] != self.n_buckets:
+            return  # bucket layout changed; averages refill within 10 minutes
+        n = len(arrays["sum"])
+        self._sum[:n] = arrays["sum"]
+        self._count[:n] = arrays["count"]
+        self._bucket[:n] = arrays["bucket"]
 
     def add(self, device_id: str, watts: float, ts: float | None = None):
-        ts = ts or time()
-        buf = self.samples.setdefault(device_id, deque())
-        buf.append((ts, float(watts)))
-        # Soft cap to keep memory bounded (drop if more than ~2000 samples)
-        if len(buf) > 2000:
-            buf.popleft()
-
-    def _avg_since(self, device_id: str, horizon_s: int) -> float | None:
-        from time import time as now
-        cutoff = now() - horizon_s
-        buf = self.samples.get(device_id)
-        if not buf:
+        ts = ts or self.clock()
+        b = int(ts // self.bucket_s)
+        pos = b % self.n_buckets
+        with self._lock:
+            k = self.store.slot(device_id)
+            if self._bucket[k, pos] != b:
+                if self._bucket[k, pos] > b:
+                    return  # older than the whole horizon
+                self._bucket[k, pos] = b
+                self._sum[k, pos] = 0.0
+                self._count[k, pos] = 0
+            self._sum[k, pos] += float(watts)
+            self._count[k, pos] += 1
+
+    @staticmethod
+    def window_avg(sums: np.ndarray, counts: np.ndarray, buckets: np.ndarray, bucket_s: int,
+                   horizon_s: int, now: float) -> float | None:
+        """Average over the buckets of one device ring that fall inside the last `horizon_s` seconds."""
+        live = buckets > int(now // bucket_s) - horizon_s // bucket_s
+        n = int(counts[live].sum())
+        if not n:
             return None
-        # Drop older than 10 minutes eagerly (largest window)
-        while buf and buf[0][0] < now() - 900:
-            buf.popleft()
-        vals = [w for (t, w) in buf if t >= cutoff]
-        if not vals:
+        return float(sums[live].sum()) / n
+
+    def _avg_since(self, device_id: str, horizon_s: int, now: float | None = None) -> float | None:
+        k = self.store.get(device_id)
+        if k is None:
+            return None
+        return self.window_avg(self._sum[k], self._count[k], self._bucket[k], self.bucket_s,
+                               horizon_s, now or self.clock())
+
+    def ring(self, device_id: str):
+        """(sums, counts, buckets) views of one device's bucket ring, or None if not tracked."""
+        k = self.store.get(device_id)
+        if k is None:
             return None
-        return sum(vals) / len(vals)
+        return self._sum[k], self._count[k], self._bucket[k]
 
-    def stats(self, device_id: str) -> dict:
+    def stats(self, device_id: str, now: float | None = None) -> dict:
         return {
-            "avg_1m_w": self._avg_since(device_id, 60),
-            "avg_5m_w": self._avg_since(device_id, 300),
-            "avg_10m_w": self._avg_since(device_id, 600),
+            "avg_1m_w": self._avg_since(device_id, 60, now),
+            "avg_5m_w": self._avg_since(device_id, 300, now),
+            "avg_10m_w": self._avg_since(device_id, 600, now),
         }
@@ -0,0 +1,244 @@
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from time import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from .rolling_stats import RollingStats
+
+try:
+    import fcntl  # slot claims across processes; absent on Windows (single process there)
+except ImportError:
+    fcntl = None
+
+# File: 64-byte header, then `capacity` fixed-size records.
+#   header: <8s magic> <I version> <I capacity> <I record size> <I rolling buckets> <I bucket_s>
+#   record: <Q seq> <body> <f8 sums[n]> <i4 counts[n]> <i8 buckets[n]>   (n = rolling buckets)
+#   body:   device_id, kind, writer pid, written at, last seen, v, i, p, pf, f, e_wh (NaN = absent),
+#           idle window avg, below_since, last sample ts, threshold, duration, samples in window
+MAGIC = b"SPOLIVE1"
+VERSION = 2
+_HEADER = struct.Struct("<8sIIIII")
+_HEADER_SIZE = 64
+_SEQ = struct.Struct("<Q")
+_BODY = struct.Struct("<64sB3xI" + "d" * 13 + "I")
+_NAN = float("nan")
+
+
+class SharedLiveState:
+    """
+    Latest reading and window aggregates per device in a memory-mapped file shared by all workers.
+
+    One fixed-layout record per device, found by open addressing on crc32(device_id),
+    so any process can look a device up without a DB round trip or an IPC call. The
+    ingesting process copies the device's hot fields, RollingStats bucket ring and idle
+    window state in after each sample; other workers compute 1/5/10-minute averages
+    from that ring at read time, exactly as RollingStats does locally.
+
+    Reads never block: each record starts with a sequence counter that is odd while the
+    record is being written, and readers retry until they copy a record with the same even
+    value before and after. That needs one writer at a time per record, and any worker can
+    ingest a device (HTTP telemetry lands anywhere), so a write holds a byte-range lock on
+    just that record; writers of different devices never contend. Claiming a record for a
+    new device takes an exclusive flock on the file. Records are never freed; when the file is full,
+    new devices are simply not shared (reads fall back to the DB). Put the file on tmpfs
+    (/dev/shm) in production.
+    """
+
+    def __init__(self, path: str, capacity: int = 16384, n_buckets: int = 61, bucket_s: int = 10,
+                 clock: Callable[[], float] = time):
+        self.path = path
+        self.capacity = capacity
+        self.n_buckets = n_buckets
+        self.bucket_s = bucket_s
+        self.clock = clock
+        self.record_size = _SEQ.size + _BODY.size + n_buckets * (8 + 4 + 8)
+        self.full_drops = 0
+        self._slots: Dict[str, int] = {}  # this process's device_id -> record offset cache
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._open()
+
+    # -------- File --------
+    def _open(self):
+        want = _HEADER.pack(MAGIC, VERSION, self.capacity, self.record_size, self.n_buckets, self.bucket_s)
+        size = _HEADER_SIZE + self.capacity * self.record_size
+        lock_fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)  # one worker creates/replaces, the rest map its file
+            try:
+                with open(self.path, "rb") as f:
+                    ok = f.read(_HEADER.size) == want
+            except FileNotFoundError:
+                ok = False
+            if not ok:
+                # Missing, or a layout from an older deploy: processes still mapping that one keep their copy
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(want.ljust(_HEADER_SIZE, b"\0"))
+                    f.truncate(size)
+                os.replace(tmp, self.path)
+            self._fd = os.open(self.path, os.O_RDWR)
+        finally:
+            os.close(lock_fd)  # also drops the flock
+        self._mm = mmap.mmap(self._fd, size)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+    def _offset(self, k: int) -> int:
+        return _HEADER_SIZE + k * self.record_size
+
+    def _id_at(self, off: int) -> bytes:
+        return self._mm[off + _SEQ.size:off + _SEQ.size + 64].rstrip(b"\0")
+
+    # -------- Records --------
+    def _find(self, key: bytes) -> Optional[int]:
+        k = zlib.crc32(key) % self.capacity
+        for _ in range(self.capacity):
+            off = self._offset(k)
+            cur = self._id_at(off)
+            if cur == key:
+                return off
+            if not cur:
+                return None
+            k = (k + 1) % self.capacity
+        return None
+
+    def _claim(self, device_id: str) -> Optional[int]:
+        key = device_id.encode("utf-8")[:64]
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                k = zlib.crc32(key) % self.capacity
+                for _ in range(self.capacity):
+                    off = self._offset(k)
+                    cur = self._id_at(off)
+                    if cur == key:
+                        break
+                    if not cur:
+                        self._mm[off + _SEQ.size:off + _SEQ.size + 64] = key.ljust(64, b"\0")
+                        break
+                    k = (k + 1) % self.capacity
+                else:
+                    return None
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._slots[device_id] = off
+        return off
+
+    def write(self, device_id: str, kind: int, payload: dict, last_seen: float,
+              ring=None, idle=None) -> bool:
+        """
+        Publish one device's state. `ring` is RollingStats.ring(), `idle` is
+        IdleDetector.window_state(); either may be None. Returns False if the file is full.
+        """
+        off = self._slots.get(device_id)
+        if off is None:
+            off = self._claim(device_id)
+            if off is None:
+                self.full_drops += 1
+                return False
+        vals = []
+        for name in ("v", "i", "p", "pf", "f", "e_wh"):
+            val = payload.get(name)
+            try:
+                vals.append(float(val) if val is not None else _NAN)
+            except (TypeError, ValueError):
+                vals.append(_NAN)
+        avg_w, n, below, last_ts, th, du = idle if idle is not None else (_NAN, 0, _NAN, _NAN, _NAN, _NAN)
+        body = _BODY.pack(device_id.encode("utf-8")[:64], kind, self._pid, time(), last_seen, *vals,
+                          avg_w, below, last_ts, th, du, n)
+        if ring is not None:
+            sums, counts, buckets = ring
+            blob = body + sums.tobytes() + counts.tobytes() + buckets.tobytes()
+        else:
+            blob = body + bytes(self.n_buckets * 12) + b"\xff" * (self.n_buckets * 8)  # buckets -1: empty
+        mm = self._mm
+        with self._lock:  # writer threads of this process
+            if fcntl is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, self.record_size, off)  # writers in other processes
+            try:
+                seq = _SEQ.unpack_from(mm, off)[0]
+                seq += 1 if seq % 2 == 0 else 2  # odd: write in progress (already odd: a writer died mid-write)
+                _SEQ.pack_into(mm, off, seq)
+                start = off + _SEQ.size
+                mm[start:start + len(blob)] = blob
+                _SEQ.pack_into(mm, off, seq + 1)
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, self.record_size, off)
+        return True
+
+    def _copy(self, off: int, retries: int = 100) -> Optional[bytes]:
+        mm = self._mm
+        for _ in range(retries):
+            s1 = _SEQ.unpack_from(mm, off)[0]
+            if s1 % 2:
+                continue
+            if not s1:
+                return None  # claimed, never written
+            raw = mm[off:off + self.record_size]
+            if _SEQ.unpack_from(mm, off)[0] == s1:
+                return raw
+        return None
+
+    def read(self, device_id: str, now: Optional[float] = None) -> Optional[dict]:
+        """Latest values, 1/5/10-minute averages and idle window of a device, or None if not shared."""
+        off = self._slots.get(device_id)
+        if off is None:
+            off = self._find(device_id.encode("utf-8")[:64])
+            if off is None:
+                return None
+            self._slots[device_id] = off
+        raw = self._copy(off)
+        if raw is None:
+            return None
+        (_, kind, pid, _, last_seen, v, i, p, pf, f, e_wh,
+         avg_w, below, last_ts, th, du, n) = _BODY.unpack_from(raw, _SEQ.size)
+        base = _SEQ.size + _BODY.size
+        nb = self.n_buckets
+        sums = np.frombuffer(raw, np.float64, nb, base)
+        counts = np.frombuffer(raw, np.int32, nb, base + 8 * nb)
+        buckets = np.frombuffer(raw, np.int64, nb, base + 12 * nb)
+        now = self.clock() if now is None else now
+        return {
+            "device_id": device_id,
+            "kind": kind,
+            "last_seen": last_seen,
+            "writer_pid": pid,
+            "payload": {name: x for name, x in (("v", v), ("i", i), ("p", p), ("pf", pf), ("f", f), ("e_wh", e_wh))
+                        if not math.isnan(x)},
+            "avg_1m_w": RollingStats.window_avg(sums, counts, buckets, self.bucket_s, 60, now),
+            "avg_5m_w": RollingStats.window_avg(sums, counts, buckets, self.bucket_s, 300, now),
+            "avg_10m_w": RollingStats.window_avg(sums, counts, buckets, self.bucket_s, 600, now),
+            "idle": {
+                "threshold_w": None if math.isnan(th) else th,
+                "duration_s": None if math.isnan(du) else int(du),
+                "avg_w": avg_w if n else None,
+                "samples": n,
+                "below_since": None if math.isnan(below) else below,
+                "last_ts": last_ts,
+            },
+        }
+
+    # -------- Introspection --------
+    def report(self) -> dict:
+        used = sum(1 for k in range(self.capacity) if self._mm[self._offset(k) + _SEQ.size] != 0)
+        return {
+            "path": self.path,
+            "capacity": self.capacity,
+            "devices": used,
+            "record_bytes": self.record_size,
+            "file_bytes": _HEADER_SIZE + self.capacity * self.record_size,
+            "full_drops": self.full_drops,
+        }
@@ -0,0 +1,95 @@
+import os
+import threading
+from time import perf_counter
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from .device_state import DeviceStateStore
+
+SNAPSHOT_VERSION = 1
+
+
+class StateSnapshotter:
+    """
+    Periodic, crash-safe snapshots of the DeviceStateStore (and everything attached to it).
+
+    The state is copied under the store lock, written uncompressed with np.savez to
+    `<path>.tmp`, fsync'ed and atomically renamed over `path`, so a crash mid-write
+    leaves the previous snapshot intact. `extra` lets the app add its own arrays
+    (e.g. the offline set) under the "app." prefix.
+    """
+
+    def __init__(self, store: DeviceStateStore, path: str, interval_s: float = 60.0,
+                 extra: Optional[Callable[[], Dict[str, np.ndarray]]] = None):
+        self.store = store
+        self.path = path
+        self.interval_s = interval_s
+        self.extra = extra
+        self.last_saved_at: Optional[float] = None
+        self.last_save_ms: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def save(self) -> float:
+        """Write a snapshot now; returns its timestamp (epoch seconds)."""
+        t0 = perf_counter()
+        arrays = self.store.export_state()
+        taken_at = float(arrays.pop("store.taken_at"))  # stamped under the store lock, on the store's clock
+        if self.extra:
+            arrays.update({"app." + k: v for k, v in self.extra().items()})
+        arrays["meta.version"] = np.array(SNAPSHOT_VERSION)
+        arrays["meta.taken_at"] = np.array(taken_at)
+
+        d = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(d, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        try:
+            dir_fd = os.open(d, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)  # make the rename itself durable
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass  # not supported on every platform (e.g. Windows)
+        self.last_saved_at = taken_at
+        self.last_save_ms = (perf_counter() - t0) * 1000
+        return taken_at
+
+    def load(self) -> Optional[Dict[str, np.ndarray]]:
+        """Read the snapshot into the (empty) store. Returns all arrays (incl. meta./app.) or None."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path, allow_pickle=False) as z:
+                arrays = {k: z[k] for k in z.files}
+        except Exception as e:
+            print("[Snapshot] unreadable, starting cold:", e)
+            return None
+        if int(arrays.get("meta.version", -1)) != SNAPSHOT_VERSION:
+            print("[Snapshot] version mismatch, starting cold")
+            return None
+        self.store.import_state({k: v for k, v in arrays.items() if not k.startswith(("meta.", "app."))})
+        return arrays
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.save()
+            except Exception as e:
+                print("[Snapshot] save failed:", e)
+
+    def start(self):
+        if self.interval_s <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="state-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
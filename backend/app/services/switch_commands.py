@@ -0,0 +1,334 @@
+import bisect
+import json
+import threading
+import uuid
+from datetime import datetime
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from ..models import Action
+from .metrics import REGISTRY
+
+COMMAND_SECONDS = REGISTRY.histogram(
+    "spo_switch_command_seconds", "Switch command publish -> broker PUBACK / device ack", ("phase",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+COMMANDS = REGISTRY.counter("spo_switch_commands", "Switch commands by outcome", ("status",))
+
+Key = Tuple[str, str]  # (switch_id, channel)
+
+# Command lifecycle: queued -> sent -> acked | failed; queued commands can end superseded/coalesced
+SETTLED = ("acked", "failed", "superseded", "coalesced")
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram in milliseconds (cumulative-free counts, upper-bound quantiles)."""
+
+    BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self, bounds_ms: Tuple[float, ...] = BOUNDS_MS):
+        self.bounds = tuple(bounds_ms)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+            self.count += 1
+            self.sum += ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return float(self.bounds[i]) if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count, 2) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "buckets": {(str(b) if i < len(self.bounds) else "+Inf"): c
+                        for i, (b, c) in enumerate(zip(self.bounds + (None,), self.counts))},
+        }
+
+
+class SwitchCommand:
+    __slots__ = ("id", "device_id", "switch_id", "channel", "state", "action", "alert_id", "reason",
+                 "manager_id", "status", "attempts", "mid", "t_submit", "t_sent", "t_settled",
+                 "row_id", "done")
+
+    def __init__(self, device_id: str, switch_id: str, channel: str, state: str, action: str,
+                 alert_id: Optional[int], reason: Optional[str], manager_id: Optional[str], now: float):
+        self.id = uuid.uuid4().hex[:16]  # correlation id echoed by the device in its ack
+        self.device_id = device_id
+        self.switch_id = switch_id
+        self.channel = str(channel)  # topics carry it as text
+        self.state = state
+        self.action = action
+        self.alert_id = alert_id
+        self.reason = reason
+        self.manager_id = manager_id
+        self.status = "queued"
+        self.attempts = 0
+        self.mid: Optional[int] = None
+        self.t_submit = now
+        self.t_sent: Optional[float] = None
+        self.t_settled: Optional[float] = None
+        self.row_id: Optional[int] = None
+        self.done = threading.Event()
+
+    @property
+    def latency_ms(self) -> Optional[float]:
+        if self.status != "acked" or self.t_sent is None or self.t_settled is None:
+            return None
+        return round((self.t_settled - self.t_sent) * 1000, 1)
+
+    def as_dict(self) -> dict:
+        return {
+            "command_id": self.id,
+            "device_id": self.device_id,
+            "switch_id": self.switch_id,
+            "channel": self.channel,
+            "state": self.state,
+            "status": self.status,
+            "attempts": self.attempts,
+            "alert_id": self.alert_id,
+            "latency_ms": self.latency_ms,
+        }
+
+
+class SwitchCommander:
+    """
+    Switch-command pipeline: QoS 1 publish, correlation ids, ack tracking, per-switch coalescing.
+
+    At most one command per (switch, channel) is in flight. Commands submitted while one is
+    in flight wait in a single "queued" slot, and a newer command replaces (supersedes) the
+    queued one, so rapid ON/OFF flapping collapses to the final state. When the in-flight
+    command settles, the queued one is published, or settled as "coalesced" if the switch
+    already reports that state. Acks come from the device's `.../ack` (JSON with "cid") or
+    `.../state` topic. Unacked commands are re-published after `ack_timeout_s` (a
+    "switch_ack" deadline on the shared scheduler) up to `max_retries` times, then marked
+    failed. Every command is persisted as an Action row and updated as its status changes.
+    """
+
+    def __init__(self, publish: Callable[..., Optional[int]], engine, scheduler=None, *,
+                 ack_timeout_s: float = 10.0, max_retries: int = 2, require_ack: bool = False,
+                 ack_wait_s: float = 3.0, on_settled: Optional[Callable[[SwitchCommand], None]] = None,
+                 clock: Callable[[], float] = time):
+        self.publish = publish  # (switch_id, state, channel, correlation_id=...) -> mid | None
+        self.engine = engine
+        self.scheduler = scheduler
+        self.ack_timeout_s = ack_timeout_s
+        self.max_retries = max_retries
+        self.require_ack = require_ack
+        self.ack_wait_s = ack_wait_s
+        self.on_settled = on_settled
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._by_id: Dict[str, SwitchCommand] = {}
+        self._inflight: Dict[Key, SwitchCommand] = {}
+        self._queued: Dict[Key, SwitchCommand] = {}
+        self._by_mid: Dict[int, SwitchCommand] = {}
+        self.reported: Dict[Key, str] = {}  # last state reported by each switch channel
+        self.ack_latency = LatencyHistogram()     # publish -> device ack
+        self.puback_latency = LatencyHistogram()  # publish -> broker PUBACK (QoS 1)
+        self.counts = {s: 0 for s in ("sent", "republished") + SETTLED}
+
+    # -------- Submit --------
+    def submit(self, device_id: str, switch_id: str, channel: Optional[str], state: str, *,
+               action: Optional[str] = None, alert_id: Optional[int] = None,
+               reason: Optional[str] = None, manager_id: Optional[str] = None) -> SwitchCommand:
+        state = state.upper()
+        cmd = SwitchCommand(device_id, switch_id, channel or "ch1", state, action or state.lower(),
+                            alert_id, reason, manager_id, self.clock())
+        key = (cmd.switch_id, cmd.channel)
+        superseded = None
+        with self._lock:
+            self._by_id[cmd.id] = cmd
+            if key in self._inflight:
+                superseded = self._queued.get(key)
+                self._queued[key] = cmd
+                if superseded is not None:
+                    self._settle_locked(superseded, "superseded")
+            else:
+                self._inflight[key] = cmd
+        self._persist(cmd)
+        if superseded is not None:
+            self._finish(superseded)
+        if cmd.status == "queued" and self._inflight.get(key) is cmd:
+            self._send(cmd)
+        return cmd
+
+    def wait(self, cmd: SwitchCommand, timeout: Optional[float] = None) -> bool:
+        """Block until the command settles (or timeout); True when the switch confirmed it."""
+        cmd.done.wait(self.ack_wait_s if timeout is None else timeout)
+        return cmd.status in ("acked", "coalesced")
+
+    def _send(self, cmd: SwitchCommand):
+        now = self.clock()
+        with self._lock:
+            cmd.attempts += 1
+            first = cmd.t_sent is None
+            cmd.t_sent = now if first else cmd.t_sent
+            cmd.status = "sent"
+            self.counts["sent" if first else "republished"] += 1
+            COMMANDS.labels("sent" if first else "republished").inc()
+        try:
+            mid = self.publish(cmd.switch_id, cmd.state, cmd.channel, correlation_id=cmd.id)
+        except Exception as e:
+            print(f"[Switch] publish failed for {cmd.switch_id}/{cmd.channel}:", e)
+            mid = None
+        if mid is not None:
+            with self._lock:
+                cmd.mid = mid
+                self._by_mid[mid] = cmd
+        if first:
+            self._persist(cmd)
+        if self.scheduler is not None:
+            self.scheduler.schedule(cmd.id, "switch_ack", now + self.ack_timeout_s)
+
+    # -------- Device / broker feedback (MQTT thread) --------
+    def on_puback(self, mid: int):
+        with self._lock:
+            cmd = self._by_mid.pop(mid, None)
+        if cmd is not None and cmd.t_sent is not None:
+            dt = self.clock() - cmd.t_sent
+            self.puback_latency.observe(dt * 1000)
+            COMMAND_SECONDS.labels("puback").observe(dt)
+
+    def on_report(self, switch_id: str, channel: str, topic_kind: str, raw: bytes | str):
+        """Handle `.../{switch}/{channel}/ack` or `.../state`. Payload: "ON"/"OFF" or JSON {"state", "cid"}."""
+        text = raw.decode("utf-8", "replace") if isinstance(raw, bytes) else str(raw)
+        cid = None
+        state = text.strip()
+        if state.startswith("{"):
+            try:
+                body = json.loads(state)
+            except ValueError:
+                return
+            cid = body.get("cid") or body.get("correlation_id")
+            state = str(body.get("state", ""))
+        state = state.upper()
+        key = (switch_id, channel)
+        with self._lock:
+            if state in ("ON", "OFF"):
+                self.reported[key] = state
+            cmd = self._by_id.get(cid) if cid else self._inflight.get(key)
+            if cmd is None or cmd.status != "sent":
+                return
+            if not cid and state != cmd.state:
+                return  # a state report for something else (e.g. a manual press)
+            self._settle_locked(cmd, "acked")
+        self.ack_latency.observe(cmd.latency_ms or 0.0)
+        COMMAND_SECONDS.labels("ack").observe((cmd.latency_ms or 0.0) / 1000)
+        self._finish(cmd)
+
+    def on_timeout(self, command_id: str):
+        """Deadline "switch_ack" fired: re-publish or give up."""
+        with self._lock:
+            cmd = self._by_id.get(command_id)
+            if cmd is None or cmd.status != "sent":
+                return
+            retry = cmd.attempts <= self.max_retries
+            if not retry:
+                self._settle_locked(cmd, "failed")
+        if retry:
+            print(f"[Switch] no ack for {cmd.switch_id}/{cmd.channel} {cmd.state} (cid={cmd.id}), re-publishing")
+            self._send(cmd)
+        else:
+            print(f"[Switch] command {cmd.id} to {cmd.switch_id}/{cmd.channel} failed after {cmd.attempts} attempts")
+            self._finish(cmd)
+
+    # -------- Settling --------
+    def _settle_locked(self, cmd: SwitchCommand, status: str):
+        cmd.status = status
+        cmd.t_settled = self.clock()
+        self.counts[status] += 1
+        COMMANDS.labels(status).inc()
+        if cmd.mid is not None:
+            self._by_mid.pop(cmd.mid, None)
+
+    def _finish(self, cmd: SwitchCommand):
+        """Persist, notify and release the next queued command for the same switch."""
+        if self.scheduler is not None:
+            self.scheduler.cancel(cmd.id, "switch_ack")
+        self._persist(cmd)
+        cmd.done.set()
+        if self.on_settled is not None:
+            try:
+                self.on_settled(cmd)
+            except Exception as e:
+                print("[Switch] on_settled error:", e)
+        key = (cmd.switch_id, cmd.channel)
+        nxt = None
+        with self._lock:
+            if self._inflight.get(key) is cmd:
+                del self._inflight[key]
+                nxt = self._queued.pop(key, None)
+                if nxt is not None:
+                    self._inflight[key] = nxt
+                    if cmd.status == "acked" and self.reported.get(key) == nxt.state:
+                        self._settle_locked(nxt, "coalesced")
+            self._by_id.pop(cmd.id, None)
+        if nxt is None:
+            return
+        if nxt.status == "coalesced":
+            self._finish(nxt)
+        else:
+            self._send(nxt)
+
+    # -------- Persistence --------
+    def _persist(self, cmd: SwitchCommand):
+        try:
+            with Session(self.engine) as s:
+                row = s.get(Action, cmd.row_id) if cmd.row_id is not None else None
+                if row is None:
+                    row = Action(
+                        alert_id=cmd.alert_id,
+                        device_id=cmd.device_id,
+                        action=cmd.action,
+                        manager_id=cmd.manager_id,
+                        reason=cmd.reason,
+                        command_id=cmd.id,
+                        switch_id=cmd.switch_id,
+                        channel=cmd.channel,
+                        state=cmd.state,
+                    )
+                row.status = cmd.status
+                row.attempts = cmd.attempts
+                if cmd.t_settled is not None:
+                    row.ts_settled = datetime.utcfromtimestamp(cmd.t_settled)
+                    row.latency_ms = cmd.latency_ms
+                s.add(row)
+                s.commit()
+                cmd.row_id = row.id
+        except Exception as e:
+            print("[Switch] persist error:", e)
+
+    # -------- Introspection --------
+    def get(self, command_id: str) -> Optional[SwitchCommand]:
+        return self._by_id.get(command_id)
+
+    def pending(self) -> List[dict]:
+        with self._lock:
+            return [c.as_dict() for c in list(self._inflight.values()) + list(self._queued.values())]
+
+    def snapshot(self) -> dict:
+        return {
+            "require_ack": self.require_ack,
+            "counts": dict(self.counts),
+            "pending": self.pending(),
+            "ack_latency": self.ack_latency.snapshot(),
+            "puback_latency": self.puback_latency.snapshot(),
+        }
@@ -0,0 +1,289 @@
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from time import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlmodel import Session, create_engine, select
+
+from ..models import Device, TelemetryAC, TelemetryDC
+from .power_sketch import QuantileSketch
+
+_TABLES = {"dc_sensor": TelemetryDC, "ac_sensor": TelemetryAC}
+
+
+# -------- Grid evaluation (pure numpy) --------
+def window_means(ts: np.ndarray, w: np.ndarray, window_s: float) -> np.ndarray:
+    """Moving average over the trailing `window_s` at every sample, as IdleDetector.add computes it."""
+    start = np.minimum(np.searchsorted(ts, ts - window_s, side="right"), np.arange(len(ts)))
+    cs = np.concatenate([[0.0], np.cumsum(w)])
+    idx = np.arange(len(ts))
+    return (cs[idx + 1] - cs[start]) / (idx + 1 - start)
+
+
+class IdleGrid:
+    """
+    Idle alerts and avoidable Wh for every (threshold, duration) pair over one device's
+    history, fed in time order one chunk at a time.
+
+    Same rule as IdleDetector: an alert fires once the window average has stayed below the
+    threshold for the duration; a below-threshold run raises at most one alert. Avoidable
+    energy is what the device drew from that alert until the run ended, i.e. what switching
+    it off at the alert would have saved. Sample intervals longer than `max_gap_s` (device
+    offline) count as `max_gap_s`.
+
+    Working memory is O(thresholds x chunk): what crosses a chunk boundary is the window's
+    tail, each threshold's run start, whether each pair has alerted in the current run and
+    the last sample (its interval ends at the next one).
+    """
+
+    def __init__(self, thresholds: Sequence[float], durations: Sequence[float], window_s: float,
+                 max_gap_s: float):
+        self.th = np.asarray(thresholds, dtype=np.float64)[:, None]
+        self.du = np.asarray(durations, dtype=np.float64)
+        self.window_s = window_s
+        self.max_gap_s = max_gap_s
+        n_th, n_du = len(self.th), len(self.du)
+        self.alerts = np.zeros((n_th, n_du), dtype=np.int64)
+        self.wh = np.zeros((n_th, n_du))
+        self._tail = (np.empty(0), np.empty(0))  # samples still inside the trailing window
+        self._pending = (np.empty(0), np.empty(0), np.empty(0))  # (ts, w, mean) awaiting the next ts
+        self._below = np.zeros(n_th, dtype=bool)  # last sample below each threshold
+        self._run_ts = np.zeros(n_th)  # start of the current below-threshold run
+        self._reached = np.zeros((n_th, n_du), dtype=bool)  # current run already past the duration
+
+    def feed(self, ts: np.ndarray, w: np.ndarray):
+        if not len(ts):
+            return
+        tail_ts, tail_w = self._tail
+        all_ts, all_w = np.concatenate([tail_ts, ts]), np.concatenate([tail_w, w])
+        mean = window_means(all_ts, all_w, self.window_s)[len(tail_ts):]
+        keep = all_ts > ts[-1] - self.window_s
+        self._tail = (all_ts[keep], all_w[keep])
+        p_ts, p_w, p_mean = self._pending
+        q_ts, q_w, q_mean = np.concatenate([p_ts, ts]), np.concatenate([p_w, w]), np.concatenate([p_mean, mean])
+        dt = np.minimum(np.diff(q_ts), self.max_gap_s)
+        self._step(q_ts[:-1], q_w[:-1], q_mean[:-1], dt)
+        self._pending = (q_ts[-1:], q_w[-1:], q_mean[-1:])
+
+    def finish(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(alerts, wh), both shaped (thresholds, durations); the last sample counts no energy."""
+        p_ts, p_w, p_mean = self._pending
+        self._step(p_ts, p_w, p_mean, np.zeros(len(p_ts)))
+        self._pending = (np.empty(0), np.empty(0), np.empty(0))
+        return self.alerts, self.wh
+
+    def _step(self, ts: np.ndarray, w: np.ndarray, mean: np.ndarray, dt: np.ndarray):
+        m = len(ts)
+        if m == 0:
+            return
+        energy = w * dt / 3600.0  # Wh drawn until the next sample
+        below = mean[None, :] < self.th  # (T, m)
+        prev = np.concatenate([self._below[:, None], below[:, :-1]], axis=1)
+        run_start = below & ~prev
+        run_idx = np.maximum.accumulate(np.where(run_start, np.arange(m), -1), axis=1)
+        start_ts = np.where(run_idx >= 0, ts[np.maximum(run_idx, 0)], self._run_ts[:, None])
+        elapsed = np.where(below, ts[None, :] - start_ts, -1.0)  # -1: not below
+        for j, d in enumerate(self.du):  # one (T, m) slice at a time, never (T, D, m)
+            reached = elapsed >= d
+            carried = np.concatenate([self._reached[:, j, None], reached[:, :-1]], axis=1)
+            self.alerts[:, j] += (reached & ~carried).sum(axis=1)
+            self.wh[:, j] += np.where(reached, energy, 0.0).sum(axis=1)
+            self._reached[:, j] = reached[:, -1]
+        self._below = below[:, -1]
+        self._run_ts = start_ts[:, -1]
+
+
+def simulate_grid(ts: np.ndarray, w: np.ndarray, thresholds: Sequence[float], durations: Sequence[float],
+                  window_s: float, max_gap_s: float, chunk: int = 20000) -> Tuple[np.ndarray, np.ndarray]:
+    """IdleGrid over in-memory arrays. Returns (alerts, wh), both shaped (thresholds, durations)."""
+    grid = IdleGrid(thresholds, durations, window_s, max_gap_s)
+    for i in range(0, len(ts), chunk):
+        grid.feed(ts[i:i + chunk], w[i:i + chunk])
+    return grid.finish()
+
+
+def recommend(thresholds: Sequence[float], durations: Sequence[float], alerts: np.ndarray, wh: np.ndarray,
+              days: float, max_alerts_per_day: float, max_threshold_w: float) -> Optional[Tuple[int, int]]:
+    """
+    Grid index with the most avoidable energy within the alert budget (fewer alerts, longer
+    duration on ties). Thresholds above `max_threshold_w` are never picked: they would call
+    the device's working load idle, which "saves" the most energy on paper.
+    """
+    ok = (alerts <= max_alerts_per_day * days) & (np.asarray(thresholds)[:, None] <= max_threshold_w)
+    if not ok.any():
+        return None
+    cand = [(-wh[i, j], alerts[i, j], -durations[j], i, j) for i, j in zip(*np.nonzero(ok))]
+    _, _, _, i, j = min(cand)
+    return (int(i), int(j)) if wh[i, j] > 0 else None
+
+
+# -------- Per-device history (runs in pool workers) --------
+_EPOCH = datetime(1970, 1, 1)
+_engines: Dict[str, object] = {}  # per worker process
+
+
+def _history(session: Session, table, device_id: str, since: datetime, chunk: int = 20000):
+    """(ts, watts) array chunks for one device, in time order, streamed from the DB."""
+    rows = session.exec(
+        select(table.ts, table.power_w)
+        .where(table.device_id == device_id, table.ts >= since)
+        .order_by(table.ts)
+        .execution_options(yield_per=chunk)
+    )
+    for part in rows.partitions(chunk):
+        yield (np.fromiter(((t - _EPOCH).total_seconds() for t, _ in part), np.float64, len(part)),
+               np.fromiter((p or 0.0 for _, p in part), np.float64, len(part)))
+
+
+def simulate_devices(db_url: str, devices: List[Tuple[str, str, float, int]], since: datetime, days: float,
+                     params: dict) -> List[dict]:
+    """Pool task: replay a chunk of devices [(device_id, kind, threshold_w, duration_s)] through the grid."""
+    engine = _engines.get(db_url)
+    if engine is None:
+        engine = _engines[db_url] = create_engine(db_url)
+    thresholds, durations = params["thresholds_w"], params["durations_sec"]
+    kwh_cost = params["tariff_usd_per_kwh"]
+    out = []
+    with Session(engine) as s:
+        for device_id, kind, cur_th, cur_du in devices:
+            grid_th = sorted(set(thresholds) | {cur_th})
+            grid_du = sorted(set(durations) | {cur_du})
+            grid = IdleGrid(grid_th, grid_du, params["window_s"], params["max_gap_s"])
+            power = QuantileSketch()  # for active_w without keeping the history
+            for ts, w in _history(s, _TABLES[kind], device_id, since):
+                grid.feed(ts, w)
+                power.add_many(w)
+            alerts, wh = grid.finish()
+            ci, cj = grid_th.index(cur_th), grid_du.index(cur_du)
+            active_w = power.quantiles([0.9])[0] or 0.0
+            best = recommend(grid_th, grid_du, alerts, wh, days, params["max_alerts_per_day"],
+                             params["max_threshold_frac"] * active_w)
+
+            def cell(i, j):
+                return {"idle_threshold_w": grid_th[i], "idle_duration_sec": int(grid_du[j]),
+                        "alerts": int(alerts[i, j]), "avoidable_kwh": round(wh[i, j] / 1000, 4),
+                        "avoidable_usd": round(wh[i, j] / 1000 * kwh_cost, 4)}
+
+            out.append({
+                "device_id": device_id,
+                "samples": power.count,
+                "active_w": round(active_w, 3),  # 90th percentile of power (sketch, within 1%)
+                "current": cell(ci, cj),
+                "grid": [cell(i, j) for i in range(len(grid_th)) for j in range(len(grid_du))],
+                # body for PATCH /devices/{id}/config; None when nothing in the budget saves energy
+                "recommended": ({"idle_threshold_w": grid_th[best[0]], "idle_duration_sec": int(grid_du[best[1]])}
+                                if best is not None else None),
+                "recommended_result": cell(*best) if best is not None else None,
+            })
+    return out
+
+
+# -------- Jobs --------
+class WhatIfJobs:
+    """
+    Background what-if runs of the idle rule over stored telemetry.
+
+    Each job lists the devices, splits them into chunks and hands the chunks to a process
+    pool (spawned, so workers don't inherit this process's threads or DB connections);
+    every worker streams its devices' history from the DB one device at a time, chunk by
+    chunk, through an IdleGrid that evaluates the whole threshold x duration grid. Jobs and their
+    results stay in memory until `keep` newer ones exist.
+    """
+
+    def __init__(self, engine, db_url: str, detector, workers: int = 0, tariff_usd_per_kwh: float = 0.2,
+                 keep: int = 20, clock: Callable[[], float] = time):
+        self.engine = engine
+        self.clock = clock
+        self.db_url = db_url
+        self.detector = detector
+        self.workers = workers or max(1, (multiprocessing.cpu_count() or 2) - 1)
+        self.tariff = tariff_usd_per_kwh
+        self.keep = keep
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def start(self, *, days: float = 7, device_ids: Optional[List[str]] = None,
+              thresholds_w: Sequence[float] = (2, 5, 10, 20, 50), durations_sec: Sequence[int] = (120, 300, 600, 1800),
+              max_alerts_per_day: float = 3.0, max_threshold_frac: float = 0.5, max_gap_s: float = 600.0,
+              chunk: int = 25) -> dict:
+        params = {
+            "thresholds_w": [float(x) for x in thresholds_w],
+            "durations_sec": [float(x) for x in durations_sec],
+            "window_s": self.detector.window_s,
+            "max_gap_s": max_gap_s,
+            "max_alerts_per_day": max_alerts_per_day,
+            "max_threshold_frac": max_threshold_frac,
+            "tariff_usd_per_kwh": self.tariff,
+        }
+        with Session(self.engine) as s:
+            q = select(Device.device_id, Device.kind).where(Device.kind.in_(list(_TABLES)))
+            if device_ids:
+                q = q.where(Device.device_id.in_(device_ids))
+            devices = [(d, k, *self.detector._cfg(d)) for d, k in s.exec(q.order_by(Device.device_id)).all()]
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "status": "running",
+            "created_at": self.clock(),
+            "finished_at": None,
+            "days": days,
+            "params": params,
+            "devices": len(devices),
+            "done": 0,
+            "error": None,
+            "results": [],
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            for old in sorted(self._jobs.values(), key=lambda j: j["created_at"])[:-self.keep]:
+                self._jobs.pop(old["id"], None)
+        since = datetime.utcfromtimestamp(self.clock()) - timedelta(days=days)
+        chunks = [devices[i:i + chunk] for i in range(0, len(devices), chunk)]
+        threading.Thread(target=self._run, args=(job, chunks, since), name=f"whatif-{job['id']}",
+                         daemon=True).start()
+        return self.summary(job)
+
+    def _run(self, job: dict, chunks: list, since: datetime):
+        try:
+            pool = self._executor()
+            futs = [pool.submit(simulate_devices, self.db_url, c, since, job["days"], job["params"]) for c in chunks]
+            for f in as_completed(futs):
+                part = f.result()
+                with self._lock:
+                    job["results"].extend(part)
+                    job["done"] += len(part)
+            job["results"].sort(key=lambda r: r["device_id"])
+            job["status"] = "done"
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self._pool = None  # a worker died: start the next job with a fresh pool
+            job["status"], job["error"] = "failed", repr(e)
+            print(f"[WhatIf] job {job['id']} failed: {e!r}")
+        job["finished_at"] = self.clock()
+
+    def summary(self, job: dict) -> dict:
+        return {k: v for k, v in job.items() if k != "results"}
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[dict]:
+        return [self.summary(j) for j in sorted(self._jobs.values(), key=lambda j: -j["created_at"])]
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
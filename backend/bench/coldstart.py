@@ -0,0 +1,120 @@
+"""
+Cold-start budget check: import time, time to live and time to ready, in fresh interpreters.
+
+    cd backend && python -m bench.coldstart [--runs 5] [--devices 0] [--budget-import-ms 3000]
+                                            [--budget-ready-ms 30000] [--out result.json]
+
+Each run starts a new Python process (what every gunicorn worker pays), imports app.main,
+enters the lifespan through TestClient and polls /livez and /readyz. The per-phase warm-up
+times come from the app's own Readiness report. `--devices` seeds a scratch SQLite DB
+with that many devices first, so the device scan and offline-timer seeding are included.
+Exits 1 when the median import or ready time exceeds its budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+_CHILD = r"""
+import json, os, sys, time
+t_proc = time.perf_counter()
+import paho.mqtt.client as mqtt
+mqtt.Client.connect = lambda *a, **k: 0  # keep the run off the network
+mqtt.Client.loop_forever = lambda *a, **k: None
+t0 = time.perf_counter()
+import app.main as M
+t_import = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(M.app) as c:
+    live = c.get("/livez").status_code
+    t_live = time.perf_counter()
+    while c.get("/readyz").status_code != 200:
+        if M.app.state.readiness.state == "failed" or time.perf_counter() - t0 > 120:
+            break
+        time.sleep(0.005)
+    t_ready = time.perf_counter()
+    report = M.app.state.readiness.report()
+sys.stdout.write("\n@@" + json.dumps({
+    "import_ms": (t_import - t0) * 1000,
+    "live_ms": (t_live - t0) * 1000,
+    "ready_ms": (t_ready - t0) * 1000,
+    "live_status": live,
+    "readiness": report,
+}))
+"""
+
+
+def _seed(db_path: str, n: int):
+    if n <= 0:
+        return
+    from sqlmodel import Session, SQLModel, create_engine
+    from app.models import Device
+    engine = create_engine(f"sqlite:///{db_path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as s:
+        for i in range(n):
+            s.add(Device(device_id=f"cold-{i:05d}", kind="dc_sensor"))
+        s.commit()
+
+
+def run(args) -> dict:
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, backend)
+    workdir = tempfile.mkdtemp(prefix="spo-coldstart-")
+    db_path = f"{workdir}/cold.db"
+    _seed(db_path, args.devices)
+    env = dict(os.environ, DB_URL=f"sqlite:///{db_path}", SNAPSHOT_PATH=f"{workdir}/state.npz",
+               SNAPSHOT_INTERVAL_SEC="0", SMTP_HOST="", WEBHOOK_URLS="", MQTT_CAPTURE_PATH="")
+    runs = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", _CHILD], cwd=backend, env=env,
+                             capture_output=True, text=True, timeout=180)
+        if "@@" not in out.stdout:
+            sys.exit(f"child failed:\n{out.stderr[-2000:]}")
+        runs.append(json.loads(out.stdout.rsplit("@@", 1)[1]))
+
+    def med(key):
+        return round(statistics.median(r[key] for r in runs), 1)
+
+    phases = {}
+    for r in runs:
+        for k, v in r["readiness"]["phases_ms"].items():
+            phases.setdefault(k, []).append(v)
+    result = {
+        "runs": args.runs,
+        "devices": args.devices,
+        "import_ms": med("import_ms"),
+        "live_ms": med("live_ms"),
+        "ready_ms": med("ready_ms"),
+        "ready_ms_max": round(max(r["ready_ms"] for r in runs), 1),
+        "phases_ms": {k: round(statistics.median(v), 1) for k, v in phases.items()},
+        "budget_import_ms": args.budget_import_ms,
+        "budget_ready_ms": args.budget_ready_ms,
+        "errors": sorted({r["readiness"]["error"] for r in runs if r["readiness"]["error"]}),
+    }
+    result["within_budget"] = (result["import_ms"] <= args.budget_import_ms
+                               and result["ready_ms"] <= args.budget_ready_ms and not result["errors"])
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--devices", type=int, default=0, help="seed the scratch DB with this many devices")
+    ap.add_argument("--budget-import-ms", type=float, default=3000)
+    ap.add_argument("--budget-ready-ms", type=float, default=30000)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args()
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    sys.exit(0 if result["within_budget"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Synthetic fleet load test for the ingest path.
+
+    cd backend && python -m bench.fleet [--devices 200] [--duration 900] [--rate 0.2]
+                                        [--transport fake|broker|http] [--broker localhost:1883]
+                                        [--realtime] [--out results.json] [--compare baseline.json]
+
+Simulates N DC/AC devices reporting every 1/rate seconds (device time) for `duration`
+seconds. Every device draws an active load; `--idle-fraction` of them have one long idle
+stretch that must raise exactly one idle alert, and `--dip-fraction` have short dips that
+must not. Samples carry device timestamps, so a 15-minute day-part runs in seconds unless
+`--realtime` paces them on the wall clock.
+
+Transports:
+  fake    messages go through MQTTBridge._on_message in-process (decode + ingest callbacks)
+  broker  a paho client publishes to a local broker the app is subscribed to (e.g. mosquitto)
+  http    POST /agent/telemetry/{dc|ac}/{id} through the ASGI app (TestClient), `--concurrency` threads
+
+By default MQTT messages are handled inline, to measure the pipeline itself; with
+`--admission` they go through the app's admission lanes as in production, so past what the
+DB keeps up with, samples are coalesced or shed (counts under `admission` in the result).
+Reports sustained throughput, p50/p99 ingest-to-commit latency, idle-alert precision/recall
+and memory growth (RSS and DeviceStateStore report). `--out` saves the result as JSON;
+`--compare` prints the change against a previous result.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# -------- Fleet model --------
+class Profile:
+    """One device's load: active level with noise, plus optional idle stretches [(start, end)] in sim seconds."""
+
+    def __init__(self, device_id: str, kind: str, base_w: float, idle_w: float, noise: float, idle=()):
+        self.device_id = device_id
+        self.kind = kind
+        self.base_w = base_w
+        self.idle_w = idle_w
+        self.noise = noise
+        self.idle = list(idle)
+
+    def power(self, t: float, rng: random.Random) -> float:
+        level = self.idle_w if any(a <= t < b for a, b in self.idle) else self.base_w
+        return max(0.0, rng.gauss(level, self.noise * level))
+
+
+def build_fleet(args, rng: random.Random):
+    th, du, win = args.idle_threshold, args.idle_duration, args.idle_window
+    need = du + win + 3 / args.rate  # idle stretch long enough for the window average to settle, plus slack
+    if need * 1.5 > args.duration:
+        sys.exit(f"--duration must be at least {need * 1.5:.0f}s for --idle-duration {du} / --idle-window {win}")
+    fleet, expect = [], set()
+    for j in range(args.devices):
+        kind = "ac" if j % 2 else "dc"
+        did = f"bench-{kind}-{j}"
+        base = rng.uniform(5, 12) * th if kind == "ac" else rng.uniform(3, 6) * th
+        idle_w = rng.uniform(0.05, 0.4) * th
+        r = rng.random()
+        stretches = []
+        if r < args.idle_fraction:
+            start = rng.uniform(0, args.duration - need * 1.25)
+            stretches = [(start, start + need)]
+            expect.add(did)
+        elif r < args.idle_fraction + args.dip_fraction:
+            # Dips shorter than the idle duration: must not alert
+            dip = max(1 / args.rate, (du - win) / 3)
+            start = rng.uniform(0, args.duration - dip * 3)
+            stretches = [(start, start + dip)]
+        fleet.append(Profile(did, kind, base, idle_w, 0.03, stretches))
+    return fleet, expect
+
+
+def messages(fleet, args, rng: random.Random, t_start: float):
+    """Time-ordered (sim_t, profile, payload) across the fleet; device phases are staggered."""
+    period = 1.0 / args.rate
+    phase = {p.device_id: rng.uniform(0, period) for p in fleet}
+    steps = int(args.duration * args.rate)
+    for k in range(steps):
+        for p in fleet:
+            t = k * period + phase[p.device_id]
+            w = p.power(t, rng)
+            if p.kind == "dc":
+                v = rng.gauss(12.0, 0.05)
+                payload = {"v": round(v, 3), "i": round(w / v, 4), "p": round(w, 3)}
+            else:
+                v = rng.gauss(230.0, 1.0)
+                payload = {"v": round(v, 2), "i": round(w / v / 0.95, 4), "p": round(w, 2),
+                           "pf": 0.95, "f": round(rng.gauss(50.0, 0.01), 3)}
+            payload["ts"] = t_start + t
+            yield t, p, payload
+
+
+# -------- Measurement helpers --------
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, KiB on Linux
+
+
+def pct(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3) if len(values) else None
+
+
+def git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class _Msg:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+# -------- Run --------
+def configure_env(args, workdir: str):
+    """App settings are read at import, so the bench owns them: temp DB, no mail, no webhooks."""
+    os.environ["DB_URL"] = args.db_url or f"sqlite:///{workdir}/bench.db"
+    os.environ["SNAPSHOT_PATH"] = f"{workdir}/state.npz"
+    os.environ["SNAPSHOT_INTERVAL_SEC"] = "0"
+    os.environ["IDLE_POWER_THRESHOLD_W"] = str(args.idle_threshold)
+    os.environ["IDLE_DURATION_SEC"] = str(args.idle_duration)
+    os.environ["IDLE_WINDOW_SEC"] = str(args.idle_window)
+    os.environ["OFFLINE_AFTER_SEC"] = "0"  # wall-clock timeouts are meaningless in accelerated time
+    os.environ["ANOMALY_DETECTION"] = "true" if args.anomalies else "false"
+    os.environ["SMTP_HOST"] = ""
+    os.environ["WEBHOOK_URLS"] = ""
+    os.environ["MQTT_BASE"] = args.mqtt_base
+    os.environ["ADMISSION_CONTROL"] = "true" if args.admission else "false"
+    if args.transport == "broker":
+        host, _, port = args.broker.partition(":")
+        os.environ["MQTT_HOST"] = host
+        os.environ["MQTT_PORT"] = port or "1883"
+        os.environ["MQTT_TLS"] = "false"
+        os.environ["MQTT_USERNAME"] = ""
+        os.environ["MQTT_CLIENT_ID"] = f"spo-bench-{os.getpid()}"
+    else:
+        import paho.mqtt.client as mqtt
+        mqtt.Client.connect = lambda *a, **k: 0  # in-process: no network
+        mqtt.Client.loop_forever = lambda *a, **k: None
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="spo-bench-")
+    configure_env(args, workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session, select
+    import app.main as M
+    from app.models import Alert
+
+    rng = random.Random(args.seed)
+    fleet, expect = build_fleet(args, rng)
+    t_start = time.time() - args.duration if not args.realtime else time.time()
+    lat: list = []
+    done = [0]
+    lat_lock = threading.Lock()
+
+    # Ingest-to-commit: wrap the ingest callbacks; the payload carries its send time
+    def timed(fn):
+        def _wrapped(device_id, payload):
+            fn(device_id, payload)
+            sent = payload.pop("_bench_sent", None)
+            if sent is not None:
+                with lat_lock:
+                    lat.append(time.perf_counter() - sent)
+                    done[0] += 1
+        return _wrapped
+
+    with TestClient(M.app) as client:
+        if not M.app.state.readiness.wait(60):
+            sys.exit(f"app not ready: {M.app.state.readiness.report()}")
+        M.mqtt.on_dc_measure = timed(M.mqtt.on_dc_measure)
+        M.mqtt.on_ac_measure = timed(M.mqtt.on_ac_measure)
+        rss0, mem0 = rss_bytes(), M.store.memory_report()["total_bytes"]
+        publisher = None
+        if args.transport == "broker":
+            import paho.mqtt.client as mqtt
+            publisher = mqtt.Client(client_id=f"spo-bench-pub-{os.getpid()}")
+            host, _, port = args.broker.partition(":")
+            publisher.connect(host, int(port or 1883))
+            publisher.loop_start()
+            time.sleep(1.0)  # let the app subscribe
+        pool = ThreadPoolExecutor(args.concurrency) if args.transport == "http" else None
+        http_futs = []
+
+        def post(kind, did, payload):
+            t0 = time.perf_counter()
+            r = client.post(f"/agent/telemetry/{kind}/{did}", json=payload)
+            r.raise_for_status()
+            with lat_lock:
+                lat.append(time.perf_counter() - t0)
+                done[0] += 1
+
+        sent = 0
+        per_sec: list = []
+        t_wall0 = time.perf_counter()
+        sec_mark, sec_count = t_wall0, 0
+        for t, p, payload in messages(fleet, args, rng, t_start):
+            if args.realtime:
+                ahead = t - (time.perf_counter() - t_wall0)
+                if ahead > 0:
+                    time.sleep(ahead)
+            topic = f"{args.mqtt_base}/telemetry/{p.kind}/{p.device_id}/measure"
+            if args.transport == "fake":
+                payload["_bench_sent"] = time.perf_counter()
+                M.mqtt._on_message(M.mqtt.client, None, _Msg(topic, json.dumps(payload).encode()))
+            elif args.transport == "broker":
+                payload["_bench_sent"] = time.perf_counter()  # same process, so perf_counter is comparable
+                publisher.publish(topic, json.dumps(payload))
+            else:
+                http_futs.append(pool.submit(post, p.kind, p.device_id, payload))
+                if len(http_futs) >= args.concurrency * 4:
+                    http_futs.pop(0).result()
+            sent += 1
+            sec_count += 1
+            now = time.perf_counter()
+            if now - sec_mark >= 1.0:
+                per_sec.append(sec_count / (now - sec_mark))
+                sec_mark, sec_count = now, 0
+
+        for f in http_futs:
+            f.result()
+        if pool:
+            pool.shutdown()
+        def shed():
+            return M.admission.shed["coalesced"] + M.admission.shed["dropped"] if M.admission else 0
+
+        deadline = time.time() + args.drain_timeout
+        while done[0] + shed() < sent and time.time() < deadline:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - t_wall0
+        if publisher is not None:
+            publisher.loop_stop()
+            publisher.disconnect()
+        rss1, mem = rss_bytes(), M.store.memory_report()
+
+        with Session(M.engine) as s:
+            alerts = s.exec(select(Alert.device_id, Alert.reason)
+                            .where(Alert.device_id.startswith("bench-"))).all()
+    idle_alerts = [d for d, r in alerts if r == "idle_detected"]
+    fired = set(idle_alerts)
+    tp = len(fired & expect)
+    other = {}
+    for _, r in alerts:
+        if r != "idle_detected":
+            other[r] = other.get(r, 0) + 1
+
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "git": git_rev(),
+        "python": sys.version.split()[0],
+        "messages": sent,
+        "processed": done[0],
+        "admission": M.admission.snapshot() if M.admission else None,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(done[0] / elapsed, 1) if elapsed else None,
+        "sustained_msg_s": round(float(np.median(per_sec)), 1) if per_sec else None,
+        "latency_ms": {"p50": pct(lat, 50), "p90": pct(lat, 90), "p99": pct(lat, 99), "max": pct(lat, 100)},
+        "alerts": {
+            "expected_idle": len(expect),
+            "fired_idle": len(fired),
+            "duplicates": len(idle_alerts) - len(fired),
+            "true_positive": tp,
+            "false_positive": sorted(fired - expect)[:20],
+            "missed": sorted(expect - fired)[:20],
+            "precision": round(tp / len(fired), 4) if fired else (1.0 if not expect else 0.0),
+            "recall": round(tp / len(expect), 4) if expect else 1.0,
+            "other": other,
+        },
+        "memory": {
+            "rss_growth_bytes": rss1 - rss0,
+            "rss_bytes": rss1,
+            "state_bytes": mem["total_bytes"],
+            "state_growth_bytes": mem["total_bytes"] - mem0,
+            "state_bytes_per_device": round(mem["total_bytes"] / max(1, mem["devices"]), 1),
+        },
+    }
+
+
+def compare(result: dict, baseline: dict):
+    def _get(d, path):
+        for k in path.split("."):
+            d = (d or {}).get(k)
+        return d
+
+    print(f"vs baseline ({baseline.get('git')}):")
+    for path, better in (("throughput_msg_s", 1), ("sustained_msg_s", 1), ("latency_ms.p50", -1),
+                         ("latency_ms.p99", -1), ("memory.state_bytes_per_device", -1),
+                         ("alerts.precision", 1), ("alerts.recall", 1)):
+        a, b = _get(baseline, path), _get(result, path)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a * 100 if a else 0.0
+        flag = "" if abs(change) < 5 else ("  better" if change * better > 0 else "  WORSE")
+        print(f"  {path:34s} {a:>12} -> {b:>12}  ({change:+.1f}%){flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--devices", type=int, default=200)
+    ap.add_argument("--duration", type=float, default=900.0, help="simulated seconds")
+    ap.add_argument("--rate", type=float, default=0.2, help="samples per second per device")
+    ap.add_argument("--transport", choices=("fake", "broker", "http"), default="fake")
+    ap.add_argument("--broker", default="localhost:1883")
+    ap.add_argument("--mqtt-base", default="spo-bench")
+    ap.add_argument("--concurrency", type=int, default=4, help="HTTP client threads")
+    ap.add_argument("--realtime", action="store_true", help="pace samples on the wall clock")
+    ap.add_argument("--admission", action="store_true", help="route MQTT messages through the admission lanes")
+    ap.add_argument("--idle-fraction", type=float, default=0.2)
+    ap.add_argument("--dip-fraction", type=float, default=0.2)
+    ap.add_argument("--idle-threshold", type=float, default=10.0)
+    ap.add_argument("--idle-duration", type=int, default=120)
+    ap.add_argument("--idle-window", type=float, default=30.0)
+    ap.add_argument("--anomalies", action="store_true", help="keep anomaly detection on")
+    ap.add_argument("--db-url", default=None, help="default: fresh SQLite file in a temp dir")
+    ap.add_argument("--drain-timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--compare", default=None)
+    args = ap.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
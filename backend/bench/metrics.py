@@ -0,0 +1,68 @@
+"""
+Per-sample cost of the ingest-path instrumentation.
+
+    cd backend && python -m bench.metrics [--samples 500000]
+
+Replays the metric calls one telemetry sample makes (5 stage timings, the sample
+counter, fleet and per-device ingest lag) and prints µs/sample, plus the cost of a
+/metrics scrape with 1000 devices' lag gauges.
+"""
+import argparse
+import time
+
+from app.services.metrics import (
+    REGISTRY, INGEST_SAMPLES, INGEST_LAG, DEVICE_INGEST_LAG, STAGE_DB_INSERT, STAGE_DB_COMMIT,
+    STAGE_ROLLING, STAGE_IDLE, STAGE_ANOMALY,
+)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--samples", type=int, default=500_000)
+    args = ap.parse_args()
+    n = args.samples
+    ingested = INGEST_SAMPLES.labels("dc")
+    lag = {}
+    ids = [f"dc-{j % 1000}" for j in range(n)]
+    perf = time.perf_counter
+
+    t0 = perf()
+    for j in range(n):
+        a = perf()
+        b = perf()
+        STAGE_DB_INSERT.observe(b - a)
+        STAGE_DB_COMMIT.since(b)
+        ingested.inc()
+        d = 0.25
+        INGEST_LAG.observe(d)
+        lag[ids[j]] = d
+        c = perf()
+        STAGE_ROLLING.since(c)
+        c = perf()
+        STAGE_IDLE.since(c)
+        c = perf()
+        STAGE_ANOMALY.since(c)
+    elapsed = perf() - t0
+
+    # Baseline: the same loop's perf_counter calls and dict write without metrics
+    t0 = perf()
+    for j in range(n):
+        a = perf()
+        b = perf()
+        lag[ids[j]] = 0.25
+        perf()
+        perf()
+        perf()
+    base = perf() - t0
+
+    DEVICE_INGEST_LAG.set_function(lambda: dict(lag))
+    t0 = perf()
+    text = REGISTRY.expose()
+    scrape = perf() - t0
+    print(f"{n} samples: {(elapsed - base) / n * 1e6:.2f} µs/sample instrumentation "
+          f"({elapsed / n * 1e6:.2f} µs incl. timers)")
+    print(f"scrape: {scrape * 1000:.1f} ms, {len(text.splitlines())} lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Replay a captured MQTT stream through the real ingest path in virtual time.
+
+    cd backend && python -m bench.replay capture.spocap [--speed 1|100|max] [--db-url ...] [--out result.json]
+
+Captures come from the app itself (MQTT_CAPTURE_PATH=... at startup, or POST/DELETE
+/debug/capture with X-Admin-Token at runtime, into MQTT_CAPTURE_DIR). Each message goes
+through MQTTBridge._on_message, so decode, DB writes, idle/anomaly detection and alerting
+all run for real, against a fresh SQLite DB unless --db-url is given. The app clock is swapped for a ReplayClock: at --speed N it
+runs N times faster than the wall clock; at "max" it jumps to each message's receive time.
+Deadlines (idle, offline, evict) fire from that clock, so a recorded day's offline
+alerts show up at the same virtual times without waiting a day.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+
+class _Msg:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+def _isolate_env(args, workdir: str):
+    """Settings are read at import: point the app at a scratch DB and keep it off the network."""
+    os.environ["DB_URL"] = args.db_url or f"sqlite:///{workdir}/replay.db"
+    os.environ["SNAPSHOT_PATH"] = f"{workdir}/state.npz"
+    os.environ["SNAPSHOT_INTERVAL_SEC"] = "0"
+    os.environ["SMTP_HOST"] = ""
+    os.environ["WEBHOOK_URLS"] = ""
+    os.environ["MQTT_CAPTURE_PATH"] = ""
+    os.environ["ADMISSION_CONTROL"] = "false"  # handle each message inline, so virtual time stays in step
+    import paho.mqtt.client as mqtt
+    mqtt.Client.connect = lambda *a, **k: 0
+    mqtt.Client.loop_forever = lambda *a, **k: None
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="spo-replay-")
+    _isolate_env(args, workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session, select
+    import app.main as M
+    from app.models import Alert
+    from app.services.capture import read_capture
+    from app.services.clock import ReplayClock
+
+    records = read_capture(args.capture)
+    first = next(records, None)
+    if first is None:
+        sys.exit(f"{args.capture}: no messages")
+    speed = None if args.speed == "max" else float(args.speed)
+    rc = ReplayClock(first[0], speed)
+    M.clock.use(rc)
+
+    n, last_ts = 0, first[0]
+    with TestClient(M.app):
+        if not M.app.state.readiness.wait(60):
+            sys.exit(f"app not ready: {M.app.state.readiness.report()}")
+        t0 = time.perf_counter()
+        on_message, client = M.mqtt._on_message, M.mqtt.client
+        for ts, topic, payload in _chain(first, records):
+            if speed is None:
+                rc.advance_to(ts)
+            else:
+                delay = rc.wall_delay(ts)
+                if delay > 0:
+                    time.sleep(delay)
+            on_message(client, None, _Msg(topic, payload))
+            M.scheduler.run_due()
+            n += 1
+            last_ts = ts
+        elapsed = time.perf_counter() - t0
+        # Let timers that fall due after the last message (e.g. offline) fire in virtual time
+        if args.tail > 0:
+            rc.advance_to(last_ts + args.tail)
+            M.scheduler.run_due()
+        with Session(M.engine) as s:
+            alerts = s.exec(select(Alert.device_id, Alert.reason, Alert.ts_open).order_by(Alert.id)).all()
+        stages = {}
+        for line in M.REGISTRY.get("spo_stage_seconds").expose().splitlines():
+            if line.startswith("spo_stage_seconds_sum") or line.startswith("spo_stage_seconds_count"):
+                name, value = line.rsplit(" ", 1)
+                stage = name.split('stage="')[1].rstrip('"}')
+                stages.setdefault(stage, {})["sum" if "_sum" in name else "count"] = float(value)
+    M.clock.use(None)
+
+    span = last_ts - first[0]
+    return {
+        "capture": args.capture,
+        "speed": args.speed,
+        "messages": n,
+        "elapsed_s": round(elapsed, 3),
+        "virtual_span_s": round(span, 3),
+        "speedup": round(span / elapsed, 1) if elapsed else None,
+        "msg_s": round(n / elapsed, 1) if elapsed else None,
+        "alerts": dict(Counter(r for _, r, _ in alerts)),
+        "alert_log": [{"device_id": d, "reason": r, "ts_open": t.isoformat()} for d, r, t in alerts[:args.max_alerts]],
+        "stage_avg_us": {k: round(v["sum"] / v["count"] * 1e6, 1) for k, v in stages.items() if v.get("count")},
+    }
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("capture")
+    ap.add_argument("--speed", default="max", help='"max", or a multiple of real time (1, 100, ...)')
+    ap.add_argument("--tail", type=float, default=0.0,
+                    help="advance virtual time this many seconds past the last message (fires pending timers)")
+    ap.add_argument("--db-url", default=None)
+    ap.add_argument("--max-alerts", type=int, default=50)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args()
+    if args.speed != "max":
+        float(args.speed)  # validate early
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()